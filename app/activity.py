@@ -0,0 +1,194 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.database import ACTIVITY_PERIODS, period_start
+
+logger = logging.getLogger(__name__)
+
+# (chat_id, user_id, date) -> [messages, words]
+ActivityKey = Tuple[int, int, date]
+# (chat_id, period, начало периода)
+BoardKey = Tuple[int, str, date]
+
+# Сколько лучших строк периода держать в памяти на чат
+LEADERBOARD_SIZE = 50
+
+
+class Leaderboard(NamedTuple):
+    # complete: в БД не больше LEADERBOARD_SIZE строк периода, значит в counts все участники
+    complete: bool
+    counts: Dict[int, List[int]]
+
+
+class ActivityBuffer:
+    """
+    Накопитель счётчиков активности в памяти.
+    Сообщения суммируются по (чат, пользователь, день) и пачками
+    сбрасываются в PostgreSQL одним INSERT ... ON CONFLICT DO UPDATE.
+    Для рейтингов за день, неделю и месяц держит в памяти топ чата:
+    он читается из сводных таблиц один раз и дальше правится сброшенными
+    пачками, а несброшенные счётчики досчитываются при чтении.
+    """
+
+    def __init__(self, db, flush_size: int = 500, max_boards: int = 5000):
+        self.db = db
+        self.flush_size = flush_size
+        self._pending: Dict[ActivityKey, List[int]] = {}
+        # Пачка, которая сейчас пишется в БД: учитывается в чтении до коммита
+        self._flushing: Dict[ActivityKey, List[int]] = {}
+        self._lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.max_boards = max_boards
+        self._boards: "OrderedDict[BoardKey, Leaderboard]" = OrderedDict()
+        self.board_hits = 0
+        self.board_misses = 0
+
+    def record(self, chat_id: int, user_id: int, day: date, words: int) -> None:
+        """Учитывает одно сообщение. При переполнении запускает фоновый сброс."""
+        counts = self._pending.get((chat_id, user_id, day))
+        if counts is None:
+            self._pending[(chat_id, user_id, day)] = [1, words]
+        else:
+            counts[0] += 1
+            counts[1] += words
+        if len(self._pending) >= self.flush_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self) -> int:
+        """Сбрасывает накопленные счётчики в БД. Возвращает число записанных строк."""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            self._flushing, self._pending = self._pending, {}
+            rows = [(chat_id, user_id, day, counts[0], counts[1])
+                    for (chat_id, user_id, day), counts in self._flushing.items()]
+            try:
+                await self.db.add_activity_batch(rows)
+            except Exception as e:
+                logger.error(f"Ошибка сброса активности, {len(rows)} записей возвращены в буфер: {e}")
+                for key, (messages, words) in self._flushing.items():
+                    counts = self._pending.setdefault(key, [0, 0])
+                    counts[0] += messages
+                    counts[1] += words
+                return 0
+            else:
+                self._apply_to_boards(self._flushing)
+            finally:
+                self._flushing = {}
+            logger.debug(f"Активность сброшена в БД: {len(rows)} записей")
+            return len(rows)
+
+    def _apply_to_boards(self, batch: Dict[ActivityKey, List[int]]) -> None:
+        """Прибавляет записанную пачку к рейтингам в памяти."""
+        for (chat_id, user_id, day), (messages, words) in batch.items():
+            for period in ACTIVITY_PERIODS:
+                key = (chat_id, period, period_start(period, day))
+                board = self._boards.get(key)
+                if board is None:
+                    continue
+                counts = board.counts.get(user_id)
+                if counts is not None:
+                    counts[0] += messages
+                    counts[1] += words
+                elif board.complete:
+                    board.counts[user_id] = [messages, words]
+                else:
+                    # Итог пользователя вне топа неизвестен: рейтинг перечитается из БД
+                    del self._boards[key]
+
+    def invalidate_chat(self, chat_id: int) -> None:
+        """Забывает рейтинги чата, например после загрузки его активности из файла."""
+        for key in [key for key in self._boards if key[0] == chat_id]:
+            del self._boards[key]
+
+    def pending_for(self, chat_id: int, period: str, start: date) -> Dict[int, Tuple[int, int]]:
+        """Несброшенные счётчики чата за период: {user_id: (messages, words)}."""
+        result: Dict[int, Tuple[int, int]] = {}
+        for source in (self._flushing, self._pending):
+            for (c_id, user_id, day), (messages, words) in source.items():
+                if c_id == chat_id and period_start(period, day) == start:
+                    prev_messages, prev_words = result.get(user_id, (0, 0))
+                    result[user_id] = (prev_messages + messages, prev_words + words)
+        return result
+
+    async def top(self, chat_id: int, period: str, day: date,
+                  limit: int = 10) -> List[Tuple[int, int, int]]:
+        """
+        Самые активные (user_id, messages, words) чата за период, в который
+        попадает day: записанное в БД плюс ещё не сброшенное.
+        """
+        start = period_start(period, day)
+        key = (chat_id, period, start)
+        stored: Dict[int, Tuple[int, int]] = {}
+        # Под замком сброс не может завершиться между чтением рейтинга и снимком буфера
+        async with self._lock:
+            board = self._boards.get(key)
+            if board is None:
+                self.board_misses += 1
+                rows = await self.db.top_activity(chat_id, period, start, LEADERBOARD_SIZE)
+                board = Leaderboard(len(rows) < LEADERBOARD_SIZE,
+                                    {user_id: [messages, words] for user_id, messages, words in rows})
+                self._boards[key] = board
+                while len(self._boards) > self.max_boards:
+                    self._boards.popitem(last=False)
+            else:
+                self.board_hits += 1
+                self._boards.move_to_end(key)
+            pending = self.pending_for(chat_id, period, start)
+            outsiders = [user_id for user_id in pending if user_id not in board.counts]
+            if outsiders and not board.complete:
+                stored = await self.db.users_activity(chat_id, period, start, outsiders)
+        totals = {user_id: (messages, words) for user_id, (messages, words) in board.counts.items()}
+        for user_id, (messages, words) in pending.items():
+            prev_messages, prev_words = totals.get(user_id) or stored.get(user_id, (0, 0))
+            totals[user_id] = (prev_messages + messages, prev_words + words)
+        ranked = sorted(totals.items(), key=lambda item: (-item[1][0], item[0]))
+        return [(user_id, messages, words) for user_id, (messages, words) in ranked[:min(limit, LEADERBOARD_SIZE)]]
+
+    async def top_talker(self, chat_id: int, day: date, period: str = "day") -> Optional[Tuple[int, int]]:
+        """Возвращает (user_id, message_count) самого активного пользователя за период."""
+        rows = await self.top(chat_id, period, day, limit=1)
+        if not rows:
+            return None
+        user_id, messages, _ = rows[0]
+        return user_id, messages
+
+    async def streak(self, chat_id: int, user_id: int, today: date) -> Tuple[int, int]:
+        """(текущая, лучшая) серия дней подряд с сообщениями, с учётом несброшенных дней."""
+        async with self._lock:
+            row = await self.db.get_streak(chat_id, user_id)
+            days = sorted({day for c_id, u_id, day in self._pending if c_id == chat_id and u_id == user_id})
+        last, current, best = row if row else (None, 0, 0)
+        for day in days:
+            if last is not None and day <= last:
+                continue
+            current = current + 1 if last is not None and day - last == timedelta(days=1) else 1
+            best = max(best, current)
+            last = day
+        # Серия прервана, если ни вчера, ни сегодня сообщений не было
+        if last is None or today - last > timedelta(days=1):
+            current = 0
+        return current, best
+
+    def snapshot(self) -> List[list]:
+        """Несброшенные счётчики для файла состояния: [chat_id, user_id, день, сообщения, слова]."""
+        return [[chat_id, user_id, day.isoformat(), messages, words]
+                for (chat_id, user_id, day), (messages, words) in self._pending.items()]
+
+    def restore(self, rows: List[list]) -> None:
+        """Возвращает в буфер счётчики из файла состояния, прибавляя их к уже накопленным."""
+        for chat_id, user_id, day, messages, words in rows:
+            counts = self._pending.setdefault((int(chat_id), int(user_id), date.fromisoformat(day)), [0, 0])
+            counts[0] += int(messages)
+            counts[1] += int(words)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending),
+            "boards": len(self._boards),
+            "board_hits": self.board_hits,
+            "board_misses": self.board_misses,
+        }
@@ -0,0 +1,80 @@
+import logging
+import random
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from telegram import User
+
+from app.members import display_name
+
+logger = logging.getLogger(__name__)
+
+
+class BeautyWinner(NamedTuple):
+    user_id: int
+    username: str
+
+
+def pick_winner(chat_id: int, day: date, candidates: List[User]) -> User:
+    """
+    Детерминированный выбор красавчика: генератор засевается чатом и датой,
+    поэтому все реплики при одном списке админов выбирают одного и того же.
+    """
+    ordered = sorted(candidates, key=lambda user: user.id)
+    return random.Random(f"{chat_id}:{day.isoformat()}").choice(ordered)
+
+
+class BeautyStore:
+    """
+    Красавчик дня: победители хранятся в таблице beauty_winners по (чат, дата)
+    и кэшируются в памяти до смены даты. Новый день начинается сам собой,
+    сбрасывать ничего не нужно, а перезапуск не приводит к новому розыгрышу.
+    """
+
+    def __init__(self, db, max_chats: int = 10000):
+        self.db = db
+        self.max_chats = max_chats
+        # chat_id -> (дата, победитель)
+        self._winners: "OrderedDict[int, Tuple[date, BeautyWinner]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, chat_id: int, day: date, winner: BeautyWinner) -> None:
+        self._winners[chat_id] = (day, winner)
+        self._winners.move_to_end(chat_id)
+        while len(self._winners) > self.max_chats:
+            self._winners.popitem(last=False)
+
+    async def get(self, chat_id: int, day: date) -> Optional[BeautyWinner]:
+        """Уже выбранный победитель дня или None."""
+        entry = self._winners.get(chat_id)
+        if entry is not None and entry[0] == day:
+            self.hits += 1
+            self._winners.move_to_end(chat_id)
+            return entry[1]
+        self.misses += 1
+        row = await self.db.get_beauty_winner(chat_id, day)
+        if row is None:
+            return None
+        winner = BeautyWinner(*row)
+        self._store(chat_id, day, winner)
+        return winner
+
+    async def choose(self, chat_id: int, day: date, candidates: List[User]) -> BeautyWinner:
+        """
+        Выбирает победителя дня среди candidates и сохраняет его. Если другая
+        реплика успела записать своего, возвращается записанный.
+        """
+        user = pick_winner(chat_id, day, candidates)
+        winner = BeautyWinner(*await self.db.claim_beauty_winner(chat_id, day, user.id, display_name(user)))
+        self._store(chat_id, day, winner)
+        logger.info(f"Красавчик дня {day} в чате {chat_id}: {winner.user_id}")
+        return winner
+
+    async def leaderboard(self, chat_id: int, limit: int = 10) -> List[Tuple[int, str, int]]:
+        """(user_id, имя, число побед) самых частых красавчиков чата."""
+        return await self.db.beauty_leaderboard(chat_id, limit)
+
+    def stats(self) -> Dict[str, int]:
+        return {"chats": len(self._winners), "hits": self.hits, "misses": self.misses}
@@ -5,3 +5,81 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Пул соединений с PostgreSQL
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# Сколько секунд при старте ждать, пока PostgreSQL начнёт принимать соединения
+DB_READY_TIMEOUT = float(os.getenv("DB_READY_TIMEOUT", "60"))
+
+# Буфер активности: сброс в БД по таймеру (секунды) или по числу накопленных записей
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "10"))
+ACTIVITY_FLUSH_SIZE = int(os.getenv("ACTIVITY_FLUSH_SIZE", "500"))
+# Сколько дней хранить дневные строки активности: старые уже учтены в недельных и месячных сводках
+ACTIVITY_RETENTION_DAYS = int(os.getenv("ACTIVITY_RETENTION_DAYS", "62"))
+
+# Сколько дней хранить ответы с файлами, которые Telegram перестал принимать, прежде чем удалить их
+MEDIA_DEAD_RETENTION_DAYS = int(os.getenv("MEDIA_DEAD_RETENTION_DAYS", "7"))
+
+# Кэш триггеров: сколько чатов держать в памяти и сколько секунд доверять записи
+TRIGGER_CACHE_MAX_CHATS = int(os.getenv("TRIGGER_CACHE_MAX_CHATS", "1000"))
+TRIGGER_CACHE_TTL = float(os.getenv("TRIGGER_CACHE_TTL", "3600"))
+
+# Кэш администраторов чатов (секунды)
+MEMBER_CACHE_TTL = float(os.getenv("MEMBER_CACHE_TTL", "600"))
+
+# Лимиты исходящих сообщений Telegram
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_GROUP_PER_MINUTE = float(os.getenv("SEND_GROUP_PER_MINUTE", "20"))
+SEND_PRIVATE_PER_SECOND = float(os.getenv("SEND_PRIVATE_PER_SECOND", "1"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+
+# Антифлуд триггеров: окно в секундах, ответов триггеров на чат и срабатываний на пользователя
+# за окно, пауза между срабатываниями одного триггера; 0 выключает ограничение. Чат меняет их через !flood
+FLOOD_WINDOW = int(os.getenv("FLOOD_WINDOW", "60"))
+FLOOD_CHAT_LIMIT = int(os.getenv("FLOOD_CHAT_LIMIT", "30"))
+FLOOD_USER_LIMIT = int(os.getenv("FLOOD_USER_LIMIT", "6"))
+TRIGGER_COOLDOWN = int(os.getenv("TRIGGER_COOLDOWN", "10"))
+
+# Часовой пояс чатов, не выставивших свой через !tz
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "UTC")
+
+# Приём апдейтов: "polling" или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес webhook без пути; пустой — webhook не регистрируется в Telegram (локальный replay)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+# Сколько апдейтов может ждать обработки, прежде чем webhook начнёт отвечать 503
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+# Сколько из них может принадлежать одному чату; 0 — без отдельного ограничения
+WEBHOOK_MAX_PENDING_PER_CHAT = int(os.getenv("WEBHOOK_MAX_PENDING_PER_CHAT", "100"))
+# Файл, куда webhook дописывает принятые апдейты для последующего replay
+WEBHOOK_RECORD_PATH = os.getenv("WEBHOOK_RECORD_PATH", "")
+
+# Сколько апдейтов обрабатывается одновременно (порядок внутри чата сохраняется)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+# Несколько воркеров: чаты делятся по abs(chat_id) % WORKER_COUNT, воркер с номером WORKER_INDEX
+# получает апдейты своих чатов от диспетчера (python -m app.dispatcher) на WORKER_PORT_BASE + номер
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_PORT_BASE = int(os.getenv("WORKER_PORT_BASE", "8500"))
+# Сколько апдейтов диспетчер держит в очереди одного воркера, прежде чем притормозить приём
+DISPATCHER_QUEUE_SIZE = int(os.getenv("DISPATCHER_QUEUE_SIZE", "1000"))
+
+# Логи: уровень и доля сообщений, чей текст пишется в DEBUG (0 — никогда, 1 — каждое)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_MESSAGE_SAMPLE_RATE = float(os.getenv("LOG_MESSAGE_SAMPLE_RATE", "0"))
+
+# Эндпоинт /metrics; у воркера с номером N порт METRICS_PORT + N, 0 — выключен
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Остановка по SIGTERM: сколько секунд дорабатывать апдейты и досылать очередь отправки
+# (меньше stop_grace_period контейнера) и куда сохранить буферы, если БД при остановке недоступна
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "20"))
+STATE_PATH = os.getenv("STATE_PATH", "pending_state.json")
@@ -1,51 +1,1113 @@
+import asyncio
+import json
 import logging
-import psycopg2
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+
+from app.metrics import TimedCursor
 
 logger = logging.getLogger(__name__)
 
+# Канал NOTIFY об изменениях триггеров чата
+TRIGGER_CHANNEL = "trigger_changes"
+
+
+class TriggerResponse(NamedTuple):
+    """
+    Один ответ триггера: тип сообщения и текст либо file_id.
+    media_id — file_unique_id файла в реестре media; у текста и старых ответов None.
+    """
+    type: str
+    content: str
+    media_id: Optional[str] = None
+
+
+class Trigger(NamedTuple):
+    """
+    Триггер чата в том виде, в каком его читают обработчики.
+    cum_weights — накопленные веса ответов для режима weighted,
+    cursor — сохранённая позиция режима round_robin.
+    """
+    keyword: str
+    responses: List[TriggerResponse]
+    match_mode: str = "exact"
+    response_mode: str = "all"
+    cursor: int = 0
+    cum_weights: Optional[List[int]] = None
+
+
+def _decode_list(raw: str) -> List[str]:
+    """Разбирает JSON-массив из старой TEXT-колонки, одиночные значения оборачивает в список."""
+    try:
+        value = json.loads(raw)
+        if isinstance(value, list):
+            return value
+    except Exception:
+        pass
+    return [raw]
+
+
+async def _split_trigger_responses(conn) -> None:
+    """
+    Переносит JSON-массивы ответов из triggers.response в trigger_responses.
+    Авторы из triggers.added_by раскладываются по ответам по порядку:
+    точного соответствия в старом формате нет, но список авторов триггера сохраняется.
+    """
+    async with conn.cursor(name="split_trigger_responses") as src:
+        await src.execute("SELECT id, type, response, added_by FROM triggers ORDER BY id")
+        async with conn.cursor() as dst:
+            while True:
+                rows = await src.fetchmany(1000)
+                if not rows:
+                    break
+                params = []
+                for trigger_id, resp_type, response, added_by in rows:
+                    authors = _decode_list(added_by) or [""]
+                    for idx, content in enumerate(_decode_list(response)):
+                        params.append((trigger_id, resp_type, content, authors[min(idx, len(authors) - 1)]))
+                await dst.executemany(
+                    "INSERT INTO trigger_responses (trigger_id, type, content, added_by) VALUES (%s, %s, %s, %s)",
+                    params
+                )
+
+
+# Периоды статистики активности: таблица и колонка начала периода
+ACTIVITY_PERIODS: Dict[str, Tuple[str, str]] = {
+    "day": ("activity", "date"),
+    "week": ("activity_weekly", "week_start"),
+    "month": ("activity_monthly", "month_start"),
+}
+
+
+def period_start(period: str, day: date) -> date:
+    """Первый день периода, в который попадает day (неделя начинается с понедельника)."""
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+# Ключ pg_advisory_xact_lock для миграций (произвольная константа проекта)
+MIGRATION_LOCK_ID = 7_215_044_001
+
+# Миграции схемы: (версия, описание, шаги). Шаг — SQL-строка или async-функция от соединения.
+# Только добавлять в конец, старые не менять.
+# Первые версии написаны через IF NOT EXISTS, чтобы лечь на базы, созданные до миграций.
+MIGRATIONS: List[Tuple[int, str, list]] = [
+    (1, "базовые таблицы", [
+        """
+        CREATE TABLE IF NOT EXISTS triggers (
+            id SERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            keyword TEXT NOT NULL,
+            type TEXT NOT NULL,
+            response TEXT NOT NULL,
+            added_by TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS birthdays (
+            id SERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            username TEXT NOT NULL,
+            birthday DATE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS activity (
+            id SERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            date DATE NOT NULL,
+            word_count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+    ]),
+    (2, "activity.message_count и уникальный ключ для upsert", [
+        "ALTER TABLE activity ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0",
+        "CREATE UNIQUE INDEX IF NOT EXISTS activity_chat_user_date_key ON activity (chat_id, user_id, date)",
+    ]),
+    (3, "triggers.match_mode", [
+        "ALTER TABLE triggers ADD COLUMN IF NOT EXISTS match_mode TEXT NOT NULL DEFAULT 'exact'",
+    ]),
+    (4, "цитаты чатов", [
+        """
+        CREATE TABLE IF NOT EXISTS quotes (
+            id SERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            text TEXT NOT NULL,
+            added_by TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS quotes_chat_id_idx ON quotes (chat_id)",
+    ]),
+    (5, "индексы дней рождения и часовые пояса чатов", [
+        "ALTER TABLE birthdays ADD COLUMN IF NOT EXISTS birth_month SMALLINT "
+        "GENERATED ALWAYS AS (EXTRACT(MONTH FROM birthday)::smallint) STORED",
+        "ALTER TABLE birthdays ADD COLUMN IF NOT EXISTS birth_day SMALLINT "
+        "GENERATED ALWAYS AS (EXTRACT(DAY FROM birthday)::smallint) STORED",
+        # Старые версии могли записать дубликаты: оставляем последнюю запись
+        "DELETE FROM birthdays a USING birthdays b "
+        "WHERE a.chat_id = b.chat_id AND a.user_id = b.user_id AND a.id < b.id",
+        "CREATE UNIQUE INDEX IF NOT EXISTS birthdays_chat_user_key ON birthdays (chat_id, user_id)",
+        "CREATE INDEX IF NOT EXISTS birthdays_month_day_idx ON birthdays (birth_month, birth_day)",
+        """
+        CREATE TABLE IF NOT EXISTS chat_settings (
+            chat_id BIGINT PRIMARY KEY,
+            timezone TEXT NOT NULL
+        )
+        """,
+    ]),
+    (6, "индексы горячих запросов триггеров и активности", [
+        "DELETE FROM triggers a USING triggers b "
+        "WHERE a.chat_id = b.chat_id AND a.keyword = b.keyword AND a.id < b.id",
+        "CREATE UNIQUE INDEX IF NOT EXISTS triggers_chat_keyword_key ON triggers (chat_id, keyword)",
+        # Покрывающий индекс: !talker читает день чата без обращения к таблице
+        "CREATE INDEX IF NOT EXISTS activity_chat_date_idx ON activity (chat_id, date) "
+        "INCLUDE (user_id, message_count, word_count)",
+    ]),
+    (7, "ответы триггеров в отдельной таблице", [
+        """
+        CREATE TABLE trigger_responses (
+            id BIGSERIAL PRIMARY KEY,
+            trigger_id INTEGER NOT NULL REFERENCES triggers (id) ON DELETE CASCADE,
+            type TEXT NOT NULL,
+            content TEXT NOT NULL,
+            added_by TEXT NOT NULL
+        )
+        """,
+        _split_trigger_responses,
+        "CREATE INDEX trigger_responses_trigger_idx ON trigger_responses (trigger_id, id)",
+        "ALTER TABLE triggers DROP COLUMN type, DROP COLUMN response, DROP COLUMN added_by",
+    ]),
+    (8, "недельные и месячные сводки активности, серии дней", [
+        """
+        CREATE TABLE activity_weekly (
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            week_start DATE NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            word_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, week_start, user_id)
+        )
+        """,
+        """
+        CREATE TABLE activity_monthly (
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            month_start DATE NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            word_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, month_start, user_id)
+        )
+        """,
+        """
+        CREATE TABLE activity_streaks (
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            last_date DATE NOT NULL,
+            current_streak INTEGER NOT NULL,
+            best_streak INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, user_id)
+        )
+        """,
+        "INSERT INTO activity_weekly (chat_id, user_id, week_start, message_count, word_count) "
+        "SELECT chat_id, user_id, date_trunc('week', date)::date, SUM(message_count), SUM(word_count) "
+        "FROM activity GROUP BY 1, 2, 3",
+        "INSERT INTO activity_monthly (chat_id, user_id, month_start, message_count, word_count) "
+        "SELECT chat_id, user_id, date_trunc('month', date)::date, SUM(message_count), SUM(word_count) "
+        "FROM activity GROUP BY 1, 2, 3",
+        # Серии подряд идущих дней: у дней одной серии date - номер строки одинаков
+        """
+        INSERT INTO activity_streaks (chat_id, user_id, last_date, current_streak, best_streak)
+        SELECT chat_id, user_id, MAX(run_end), (array_agg(run_length ORDER BY run_end DESC))[1], MAX(run_length)
+        FROM (
+            SELECT chat_id, user_id, MAX(date) AS run_end, COUNT(*) AS run_length
+            FROM (
+                SELECT chat_id, user_id, date,
+                       date - (ROW_NUMBER() OVER (PARTITION BY chat_id, user_id ORDER BY date))::int AS run
+                FROM activity
+            ) days
+            GROUP BY chat_id, user_id, run
+        ) runs
+        GROUP BY chat_id, user_id
+        """,
+        "CREATE INDEX activity_date_idx ON activity (date)",
+    ]),
+    (9, "красавчики дня по (chat_id, date)", [
+        """
+        CREATE TABLE beauty_winners (
+            chat_id BIGINT NOT NULL,
+            date DATE NOT NULL,
+            user_id BIGINT NOT NULL,
+            username TEXT NOT NULL,
+            PRIMARY KEY (chat_id, date)
+        )
+        """,
+    ]),
+    (10, "последние выполненные слоты периодических задач", [
+        """
+        CREATE TABLE job_runs (
+            name TEXT PRIMARY KEY,
+            slot TEXT NOT NULL,
+            instance TEXT NOT NULL,
+            finished_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+    ]),
+    (11, "реестр медиафайлов по file_unique_id", [
+        """
+        CREATE TABLE media (
+            file_unique_id TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            type TEXT NOT NULL,
+            last_sent_at TIMESTAMPTZ,
+            dead_at TIMESTAMPTZ
+        )
+        """,
+        "CREATE INDEX media_file_id_idx ON media (file_id)",
+        "ALTER TABLE trigger_responses ADD COLUMN media_id TEXT REFERENCES media (file_unique_id)",
+        # Один и тот же файл в ответах одного триггера хранится один раз
+        "CREATE UNIQUE INDEX trigger_responses_media_key ON trigger_responses (trigger_id, media_id) "
+        "WHERE media_id IS NOT NULL",
+    ]),
+    (12, "антифлуд в настройках чата", [
+        # Строка настроек теперь может хранить только лимиты, без часового пояса
+        "ALTER TABLE chat_settings ALTER COLUMN timezone DROP NOT NULL, "
+        "ADD COLUMN flood_window INTEGER, ADD COLUMN flood_chat_limit INTEGER, "
+        "ADD COLUMN flood_user_limit INTEGER, ADD COLUMN trigger_cooldown INTEGER",
+    ]),
+    (13, "режимы выбора ответа триггера", [
+        "ALTER TABLE triggers ADD COLUMN response_mode TEXT NOT NULL DEFAULT 'all', "
+        "ADD COLUMN rr_cursor INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE trigger_responses ADD COLUMN weight INTEGER NOT NULL DEFAULT 1",
+    ]),
+]
+
+# Запросы обработчиков; используются и методами ниже, и проверкой индексов
+# Файл из реестра отправляется по последнему известному file_id, мёртвые файлы пропускаются
+SQL_FETCH_TRIGGERS = (
+    "SELECT t.keyword, t.match_mode, t.response_mode, t.rr_cursor, r.type, COALESCE(m.file_id, r.content), "
+    "r.media_id, r.weight FROM triggers t "
+    "JOIN trigger_responses r ON r.trigger_id = t.id "
+    "LEFT JOIN media m ON m.file_unique_id = r.media_id "
+    "WHERE t.chat_id = %s AND m.dead_at IS NULL ORDER BY t.id, r.id"
+)
+SQL_FETCH_TRIGGERS_MANY = (
+    "SELECT t.chat_id, t.keyword, t.match_mode, t.response_mode, t.rr_cursor, r.type, "
+    "COALESCE(m.file_id, r.content), r.media_id, r.weight FROM triggers t "
+    "JOIN trigger_responses r ON r.trigger_id = t.id "
+    "LEFT JOIN media m ON m.file_unique_id = r.media_id "
+    "WHERE t.chat_id = ANY(%s) AND m.dead_at IS NULL ORDER BY t.chat_id, t.id, r.id"
+)
+# Повторно присланный файл получает свежий file_id и снова считается живым
+SQL_UPSERT_MEDIA = (
+    "INSERT INTO media (file_unique_id, file_id, type) VALUES (%s, %s, %s) "
+    "ON CONFLICT (file_unique_id) DO UPDATE SET file_id = EXCLUDED.file_id, dead_at = NULL"
+)
+# Новый триггер получает режим 'exact'; у существующего режим меняется, только если он передан.
+# xmax = 0 только у только что вставленной строки.
+SQL_UPSERT_TRIGGER = (
+    "INSERT INTO triggers (chat_id, keyword, match_mode) VALUES (%s, %s, COALESCE(%s, 'exact')) "
+    "ON CONFLICT (chat_id, keyword) DO UPDATE SET match_mode = COALESCE(%s, triggers.match_mode) "
+    "RETURNING id, (xmax = 0)"
+)
+SQL_DELETE_TRIGGER = "DELETE FROM triggers WHERE chat_id = %s AND keyword = %s"
+SQL_LIST_TRIGGERS = (
+    "SELECT t.keyword, array_agg(r.added_by ORDER BY r.id) FROM triggers t "
+    "JOIN trigger_responses r ON r.trigger_id = t.id "
+    "WHERE t.chat_id = %s GROUP BY t.id, t.keyword ORDER BY t.id"
+)
+SQL_ITER_BIRTHDAYS = (
+    "SELECT b.chat_id, b.user_id, b.username FROM birthdays b "
+    "LEFT JOIN chat_settings s ON s.chat_id = b.chat_id "
+    "WHERE b.birth_month = %s AND b.birth_day = ANY(%s) "
+    "AND COALESCE(s.timezone, %s) = %s AND abs(b.chat_id) %% %s = %s"
+)
+SQL_TOP_ACTIVITY = {
+    period: f"SELECT user_id, message_count, word_count FROM {table} "
+            f"WHERE chat_id = %s AND {column} = %s ORDER BY message_count DESC, user_id LIMIT %s"
+    for period, (table, column) in ACTIVITY_PERIODS.items()
+}
+SQL_USERS_ACTIVITY = {
+    period: f"SELECT user_id, message_count, word_count FROM {table} "
+            f"WHERE chat_id = %s AND {column} = %s AND user_id = ANY(%s)"
+    for period, (table, column) in ACTIVITY_PERIODS.items()
+}
+# Серия продолжается, если пользователь писал вчера; повторный день её не меняет
+SQL_UPSERT_STREAKS = (
+    "INSERT INTO activity_streaks AS s (chat_id, user_id, last_date, current_streak, best_streak) "
+    "VALUES {values} "
+    "ON CONFLICT (chat_id, user_id) DO UPDATE SET "
+    "current_streak = CASE WHEN s.last_date >= EXCLUDED.last_date THEN s.current_streak "
+    "WHEN s.last_date = EXCLUDED.last_date - 1 THEN s.current_streak + 1 ELSE 1 END, "
+    "best_streak = GREATEST(s.best_streak, CASE WHEN s.last_date >= EXCLUDED.last_date THEN s.current_streak "
+    "WHEN s.last_date = EXCLUDED.last_date - 1 THEN s.current_streak + 1 ELSE 1 END), "
+    "last_date = GREATEST(s.last_date, EXCLUDED.last_date)"
+)
+SQL_GET_BEAUTY = "SELECT user_id, username FROM beauty_winners WHERE chat_id = %s AND date = %s"
+# Победитель уже есть — пустой DO UPDATE возвращает записанную строку
+SQL_CLAIM_BEAUTY = (
+    "INSERT INTO beauty_winners (chat_id, date, user_id, username) VALUES (%s, %s, %s, %s) "
+    "ON CONFLICT (chat_id, date) DO UPDATE SET chat_id = EXCLUDED.chat_id "
+    "RETURNING user_id, username"
+)
+SQL_BEAUTY_LEADERBOARD = (
+    "SELECT user_id, (array_agg(username ORDER BY date DESC))[1], COUNT(*) FROM beauty_winners "
+    "WHERE chat_id = %s GROUP BY user_id ORDER BY COUNT(*) DESC, MAX(date) DESC LIMIT %s"
+)
+SQL_FETCH_QUOTES = "SELECT text FROM quotes WHERE chat_id = %s ORDER BY id"
+
+# Выгрузка чата: (вид записи, запрос по chat_id) в порядке записи в файл.
+# Ответы одного триггера идут подряд, чтобы их можно было собрать в одну запись.
+EXPORT_QUERIES: List[Tuple[str, str]] = [
+    ("settings", "SELECT timezone, flood_window, flood_chat_limit, flood_user_limit, trigger_cooldown "
+                 "FROM chat_settings WHERE chat_id = %s"),
+    ("trigger", "SELECT t.keyword, t.match_mode, t.response_mode, r.type, COALESCE(m.file_id, r.content), "
+                "r.added_by, r.media_id, r.weight FROM triggers t JOIN trigger_responses r ON r.trigger_id = t.id "
+                "LEFT JOIN media m ON m.file_unique_id = r.media_id "
+                "WHERE t.chat_id = %s AND m.dead_at IS NULL ORDER BY t.id, r.id"),
+    ("birthday", "SELECT user_id, username, birthday FROM birthdays WHERE chat_id = %s ORDER BY user_id"),
+    ("quote", "SELECT text, added_by FROM quotes WHERE chat_id = %s ORDER BY id"),
+    *[("activity", f"SELECT '{period}', {column}, user_id, message_count, word_count FROM {table} "
+                   f"WHERE chat_id = %s ORDER BY {column}, user_id")
+      for period, (table, column) in ACTIVITY_PERIODS.items()],
+    ("streak", "SELECT user_id, last_date, current_streak, best_streak FROM activity_streaks "
+               "WHERE chat_id = %s ORDER BY user_id"),
+]
+# Загрузка: вид записи -> (колонки временной таблицы import_rows, запросы переноса из неё).
+# Строки пишутся в import_rows через COPY, дальше переносятся с upsert, поэтому повторная
+# загрузка того же файла ничего не дублирует. DISTINCT ON убирает повторы ключа внутри пачки.
+IMPORT_SPECS: Dict[str, Tuple[str, List[str]]] = {
+    "settings": ("timezone TEXT, flood_window INTEGER, flood_chat_limit INTEGER, flood_user_limit INTEGER, "
+                 "trigger_cooldown INTEGER", [
+        "INSERT INTO chat_settings (chat_id, timezone, flood_window, flood_chat_limit, flood_user_limit, "
+        "trigger_cooldown) "
+        "SELECT %(chat_id)s, timezone, flood_window, flood_chat_limit, flood_user_limit, trigger_cooldown "
+        "FROM import_rows LIMIT 1 "
+        "ON CONFLICT (chat_id) DO UPDATE SET timezone = EXCLUDED.timezone, flood_window = EXCLUDED.flood_window, "
+        "flood_chat_limit = EXCLUDED.flood_chat_limit, flood_user_limit = EXCLUDED.flood_user_limit, "
+        "trigger_cooldown = EXCLUDED.trigger_cooldown",
+    ]),
+    # Триггер из файла заменяет ответы одноимённого триггера чата целиком
+    "trigger": ("keyword TEXT, match_mode TEXT, response_mode TEXT, type TEXT, content TEXT, added_by TEXT, "
+                "media_id TEXT, weight INTEGER, position INTEGER", [
+        "INSERT INTO triggers (chat_id, keyword, match_mode, response_mode) "
+        "SELECT DISTINCT ON (keyword) %(chat_id)s, keyword, match_mode, response_mode FROM import_rows "
+        "ORDER BY keyword, position "
+        "ON CONFLICT (chat_id, keyword) DO UPDATE SET match_mode = EXCLUDED.match_mode, "
+        "response_mode = EXCLUDED.response_mode, rr_cursor = 0",
+        "INSERT INTO media (file_unique_id, file_id, type) "
+        "SELECT DISTINCT ON (media_id) media_id, content, type FROM import_rows WHERE media_id IS NOT NULL "
+        "ORDER BY media_id, position "
+        "ON CONFLICT (file_unique_id) DO UPDATE SET file_id = EXCLUDED.file_id, dead_at = NULL",
+        "DELETE FROM trigger_responses r USING triggers t "
+        "WHERE r.trigger_id = t.id AND t.chat_id = %(chat_id)s AND t.keyword IN (SELECT keyword FROM import_rows)",
+        "INSERT INTO trigger_responses (trigger_id, type, content, added_by, media_id, weight) "
+        "SELECT t.id, i.type, i.content, i.added_by, i.media_id, i.weight FROM import_rows i "
+        "JOIN triggers t ON t.chat_id = %(chat_id)s AND t.keyword = i.keyword ORDER BY i.position "
+        "ON CONFLICT (trigger_id, media_id) WHERE media_id IS NOT NULL DO NOTHING",
+    ]),
+    "birthday": ("user_id BIGINT, username TEXT, birthday DATE", [
+        "INSERT INTO birthdays (chat_id, user_id, username, birthday) "
+        "SELECT DISTINCT ON (user_id) %(chat_id)s, user_id, username, birthday FROM import_rows "
+        "ON CONFLICT (chat_id, user_id) DO UPDATE SET username = EXCLUDED.username, birthday = EXCLUDED.birthday",
+    ]),
+    # У цитат нет ключа: уже существующий в чате текст не добавляется второй раз
+    "quote": ("text TEXT, added_by TEXT", [
+        "INSERT INTO quotes (chat_id, text, added_by) "
+        "SELECT DISTINCT ON (i.text) %(chat_id)s, i.text, i.added_by FROM import_rows i "
+        "WHERE NOT EXISTS (SELECT 1 FROM quotes q WHERE q.chat_id = %(chat_id)s AND q.text = i.text)",
+    ]),
+    "activity": ("period TEXT, start DATE, user_id BIGINT, message_count INTEGER, word_count INTEGER", [
+        f"INSERT INTO {table} (chat_id, user_id, {column}, message_count, word_count) "
+        f"SELECT DISTINCT ON (start, user_id) %(chat_id)s, user_id, start, message_count, word_count "
+        f"FROM import_rows WHERE period = '{period}' "
+        f"ON CONFLICT (chat_id, user_id, {column}) DO UPDATE SET "
+        f"message_count = EXCLUDED.message_count, word_count = EXCLUDED.word_count"
+        for period, (table, column) in ACTIVITY_PERIODS.items()
+    ]),
+    "streak": ("user_id BIGINT, last_date DATE, current_streak INTEGER, best_streak INTEGER", [
+        "INSERT INTO activity_streaks (chat_id, user_id, last_date, current_streak, best_streak) "
+        "SELECT DISTINCT ON (user_id) %(chat_id)s, user_id, last_date, current_streak, best_streak FROM import_rows "
+        "ON CONFLICT (chat_id, user_id) DO UPDATE SET last_date = EXCLUDED.last_date, "
+        "current_streak = EXCLUDED.current_streak, best_streak = EXCLUDED.best_streak",
+    ]),
+}
+
+HOT_QUERIES: Dict[str, Tuple[str, tuple]] = {
+    "fetch_triggers": (SQL_FETCH_TRIGGERS, (0,)),
+    "fetch_triggers_many": (SQL_FETCH_TRIGGERS_MANY, ([0],)),
+    "upsert_trigger": (SQL_UPSERT_TRIGGER, (0, "", None, None)),
+    "delete_trigger": (SQL_DELETE_TRIGGER, (0, "")),
+    "list_triggers": (SQL_LIST_TRIGGERS, (0,)),
+    "iter_birthdays": (SQL_ITER_BIRTHDAYS, (1, [1], "UTC", "UTC", 1, 0)),
+    **{f"top_activity_{period}": (sql, (0, date(2000, 1, 1), 10)) for period, sql in SQL_TOP_ACTIVITY.items()},
+    **{f"users_activity_{period}": (sql, (0, date(2000, 1, 1), [0])) for period, sql in SQL_USERS_ACTIVITY.items()},
+    "get_beauty": (SQL_GET_BEAUTY, (0, date(2000, 1, 1))),
+    "beauty_leaderboard": (SQL_BEAUTY_LEADERBOARD, (0, 10)),
+    "fetch_quotes": (SQL_FETCH_QUOTES, (0,)),
+}
+
+
+def _add_trigger_row(triggers: Dict[str, Trigger], row: tuple) -> None:
+    keyword, match_mode, response_mode, cursor, resp_type, content, media_id, weight = row
+    trigger = triggers.get(keyword)
+    if trigger is None:
+        trigger = triggers[keyword] = Trigger(keyword, [], match_mode, response_mode, cursor, [])
+    trigger.responses.append(TriggerResponse(resp_type, content, media_id))
+    trigger.cum_weights.append((trigger.cum_weights[-1] if trigger.cum_weights else 0) + max(weight, 0))
+
+
+def _plan_nodes(plan: dict) -> Iterator[str]:
+    """Обходит JSON-план EXPLAIN и отдаёт узлы вида 'Index Scan on triggers'."""
+    relation = plan.get("Relation Name")
+    yield f"{plan['Node Type']} on {relation}" if relation else plan["Node Type"]
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+class PoolMetrics:
+    """
+    Метрики пула соединений: время ожидания, занятые соединения, ошибки выдачи.
+    """
+
+    def __init__(self):
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.in_use = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_checkout(self, waited: float) -> None:
+        self.checkouts += 1
+        self.in_use += 1
+        self.wait_total += waited
+        if waited > self.wait_max:
+            self.wait_max = waited
+
+    def snapshot(self) -> Dict[str, float]:
+        avg_wait = self.wait_total / self.checkouts if self.checkouts else 0.0
+        return {
+            "checkouts": self.checkouts,
+            "checkout_failures": self.checkout_failures,
+            "in_use": self.in_use,
+            "wait_avg_ms": avg_wait * 1000,
+            "wait_max_ms": self.wait_max * 1000,
+        }
+
+
 class Database:
-    def __init__(self, db_url):
+    """
+    Асинхронный слой доступа к данным поверх пула соединений psycopg3.
+    Обработчики работают только через методы-репозитории ниже.
+    """
+
+    def __init__(self, db_url, min_size: int = 1, max_size: int = 10, timeout: float = 5.0):
         self.db_url = db_url
+        # Метка процесса в NOTIFY, чтобы реплика не обрабатывала свои же уведомления
+        self.instance_id = uuid.uuid4().hex[:12]
+        self.metrics = PoolMetrics()
+        self.pool = AsyncConnectionPool(
+            db_url,
+            min_size=min_size,
+            max_size=max_size,
+            timeout=timeout,
+            open=False,
+            check=AsyncConnectionPool.check_connection,
+            # Время каждого запроса попадает в гистограмму bot_db_query_seconds
+            kwargs={"cursor_factory": TimedCursor},
+        )
+
+    async def wait_until_ready(self, timeout: float = 60.0, initial_delay: float = 0.1,
+                               max_delay: float = 5.0) -> int:
+        """
+        Ждёт, пока PostgreSQL начнёт принимать соединения: пробует подключиться
+        с экспоненциально растущей паузой. Уже поднятая БД отвечает с первой
+        попытки. Возвращает число попыток, по истечении timeout бросает ошибку.
+        """
+        deadline = time.monotonic() + timeout
+        delay = initial_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                conn = await psycopg.AsyncConnection.connect(self.db_url, connect_timeout=max(1, int(max_delay)))
+                try:
+                    await conn.execute("SELECT 1")
+                finally:
+                    await conn.close()
+                return attempt
+            except psycopg.OperationalError as e:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise
+                logger.info(f"БД недоступна (попытка {attempt}): {e}; повтор через {delay:.1f} с")
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, max_delay)
+
+    async def open(self) -> None:
+        await self.pool.open(wait=True)
+        logger.info(f"Пул соединений открыт (min={self.pool.min_size}, max={self.pool.max_size})")
+
+    async def close(self) -> None:
+        await self.pool.close()
+        logger.info("Пул соединений закрыт")
 
-    def get_connection(self):
+    @asynccontextmanager
+    async def connection(self):
+        """Выдаёт соединение из пула внутри транзакции и учитывает метрики."""
+        started = time.monotonic()
         try:
-            return psycopg2.connect(self.db_url)
+            conn = await self.pool.getconn()
         except Exception as e:
+            self.metrics.checkout_failures += 1
             logger.error(f"Ошибка подключения к базе данных: {e}")
             raise
+        self.metrics.record_checkout(time.monotonic() - started)
+        try:
+            async with conn.transaction():
+                yield conn
+        finally:
+            self.metrics.in_use -= 1
+            await self.pool.putconn(conn)
+
+    def pool_stats(self) -> Dict[str, float]:
+        stats = self.metrics.snapshot()
+        pool_stats = self.pool.get_stats()
+        stats["pool_size"] = pool_stats.get("pool_size", 0)
+        stats["pool_available"] = pool_stats.get("pool_available", 0)
+        stats["requests_waiting"] = pool_stats.get("requests_waiting", 0)
+        return stats
+
+    async def notifications(self, channel: str) -> AsyncIterator[Tuple[str, int]]:
+        """
+        Слушает канал LISTEN на отдельном соединении вне пула
+        и отдаёт пары (instance_id отправителя, chat_id).
+        """
+        conn = await psycopg.AsyncConnection.connect(self.db_url, autocommit=True)
+        try:
+            await conn.execute(f"LISTEN {channel}")
+            async for notify in conn.notifies():
+                origin, _, chat_id = notify.payload.partition(":")
+                yield origin, int(chat_id)
+        finally:
+            await conn.close()
+
+    async def _notify(self, conn, channel: str, chat_id: int) -> None:
+        # pg_notify внутри транзакции доставляется только после COMMIT
+        await conn.execute("SELECT pg_notify(%s, %s)", (channel, f"{self.instance_id}:{chat_id}"))
+
+    # -----------------------------
+    #   МИГРАЦИИ
+    # -----------------------------
+    async def migrate(self) -> int:
+        """
+        Применяет недостающие миграции в одной транзакции под advisory-блокировкой,
+        чтобы одновременно стартующие реплики не гонялись друг с другом.
+        Возвращает текущую версию схемы.
+        """
+        async with self.connection() as conn:
+            await conn.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                );
+            """)
+            cur = await conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            (current,) = await cur.fetchone()
+            for version, description, statements in MIGRATIONS:
+                if version <= current:
+                    continue
+                for statement in statements:
+                    if callable(statement):
+                        await statement(conn)
+                    else:
+                        await conn.execute(statement)
+                await conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)", (version, description)
+                )
+                logger.info(f"Применена миграция {version}: {description}")
+                current = version
+        logger.info(f"Версия схемы БД: {current}")
+        return current
+
+    @asynccontextmanager
+    async def job_lock(self, name: str, slot: str) -> AsyncIterator[bool]:
+        """
+        Выборы исполнителя периодической задачи между процессами.
+        Отдаёт True, если этот процесс занял слот (например, дату) задачи:
+        слот занимается одним коротким запросом, и из одновременных претендентов
+        его получает ровно один. Тело блока выполняется вне транзакции и не
+        держит соединение из пула. Если тело упало с ошибкой, слот освобождается,
+        и задачу подхватит следующий запуск.
+        """
+        async with self.connection() as conn:
+            cur = await conn.execute(
+                "INSERT INTO job_runs (name, slot, instance) VALUES (%s, %s, %s) "
+                "ON CONFLICT (name) DO UPDATE SET slot = EXCLUDED.slot, instance = EXCLUDED.instance, "
+                "finished_at = now() WHERE job_runs.slot <> EXCLUDED.slot RETURNING 1",
+                (name, slot, self.instance_id)
+            )
+            claimed = await cur.fetchone() is not None
+        try:
+            yield claimed
+        except Exception:
+            if claimed:
+                try:
+                    async with self.connection() as conn:
+                        await conn.execute(
+                            "DELETE FROM job_runs WHERE name = %s AND slot = %s AND instance = %s",
+                            (name, slot, self.instance_id)
+                        )
+                except Exception as e:
+                    logger.error(f"Не удалось освободить слот {slot} задачи {name}: {e}")
+            raise
+        if claimed:
+            async with self.connection() as conn:
+                await conn.execute(
+                    "UPDATE job_runs SET finished_at = now() WHERE name = %s AND slot = %s AND instance = %s",
+                    (name, slot, self.instance_id)
+                )
+
+    async def explain_hot_queries(self) -> List[Tuple[str, bool, List[str]]]:
+        """
+        Прогоняет EXPLAIN для запросов обработчиков с выключенным seq scan.
+        Если индекс подходит, планировщик его выберет; Seq Scan в плане значит,
+        что индекса нет. Возвращает (имя запроса, идёт ли по индексу, узлы плана).
+        """
+        results = []
+        async with self.connection() as conn:
+            await conn.execute("SET LOCAL enable_seqscan = off")
+            # Параметры подставляются на клиенте: так EXPLAIN видит те же литералы, что и план запроса
+            cur = psycopg.AsyncClientCursor(conn)
+            for name, (sql, params) in HOT_QUERIES.items():
+                await cur.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+                (plan,) = await cur.fetchone()
+                nodes = list(_plan_nodes(plan[0]["Plan"]))
+                uses_index = not any(node.startswith("Seq Scan") for node in nodes)
+                results.append((name, uses_index, nodes))
+        return results
+
+    # -----------------------------
+    #   ТРИГГЕРЫ
+    # -----------------------------
+    async def fetch_triggers(self, chat_id: int) -> Dict[str, Trigger]:
+        """Возвращает триггеры чата в виде {keyword: Trigger}."""
+        async with self.connection() as conn:
+            cur = await conn.execute(SQL_FETCH_TRIGGERS, (chat_id,))
+            rows = await cur.fetchall()
+        triggers: Dict[str, Trigger] = {}
+        for row in rows:
+            _add_trigger_row(triggers, row)
+        return triggers
+
+    async def fetch_triggers_many(self, chat_ids: List[int]) -> Dict[int, Dict[str, Trigger]]:
+        """Триггеры нескольких чатов одним запросом: {chat_id: {keyword: Trigger}}; чаты без триггеров пусты."""
+        async with self.connection() as conn:
+            cur = await conn.execute(SQL_FETCH_TRIGGERS_MANY, (chat_ids,))
+            rows = await cur.fetchall()
+        result: Dict[int, Dict[str, Trigger]] = {chat_id: {} for chat_id in chat_ids}
+        for chat_id, *row in rows:
+            _add_trigger_row(result[chat_id], row)
+        return result
+
+    async def active_chats(self, since: date, limit: int, shard: Tuple[int, int] = (0, 1)) -> List[int]:
+        """Самые активные чаты шарда с недели since: для прогрева кэшей при старте."""
+        async with self.connection() as conn:
+            cur = await conn.execute(
+                "SELECT chat_id FROM activity_weekly WHERE week_start >= %s AND abs(chat_id) %% %s = %s "
+                "GROUP BY chat_id ORDER BY SUM(message_count) DESC LIMIT %s",
+                (since, shard[1], shard[0], limit)
+            )
+            return [chat_id for (chat_id,) in await cur.fetchall()]
+
+    async def add_trigger_response(self, chat_id: int, keyword: str, content_type: str,
+                                   content: str, username: str, match_mode: Optional[str] = None,
+                                   media_id: Optional[str] = None) -> bool:
+        """
+        Добавляет ответ к триггеру одной вставкой строки, без перезаписи остальных.
+        Возвращает True, если триггер создан впервые.
+        match_mode=None оставляет режим существующего триггера, новый получает 'exact'.
+        Для файла media_id — его file_unique_id, content — file_id: файл попадает в реестр
+        media, а повтор того же файла в ответах триггера не добавляется.
+        """
+        async with self.connection() as conn:
+            cur = await conn.execute(SQL_UPSERT_TRIGGER, (chat_id, keyword, match_mode, match_mode))
+            trigger_id, created = await cur.fetchone()
+            if media_id is not None:
+                await conn.execute(SQL_UPSERT_MEDIA, (media_id, content, content_type))
+            await conn.execute(
+                "INSERT INTO trigger_responses (trigger_id, type, content, added_by, media_id) "
+                "VALUES (%s, %s, %s, %s, %s) "
+                "ON CONFLICT (trigger_id, media_id) WHERE media_id IS NOT NULL DO NOTHING",
+                (trigger_id, content_type, content, username, media_id)
+            )
+            await self._notify(conn, TRIGGER_CHANNEL, chat_id)
+            return created
+
+    async def set_response_mode(self, chat_id: int, keyword: str, mode: str) -> bool:
+        """Меняет режим выбора ответа триггера. False, если триггера нет."""
+        async with self.connection() as conn:
+            cur = await conn.execute(
+                "UPDATE triggers SET response_mode = %s, rr_cursor = 0 WHERE chat_id = %s AND keyword = %s",
+                (mode, chat_id, keyword)
+            )
+            if cur.rowcount:
+                await self._notify(conn, TRIGGER_CHANNEL, chat_id)
+            return bool(cur.rowcount)
+
+    async def set_response_weight(self, chat_id: int, keyword: str, position: int, weight: int) -> bool:
+        """Вес ответа номер position (с 1, в порядке добавления). False, если такого ответа нет."""
+        async with self.connection() as conn:
+            cur = await conn.execute(
+                "UPDATE trigger_responses SET weight = %s WHERE id = ("
+                "SELECT r.id FROM triggers t JOIN trigger_responses r ON r.trigger_id = t.id "
+                "WHERE t.chat_id = %s AND t.keyword = %s ORDER BY r.id OFFSET %s LIMIT 1)",
+                (weight, chat_id, keyword, position - 1)
+            )
+            if cur.rowcount:
+                await self._notify(conn, TRIGGER_CHANNEL, chat_id)
+            return bool(cur.rowcount)
+
+    async def save_rr_cursors(self, cursors: Dict[Tuple[int, str], int]) -> int:
+        """Записывает позиции round-robin: {(chat_id, keyword): позиция}. Без NOTIFY: это не правка триггера."""
+        chat_ids, keywords = zip(*cursors) if cursors else ((), ())
+        async with self.connection() as conn:
+            cur = await conn.execute(
+                "UPDATE triggers t SET rr_cursor = v.cursor "
+                "FROM unnest(%s::bigint[], %s::text[], %s::int[]) AS v(chat_id, keyword, cursor) "
+                "WHERE t.chat_id = v.chat_id AND t.keyword = v.keyword",
+                (list(chat_ids), list(keywords), list(cursors.values()))
+            )
+            return cur.rowcount
+
+    async def delete_trigger(self, chat_id: int, keyword: str) -> int:
+        async with self.connection() as conn:
+            cur = await conn.execute(SQL_DELETE_TRIGGER, (chat_id, keyword))
+            if cur.rowcount:
+                await self._notify(conn, TRIGGER_CHANNEL, chat_id)
+            return cur.rowcount
+
+    async def list_triggers(self, chat_id: int) -> List[Tuple[str, List[str]]]:
+        """Возвращает список (keyword, [added_by, ...]) для чата."""
+        async with self.connection() as conn:
+            cur = await conn.execute(SQL_LIST_TRIGGERS, (chat_id,))
+            rows = await cur.fetchall()
+        # dict.fromkeys убирает повторы авторов, сохраняя порядок первого добавления
+        return [(keyword, list(dict.fromkeys(added_by))) for keyword, added_by in rows]
+
+    # -----------------------------
+    #   МЕДИА
+    # -----------------------------
+    async def mark_media_dead(self, file_ids: List[str]) -> int:
+        """Помечает файлы реестра с этими file_id как недоступные; триггеры перестают их отправлять."""
+        async with self.connection() as conn:
+            cur = await conn.execute(
+                "UPDATE media SET dead_at = now() WHERE file_id = ANY(%s) AND dead_at IS NULL",
+                (file_ids,)
+            )
+            return cur.rowcount
+
+    async def touch_media(self, sent: Dict[str, datetime]) -> int:
+        """Записывает время последней успешной отправки: {file_unique_id: время}."""
+        async with self.connection() as conn:
+            cur = await conn.execute(
+                "UPDATE media m SET last_sent_at = GREATEST(m.last_sent_at, v.sent_at) "
+                "FROM unnest(%s::text[], %s::timestamptz[]) AS v(file_unique_id, sent_at) "
+                "WHERE m.file_unique_id = v.file_unique_id",
+                (list(sent), list(sent.values()))
+            )
+            return cur.rowcount
+
+    async def prune_dead_media(self, before: datetime) -> Tuple[int, List[int]]:
+        """
+        Удаляет ответы с файлами, недоступными с before, опустевшие после этого
+        триггеры и сами файлы. Возвращает (число удалённых ответов, затронутые чаты).
+        """
+        async with self.connection() as conn:
+            cur = await conn.execute(
+                "DELETE FROM trigger_responses r USING media m, triggers t "
+                "WHERE m.file_unique_id = r.media_id AND t.id = r.trigger_id AND m.dead_at < %s "
+                "RETURNING t.chat_id",
+                (before,)
+            )
+            rows = await cur.fetchall()
+            chat_ids = sorted({chat_id for (chat_id,) in rows})
+            await conn.execute(
+                "DELETE FROM triggers t WHERE t.chat_id = ANY(%s) "
+                "AND NOT EXISTS (SELECT 1 FROM trigger_responses r WHERE r.trigger_id = t.id)",
+                (chat_ids,)
+            )
+            await conn.execute(
+                "DELETE FROM media m WHERE m.dead_at < %s "
+                "AND NOT EXISTS (SELECT 1 FROM trigger_responses r WHERE r.media_id = m.file_unique_id)",
+                (before,)
+            )
+            for chat_id in chat_ids:
+                await self._notify(conn, TRIGGER_CHANNEL, chat_id)
+            return len(rows), chat_ids
+
+    # -----------------------------
+    #   ДНИ РОЖДЕНИЯ
+    # -----------------------------
+    async def set_birthday(self, chat_id: int, user_id: int, username: str, birthday: date) -> bool:
+        """Сохраняет дату рождения. Возвращает True, если запись создана впервые."""
+        async with self.connection() as conn:
+            # xmax = 0 только у только что вставленной строки
+            cur = await conn.execute(
+                "INSERT INTO birthdays (chat_id, user_id, username, birthday) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (chat_id, user_id) DO UPDATE SET "
+                "birthday = EXCLUDED.birthday, username = EXCLUDED.username "
+                "RETURNING (xmax = 0)",
+                (chat_id, user_id, username, birthday)
+            )
+            (inserted,) = await cur.fetchone()
+            return inserted
+
+    async def iter_birthdays(self, month: int, days: List[int], timezone: str, default_timezone: str,
+                             shard: Tuple[int, int] = (0, 1)) -> AsyncIterator[Tuple[int, int, str]]:
+        """
+        Потоково отдаёт (chat_id, user_id, username) именинников этих дней
+        в чатах с указанным часовым поясом. Строки читаются серверным курсором.
+        shard = (номер воркера, число воркеров) оставляет только его чаты.
+        """
+        async with self.connection() as conn:
+            async with conn.cursor(name="birthdays_today") as cur:
+                cur.itersize = 500
+                await cur.execute(SQL_ITER_BIRTHDAYS, (month, days, default_timezone, timezone, shard[1], shard[0]))
+                async for row in cur:
+                    yield row
+
+    # -----------------------------
+    #   НАСТРОЙКИ ЧАТА
+    # -----------------------------
+    async def chat_timezones(self) -> List[str]:
+        """Все часовые пояса, выставленные чатами."""
+        async with self.connection() as conn:
+            cur = await conn.execute("SELECT DISTINCT timezone FROM chat_settings WHERE timezone IS NOT NULL")
+            return [timezone for (timezone,) in await cur.fetchall()]
+
+    async def set_chat_timezone(self, chat_id: int, timezone: str) -> None:
+        async with self.connection() as conn:
+            await conn.execute(
+                "INSERT INTO chat_settings (chat_id, timezone) VALUES (%s, %s) "
+                "ON CONFLICT (chat_id) DO UPDATE SET timezone = EXCLUDED.timezone",
+                (chat_id, timezone)
+            )
+
+    async def get_flood_limits(self, chat_id: int) -> Optional[Tuple[Optional[int], ...]]:
+        """(окно, лимит чата, лимит пользователя, пауза триггера) чата; NULL — значение по умолчанию."""
+        async with self.connection() as conn:
+            cur = await conn.execute(
+                "SELECT flood_window, flood_chat_limit, flood_user_limit, trigger_cooldown "
+                "FROM chat_settings WHERE chat_id = %s",
+                (chat_id,)
+            )
+            return await cur.fetchone()
+
+    async def set_flood_limits(self, chat_id: int, limits: Optional[Tuple[int, int, int, int]]) -> None:
+        """Сохраняет ограничения антифлуда чата; None сбрасывает их к значениям по умолчанию."""
+        values = tuple(limits) if limits is not None else (None, None, None, None)
+        async with self.connection() as conn:
+            await conn.execute(
+                "INSERT INTO chat_settings (chat_id, flood_window, flood_chat_limit, flood_user_limit, "
+                "trigger_cooldown) VALUES (%s, %s, %s, %s, %s) "
+                "ON CONFLICT (chat_id) DO UPDATE SET flood_window = EXCLUDED.flood_window, "
+                "flood_chat_limit = EXCLUDED.flood_chat_limit, flood_user_limit = EXCLUDED.flood_user_limit, "
+                "trigger_cooldown = EXCLUDED.trigger_cooldown",
+                (chat_id, *values)
+            )
+
+    # -----------------------------
+    #   АКТИВНОСТЬ
+    # -----------------------------
+    async def add_activity_batch(self, rows: List[Tuple[int, int, date, int, int]]) -> None:
+        """
+        Прибавляет пачку (chat_id, user_id, date, messages, words) к дневным,
+        недельным и месячным счётчикам и продлевает серии дней в одной транзакции.
+        """
+        weekly: Dict[Tuple[int, int, date], List[int]] = {}
+        monthly: Dict[Tuple[int, int, date], List[int]] = {}
+        by_day: Dict[date, List[Tuple[int, int]]] = {}
+        for chat_id, user_id, day, messages, words in rows:
+            for rollup, period in ((weekly, "week"), (monthly, "month")):
+                counts = rollup.setdefault((chat_id, user_id, period_start(period, day)), [0, 0])
+                counts[0] += messages
+                counts[1] += words
+            by_day.setdefault(day, []).append((chat_id, user_id))
+        async with self.connection() as conn:
+            await self._upsert_counts(conn, "day", rows)
+            await self._upsert_counts(conn, "week", [(*key, *counts) for key, counts in weekly.items()])
+            await self._upsert_counts(conn, "month", [(*key, *counts) for key, counts in monthly.items()])
+            # По дню за запрос: ON CONFLICT не может дважды обновить одну строку серии
+            for day in sorted(by_day):
+                users = by_day[day]
+                for offset in range(0, len(users), 1000):
+                    chunk = users[offset:offset + 1000]
+                    values = ", ".join(["(%s, %s, %s, 1, 1)"] * len(chunk))
+                    params = [value for chat_id, user_id in chunk for value in (chat_id, user_id, day)]
+                    await conn.execute(SQL_UPSERT_STREAKS.format(values=values), params)
+
+    async def _upsert_counts(self, conn, period: str, rows: List[Tuple[int, int, date, int, int]]) -> None:
+        """Прибавляет счётчики к таблице периода пачками по 1000 строк."""
+        table, column = ACTIVITY_PERIODS[period]
+        for offset in range(0, len(rows), 1000):
+            chunk = rows[offset:offset + 1000]
+            values = ", ".join(["(%s, %s, %s, %s, %s)"] * len(chunk))
+            params = [value for row in chunk for value in row]
+            await conn.execute(
+                f"INSERT INTO {table} (chat_id, user_id, {column}, message_count, word_count) "
+                f"VALUES {values} "
+                f"ON CONFLICT (chat_id, user_id, {column}) DO UPDATE SET "
+                f"message_count = {table}.message_count + EXCLUDED.message_count, "
+                f"word_count = {table}.word_count + EXCLUDED.word_count",
+                params
+            )
+
+    async def top_activity(self, chat_id: int, period: str, start: date,
+                           limit: int) -> List[Tuple[int, int, int]]:
+        """Лучшие (user_id, messages, words) чата за период, начинающийся в start."""
+        async with self.connection() as conn:
+            cur = await conn.execute(SQL_TOP_ACTIVITY[period], (chat_id, start, limit))
+            return await cur.fetchall()
+
+    async def users_activity(self, chat_id: int, period: str, start: date,
+                             user_ids: List[int]) -> Dict[int, Tuple[int, int]]:
+        """Счётчики указанных пользователей за период: {user_id: (messages, words)}."""
+        async with self.connection() as conn:
+            cur = await conn.execute(SQL_USERS_ACTIVITY[period], (chat_id, start, user_ids))
+            rows = await cur.fetchall()
+        return {user_id: (messages, words) for user_id, messages, words in rows}
+
+    async def get_streak(self, chat_id: int, user_id: int) -> Optional[Tuple[date, int, int]]:
+        """(последний активный день, текущая серия, лучшая серия) или None."""
+        async with self.connection() as conn:
+            cur = await conn.execute(
+                "SELECT last_date, current_streak, best_streak FROM activity_streaks "
+                "WHERE chat_id = %s AND user_id = %s",
+                (chat_id, user_id)
+            )
+            return await cur.fetchone()
+
+    async def compact_activity(self, before: date, batch_size: int = 10000) -> int:
+        """
+        Удаляет дневные строки старше before: их счётчики уже лежат в недельных
+        и месячных сводках. Удаляет пачками, чтобы не держать длинных блокировок.
+        """
+        deleted = 0
+        while True:
+            async with self.connection() as conn:
+                cur = await conn.execute(
+                    "DELETE FROM activity WHERE id IN "
+                    "(SELECT id FROM activity WHERE date < %s LIMIT %s)",
+                    (before, batch_size)
+                )
+                count = cur.rowcount
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+    # -----------------------------
+    #   ЦИТАТЫ
+    # -----------------------------
+    async def fetch_quotes(self, chat_id: int) -> List[str]:
+        """Цитаты, добавленные админами чата, в порядке добавления."""
+        async with self.connection() as conn:
+            cur = await conn.execute(SQL_FETCH_QUOTES, (chat_id,))
+            return [text for (text,) in await cur.fetchall()]
+
+    async def fetch_quotes_many(self, chat_ids: List[int]) -> Dict[int, List[str]]:
+        """Цитаты нескольких чатов одним запросом: {chat_id: [text, ...]}."""
+        async with self.connection() as conn:
+            cur = await conn.execute(
+                "SELECT chat_id, text FROM quotes WHERE chat_id = ANY(%s) ORDER BY id", (chat_ids,)
+            )
+            rows = await cur.fetchall()
+        result: Dict[int, List[str]] = {chat_id: [] for chat_id in chat_ids}
+        for chat_id, text in rows:
+            result[chat_id].append(text)
+        return result
+
+    async def add_quote(self, chat_id: int, text: str, added_by: str) -> None:
+        async with self.connection() as conn:
+            await conn.execute(
+                "INSERT INTO quotes (chat_id, text, added_by) VALUES (%s, %s, %s)",
+                (chat_id, text, added_by)
+            )
+
+    # -----------------------------
+    #   ПЕРЕНОС ДАННЫХ ЧАТА
+    # -----------------------------
+    @asynccontextmanager
+    async def export_rows(self, chat_id: int) -> AsyncIterator[AsyncIterator[Tuple[str, tuple]]]:
+        """
+        Отдаёт итератор данных чата строками (вид записи, строка) по EXPORT_QUERIES.
+        Строки читаются серверным курсором, поэтому память не зависит от размера
+        чата; все запросы видят один снимок базы. Соединение возвращается в пул
+        при выходе из блока, даже если строки дочитаны не до конца.
+        """
+        async with self.connection() as conn:
+            await conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            rows = self._export_rows(conn, chat_id)
+            try:
+                yield rows
+            finally:
+                await rows.aclose()
+
+    @staticmethod
+    async def _export_rows(conn, chat_id: int) -> AsyncIterator[Tuple[str, tuple]]:
+        for kind, sql in EXPORT_QUERIES:
+            async with conn.cursor(name=f"export_{kind}") as cur:
+                await cur.execute(sql, (chat_id,))
+                async for row in cur:
+                    yield kind, row
+
+    async def import_rows(self, chat_id: int, kind: str, rows: List[tuple]) -> int:
+        """
+        Загружает пачку строк одного вида в чат chat_id: COPY во временную таблицу
+        и перенос с upsert по IMPORT_SPECS, одной транзакцией. Возвращает число строк.
+        """
+        columns, statements = IMPORT_SPECS[kind]
+        async with self.connection() as conn:
+            await conn.execute(f"CREATE TEMP TABLE import_rows ({columns}) ON COMMIT DROP")
+            async with conn.cursor() as cur:
+                async with cur.copy("COPY import_rows FROM STDIN") as copy:
+                    for row in rows:
+                        await copy.write_row(row)
+            for sql in statements:
+                await conn.execute(sql, {"chat_id": chat_id})
+            if kind == "trigger":
+                await self._notify(conn, TRIGGER_CHANNEL, chat_id)
+        return len(rows)
+
+    # -----------------------------
+    #   КРАСАВЧИК ДНЯ
+    # -----------------------------
+    async def get_beauty_winner(self, chat_id: int, day: date) -> Optional[Tuple[int, str]]:
+        """(user_id, username) красавчика дня или None."""
+        async with self.connection() as conn:
+            cur = await conn.execute(SQL_GET_BEAUTY, (chat_id, day))
+            return await cur.fetchone()
+
+    async def claim_beauty_winner(self, chat_id: int, day: date, user_id: int, username: str) -> Tuple[int, str]:
+        """Записывает красавчика дня, если его ещё нет. Возвращает записанного."""
+        async with self.connection() as conn:
+            cur = await conn.execute(SQL_CLAIM_BEAUTY, (chat_id, day, user_id, username))
+            return await cur.fetchone()
 
-    def init_db(self):
-        with self.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS triggers (
-                        id SERIAL PRIMARY KEY,
-                        chat_id BIGINT NOT NULL,
-                        keyword TEXT NOT NULL,
-                        type TEXT NOT NULL,
-                        response TEXT NOT NULL,
-                        added_by TEXT NOT NULL
-                    );
-                """)
-                logger.info("Создана таблица: triggers")
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS birthdays (
-                        id SERIAL PRIMARY KEY,
-                        chat_id BIGINT NOT NULL,
-                        user_id BIGINT NOT NULL,
-                        username TEXT NOT NULL,
-                        birthday DATE NOT NULL
-                    );
-                """)
-                logger.info("Создана таблица: birthdays")
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS activity (
-                        id SERIAL PRIMARY KEY,
-                        chat_id BIGINT NOT NULL,
-                        user_id BIGINT NOT NULL,
-                        date DATE NOT NULL,
-                        word_count INTEGER NOT NULL DEFAULT 0
-                    );
-                """)
-                logger.info("Создана таблица: activity")
-            conn.commit()
+    async def beauty_leaderboard(self, chat_id: int, limit: int) -> List[Tuple[int, str, int]]:
+        """(user_id, последнее имя, число побед) по убыванию побед."""
+        async with self.connection() as conn:
+            cur = await conn.execute(SQL_BEAUTY_LEADERBOARD, (chat_id, limit))
+            return await cur.fetchall()
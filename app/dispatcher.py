@@ -0,0 +1,243 @@
+"""
+Диспетчер воркеров: принимает апдейты от Telegram (long polling или webhook)
+и раздаёт их WORKER_COUNT процессам app.main по abs(chat_id) % WORKER_COUNT.
+Каждый воркер видит только свои чаты, поэтому кэши, очередь отправки и
+прочее состояние чата живут в одном процессе. Воркеры принимают апдейты
+локальным webhook на WORKER_PORT_BASE + номер и перезапускаются при падении.
+
+Запуск: WORKER_COUNT=4 python -m app.dispatcher
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import signal
+import sys
+import time
+from typing import Dict, List, Optional
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+from telegram import Bot, Update
+
+from app.config import (
+    BOT_MODE, BOT_TOKEN, DISPATCHER_QUEUE_SIZE, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET,
+    WEBHOOK_URL, WORKER_COUNT, WORKER_PORT_BASE,
+)
+from app.sharding import shard_of, update_chat_id
+from app.webhook import SECRET_HEADER
+
+logging.basicConfig(
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+class WorkerLink:
+    """
+    Очередь апдейтов одного воркера. Апдейты доставляются по одному и по
+    порядку: пока воркер недоступен или отвечает 503, доставка повторяется,
+    а очередь копится до queue_size, после чего тормозит приём.
+    """
+
+    def __init__(self, index: int, url: str, secret: str, queue_size: int):
+        self.index = index
+        self.url = url
+        self.secret = secret
+        self.queue: "asyncio.Queue[bytes]" = asyncio.Queue(maxsize=queue_size)
+        self.delivered = 0
+        self.retries = 0
+
+    async def run(self, session: ClientSession) -> None:
+        headers = {"Content-Type": "application/json", SECRET_HEADER: self.secret}
+        while True:
+            body = await self.queue.get()
+            try:
+                await self._deliver(session, body, headers)
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, session: ClientSession, body: bytes, headers: Dict[str, str]) -> None:
+        delay = 0.1
+        while True:
+            try:
+                async with session.post(self.url, data=body, headers=headers) as response:
+                    if response.status == 503:
+                        delay = float(response.headers.get("Retry-After", "1"))
+                    else:
+                        if response.status != 200:
+                            logger.error(f"Воркер {self.index} отклонил апдейт: HTTP {response.status}")
+                        self.delivered += 1
+                        return
+            except (ClientError, asyncio.TimeoutError) as e:
+                # Воркер ещё стартует или перезапускается
+                logger.debug(f"Воркер {self.index} недоступен: {e}")
+                delay = min(delay * 2, 5.0)
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+
+class Dispatcher:
+    """Запуск воркеров, надзор за ними и маршрутизация апдейтов по чатам."""
+
+    def __init__(self, count: int, port_base: int, queue_size: int = 1000):
+        self.count = count
+        self.port_base = port_base
+        # Секрет локальных webhook воркеров: чужой процесс на хосте не подсунет апдейт
+        self.secret = secrets.token_hex(16)
+        self.links: List[WorkerLink] = [
+            WorkerLink(index, f"http://127.0.0.1:{port_base + index}/telegram", self.secret, queue_size)
+            for index in range(count)
+        ]
+        self._processes: Dict[int, asyncio.subprocess.Process] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._session: Optional[ClientSession] = None
+        self.stopping = False
+
+    def _link(self, data: dict) -> WorkerLink:
+        chat_id = update_chat_id(data)
+        return self.links[shard_of(chat_id if chat_id is not None else data["update_id"], self.count)]
+
+    async def dispatch(self, data: dict) -> None:
+        """Ставит апдейт в очередь его воркера, дожидаясь места (приём тормозится)."""
+        await self._link(data).queue.put(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+    def offer(self, data: dict, body: bytes) -> bool:
+        """Ставит апдейт в очередь без ожидания. False — очередь воркера полна."""
+        try:
+            self._link(data).queue.put_nowait(body)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    # -----------------------------
+    #   ВОРКЕРЫ
+    # -----------------------------
+    async def start(self) -> None:
+        self._session = ClientSession(timeout=ClientTimeout(total=30))
+        for link in self.links:
+            self._tasks.append(asyncio.ensure_future(link.run(self._session)))
+            self._tasks.append(asyncio.ensure_future(self._supervise(link.index)))
+
+    def _worker_env(self, index: int) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "BOT_MODE": "webhook",
+            "WEBHOOK_URL": "",
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PORT": str(self.port_base + index),
+            "WEBHOOK_PATH": "/telegram",
+            "WEBHOOK_SECRET": self.secret,
+            "WEBHOOK_RECORD_PATH": "",
+            "WORKER_INDEX": str(index),
+            "WORKER_COUNT": str(self.count),
+        })
+        return env
+
+    async def _supervise(self, index: int) -> None:
+        backoff = 1.0
+        while not self.stopping:
+            started = time.monotonic()
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "app.main", env=self._worker_env(index)
+            )
+            self._processes[index] = process
+            logger.info(f"Воркер {index} запущен, pid {process.pid}")
+            code = await process.wait()
+            if self.stopping:
+                return
+            # Долго проработавший воркер перезапускаем сразу, падающий на старте — с паузой
+            backoff = 1.0 if time.monotonic() - started > 60 else min(backoff * 2, 30.0)
+            logger.error(f"Воркер {index} завершился с кодом {code}, перезапуск через {backoff:.0f} с")
+            await asyncio.sleep(backoff)
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """Досылает очереди воркерам (не дольше drain_timeout) и останавливает их."""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(link.queue.join() for link in self.links)), drain_timeout)
+        except asyncio.TimeoutError:
+            lost = sum(link.queue.qsize() for link in self.links)
+            logger.error(f"Не доставлено воркерам при остановке: {lost} апдейтов")
+        self.stopping = True
+        for task in self._tasks:
+            task.cancel()
+        for process in self._processes.values():
+            if process.returncode is None:
+                process.send_signal(signal.SIGTERM)
+        await asyncio.gather(*(process.wait() for process in self._processes.values()))
+        if self._session is not None:
+            await self._session.close()
+        logger.info(f"Диспетчер остановлен: {self.stats()}")
+
+    def stats(self) -> Dict[str, List[int]]:
+        return {
+            "delivered": [link.delivered for link in self.links],
+            "retries": [link.retries for link in self.links],
+            "queued": [link.queue.qsize() for link in self.links],
+        }
+
+    # -----------------------------
+    #   ПРИЁМ АПДЕЙТОВ
+    # -----------------------------
+    async def poll(self, bot: Bot, stop: asyncio.Event) -> None:
+        """Long polling: следующий getUpdates уходит, только когда апдейты разложены по очередям."""
+        await bot.delete_webhook()
+        offset = None
+        while not stop.is_set():
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+            except Exception as e:
+                logger.error(f"Ошибка getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await self.dispatch(update.to_dict())
+                offset = update.update_id + 1
+
+    async def handle_webhook(self, request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), WEBHOOK_SECRET):
+            return web.Response(status=403)
+        body = await request.read()
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(data, dict) or "update_id" not in data:
+            return web.Response(status=400)
+        if not self.offer(data, body):
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return web.Response(status=200)
+
+
+async def run() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    dispatcher = Dispatcher(WORKER_COUNT, WORKER_PORT_BASE, queue_size=DISPATCHER_QUEUE_SIZE)
+    await dispatcher.start()
+    async with Bot(BOT_TOKEN) as bot:
+        if BOT_MODE == "webhook":
+            app = web.Application()
+            app.router.add_post(WEBHOOK_PATH, dispatcher.handle_webhook)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+            if WEBHOOK_URL:
+                await bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                                      allowed_updates=Update.ALL_TYPES)
+            logger.info(f"Диспетчер принимает webhook на {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+            await stop.wait()
+            await runner.cleanup()
+        else:
+            polling = asyncio.ensure_future(dispatcher.poll(bot, stop))
+            await stop.wait()
+            polling.cancel()
+    await dispatcher.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, NamedTuple, Optional, Set, Tuple
+
+from app.config import FLOOD_CHAT_LIMIT, FLOOD_USER_LIMIT, FLOOD_WINDOW, TRIGGER_COOLDOWN
+from app.metrics import FLOOD_DROPPED
+
+logger = logging.getLogger(__name__)
+
+
+class FloodLimits(NamedTuple):
+    """Ограничения триггеров чата; 0 выключает соответствующее ограничение."""
+    window: int = FLOOD_WINDOW
+    chat_limit: int = FLOOD_CHAT_LIMIT
+    user_limit: int = FLOOD_USER_LIMIT
+    cooldown: int = TRIGGER_COOLDOWN
+
+
+DEFAULT_LIMITS = FloodLimits()
+
+
+class TimeWheel:
+    """
+    Колесо таймеров: ключ кладётся в ячейку по секунде истечения, а advance
+    забирает ключи из пройденных ячеек. Добавление и продвижение — O(1) на ключ,
+    без сортировки и без обхода всех ключей. Ключ, запланированный дальше
+    оборота колеса, попадает в последнюю ячейку и будет проверен раньше срока.
+    """
+
+    def __init__(self, slots: int = 512, tick: float = 1.0):
+        self.tick = tick
+        self._slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self._position: Optional[int] = None
+
+    def schedule(self, key: Hashable, expires_at: float) -> None:
+        slot = int(expires_at / self.tick)
+        if self._position is not None:
+            slot = min(max(slot, self._position + 1), self._position + len(self._slots) - 1)
+        self._slots[slot % len(self._slots)].add(key)
+
+    def advance(self, now: float) -> List[Hashable]:
+        """Ключи из ячеек, время которых прошло к now."""
+        current = int(now / self.tick)
+        if self._position is None:
+            self._position = current
+            return []
+        due: List[Hashable] = []
+        start = max(self._position + 1, current - len(self._slots) + 1)
+        for slot in range(start, current + 1):
+            bucket = self._slots[slot % len(self._slots)]
+            if bucket:
+                due.extend(bucket)
+                bucket.clear()
+        self._position = max(self._position, current)
+        return due
+
+
+class FloodGuard:
+    """
+    Антифлуд триггеров. Лимиты чата и пользователя считаются скользящим окном
+    по двум соседним интервалам: оценка = прошлый * (доля окна, ещё не прошедшая)
+    + текущий, по три числа на ключ. Повторное срабатывание одного триггера
+    в пределах cooldown схлопывается. Истёкшие записи убирает колесо таймеров.
+    Проверка перед поиском триггеров только читает счётчики, списание идёт
+    лишь за сработавшие триггеры, поэтому обычная переписка лимиты не тратит.
+    """
+
+    def __init__(self, db, max_chats: int = 10000, settings_ttl: float = 600.0):
+        self.db = db
+        self.max_chats = max_chats
+        self.settings_ttl = settings_ttl
+        # chat_id -> (время загрузки, ограничения)
+        self._limits: "OrderedDict[int, Tuple[float, FloodLimits]]" = OrderedDict()
+        # Одновременные промахи по одному чату ждут один запрос к БД
+        self._loading: Dict[int, asyncio.Future] = {}
+        # (chat_id,) или (chat_id, user_id) -> [начало текущего интервала, прошлый, текущий, длина окна]
+        self._windows: Dict[tuple, list] = {}
+        # (chat_id, keyword) -> время окончания паузы
+        self._cooldowns: Dict[Tuple[int, str], float] = {}
+        self._wheel = TimeWheel()
+        self.dropped: Dict[str, int] = {"chat": 0, "user": 0, "cooldown": 0}
+
+    # -----------------------------
+    #   НАСТРОЙКИ ЧАТА
+    # -----------------------------
+    async def limits(self, chat_id: int) -> FloodLimits:
+        """Ограничения чата: из БД один раз за settings_ttl, дальше из памяти."""
+        entry = self._limits.get(chat_id)
+        if entry is not None and time.monotonic() - entry[0] < self.settings_ttl:
+            self._limits.move_to_end(chat_id)
+            return entry[1]
+        pending = self._loading.get(chat_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._loading[chat_id] = future
+        started = time.monotonic()
+        try:
+            row = await self.db.get_flood_limits(chat_id)
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим; помечаем его как полученное
+            future.exception()
+            raise
+        finally:
+            del self._loading[chat_id]
+        limits = DEFAULT_LIMITS
+        if row is not None:
+            # NULL в колонке — значение по умолчанию из конфигурации
+            limits = FloodLimits(*(default if value is None else value
+                                   for value, default in zip(row, DEFAULT_LIMITS)))
+        entry = self._limits.get(chat_id)
+        # !flood во время запроса уже записал свежие ограничения
+        if entry is None or entry[0] < started:
+            self._store_limits(chat_id, limits)
+        else:
+            limits = entry[1]
+        future.set_result(limits)
+        return limits
+
+    def cached_limits(self, chat_id: int) -> FloodLimits:
+        """Ограничения чата из памяти, даже устаревшие, без запроса к БД; по умолчанию, если их нет."""
+        entry = self._limits.get(chat_id)
+        return entry[1] if entry is not None else DEFAULT_LIMITS
+
+    def _store_limits(self, chat_id: int, limits: FloodLimits) -> None:
+        self._limits[chat_id] = (time.monotonic(), limits)
+        self._limits.move_to_end(chat_id)
+        while len(self._limits) > self.max_chats:
+            self._limits.popitem(last=False)
+
+    async def set_limits(self, chat_id: int, limits: Optional[FloodLimits]) -> FloodLimits:
+        """Сохраняет ограничения чата; None возвращает значения по умолчанию."""
+        await self.db.set_flood_limits(chat_id, limits)
+        limits = limits or DEFAULT_LIMITS
+        self._store_limits(chat_id, limits)
+        return limits
+
+    # -----------------------------
+    #   ПРОВЕРКИ
+    # -----------------------------
+    def _estimate(self, key: tuple, window: int, now: float) -> float:
+        entry = self._windows.get(key)
+        if entry is None:
+            return 0.0
+        start, previous, current = entry[:3]
+        if now - start >= 2 * window:
+            return 0.0
+        if now - start >= window:
+            start, previous, current = start + window, current, 0
+            entry[:3] = start, previous, current
+        return previous * (1 - (now - start) / window) + current
+
+    def _charge(self, key: tuple, amount: int, window: int, now: float) -> None:
+        entry = self._windows.get(key)
+        if entry is None or now - entry[0] >= 2 * window:
+            entry = self._windows[key] = [now, 0, 0, window]
+        else:
+            self._estimate(key, window, now)
+            # Срок записи считается по окну последнего списания, а не по текущим настройкам чата
+            entry[3] = window
+        entry[2] += amount
+        self._wheel.schedule(("window", key), entry[0] + 2 * window)
+
+    def _drop(self, reason: str) -> None:
+        self.dropped[reason] += 1
+        FLOOD_DROPPED.inc(reason)
+
+    def blocked(self, chat_id: int, user_id: int, limits: FloodLimits, now: Optional[float] = None) -> Optional[str]:
+        """
+        Причина отказа ('user' или 'chat'), если пользователь или чат уже исчерпал
+        лимит, иначе None. Ничего не списывает: вызывается до поиска триггеров.
+        """
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        if limits.user_limit and self._estimate((chat_id, user_id), limits.window, now) >= limits.user_limit:
+            self._drop("user")
+            return "user"
+        if limits.chat_limit and self._estimate((chat_id,), limits.window, now) >= limits.chat_limit:
+            self._drop("chat")
+            return "chat"
+        return None
+
+    def admit(self, chat_id: int, user_id: int, keyword: str, responses: int, limits: FloodLimits,
+              now: Optional[float] = None) -> bool:
+        """
+        Решает, отвечать ли сработавшим триггером. При согласии списывает
+        срабатывание с пользователя, ответы — с чата и ставит триггер на паузу.
+        """
+        now = time.monotonic() if now is None else now
+        if limits.cooldown and self._cooldowns.get((chat_id, keyword), 0.0) > now:
+            self._drop("cooldown")
+            return False
+        if limits.user_limit and self._estimate((chat_id, user_id), limits.window, now) >= limits.user_limit:
+            self._drop("user")
+            return False
+        if limits.chat_limit and self._estimate((chat_id,), limits.window, now) >= limits.chat_limit:
+            self._drop("chat")
+            return False
+        if limits.cooldown:
+            self._cooldowns[(chat_id, keyword)] = now + limits.cooldown
+            self._wheel.schedule(("cooldown", (chat_id, keyword)), now + limits.cooldown)
+        if limits.user_limit:
+            self._charge((chat_id, user_id), 1, limits.window, now)
+        if limits.chat_limit:
+            self._charge((chat_id,), responses, limits.window, now)
+        return True
+
+    def _expire(self, now: float) -> None:
+        # Запись могла обновиться после постановки в колесо: срок проверяется по данным
+        for kind, key in self._wheel.advance(now):
+            if kind == "cooldown":
+                expires_at = self._cooldowns.get(key)
+                storage = self._cooldowns
+            else:
+                entry = self._windows.get(key)
+                expires_at = entry[0] + 2 * entry[3] if entry is not None else None
+                storage = self._windows
+            if expires_at is None:
+                continue
+            if expires_at <= now:
+                del storage[key]
+            else:
+                self._wheel.schedule((kind, key), expires_at)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "windows": len(self._windows),
+            "cooldowns": len(self._cooldowns),
+            **{f"dropped_{reason}": count for reason, count in self.dropped.items()},
+        }
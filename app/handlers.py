@@ -1,14 +1,35 @@
+import calendar
 import logging
+import os
 import random
-import json
 import asyncio
-from datetime import datetime, date, time as dtime
-from typing import Dict, List, Tuple
+import tempfile
+from datetime import datetime, date, timedelta, timezone
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import CallbackContext
 
-from app.utils import get_message_type, get_message_content, is_admin, get_random_quote
+from app.activity import LEADERBOARD_SIZE, ActivityBuffer
+from app.beauty import BeautyStore
+from app.config import (
+    ACTIVITY_FLUSH_SIZE, ACTIVITY_RETENTION_DAYS, DEFAULT_TIMEZONE, MEDIA_DEAD_RETENTION_DAYS, MEMBER_CACHE_TTL,
+    SEND_GLOBAL_RATE, SEND_GROUP_PER_MINUTE, SEND_MAX_RETRIES, SEND_PRIVATE_PER_SECOND, TRIGGER_CACHE_MAX_CHATS,
+    TRIGGER_CACHE_TTL, WORKER_COUNT, WORKER_INDEX,
+)
+from app.database import TriggerResponse
+from app.flood import FloodGuard, FloodLimits
+from app.matching import MATCH_REGEX, MATCH_SUBSTRING, MATCH_WORD, validate_pattern
+from app.media import MediaRegistry, group_responses, is_dead_file_error, media_group_input
+from app.members import MemberCache
+from app.quotes import QuoteStore
+from app.responses import ResponsePicker, reply_count
+from app.sender import SendScheduler
+from app.transfer import export_chat, import_chat
+from app.triggers import TriggerCache
+from app.utils import get_message_type, get_message_content, get_message_file, log_message_sample
 
 
 logger = logging.getLogger(__name__)
@@ -22,6 +43,137 @@ BIRTHDAY_TOASTS = [
     "Поздравляем, @{username}! Пусть жизнь дарит тебе только яркие моменты! 🎊"
 ]
 
+# Префиксы режима срабатывания в !add/!del, например "!add слово: кот"
+MATCH_PREFIXES = {
+    "слово:": MATCH_WORD,
+    "word:": MATCH_WORD,
+    "часть:": MATCH_SUBSTRING,
+    "sub:": MATCH_SUBSTRING,
+    "рег:": MATCH_REGEX,
+    "re:": MATCH_REGEX,
+}
+
+# Сколько разных триггеров максимум срабатывает на одно сообщение
+MAX_TRIGGERS_PER_MESSAGE = 3
+
+# Режимы ответа в !mode: слово в команде -> режим, и их описания
+RESPONSE_MODE_ALIASES = {
+    "все": "all", "all": "all",
+    "случайно": "random", "random": "random",
+    "вес": "weighted", "weighted": "weighted",
+    "очередь": "round_robin", "поочерёдно": "round_robin", "поочередно": "round_robin", "round_robin": "round_robin",
+}
+RESPONSE_MODE_LABELS = {
+    "all": "все ответы сразу",
+    "random": "один случайный ответ",
+    "weighted": "один случайный ответ по весам",
+    "round_robin": "ответы по очереди",
+}
+
+# Параметры !flood: слово в команде -> поле FloodLimits
+FLOOD_FIELDS = {
+    "окно": "window", "window": "window",
+    "чат": "chat_limit", "chat": "chat_limit",
+    "юзер": "user_limit", "user": "user_limit",
+    "пауза": "cooldown", "cooldown": "cooldown",
+}
+
+
+def parse_flood_args(args: List[str], current: FloodLimits) -> Optional[FloodLimits]:
+    """Разбирает пары "параметр число" из !flood поверх текущих ограничений; None при ошибке."""
+    if not args or len(args) % 2:
+        return None
+    values = current._asdict()
+    for name, raw in zip(args[::2], args[1::2]):
+        field = FLOOD_FIELDS.get(name.lower())
+        if field is None or not raw.isdigit():
+            return None
+        values[field] = int(raw)
+    if values["window"] < 1:
+        return None
+    return FloodLimits(**values)
+
+
+def describe_flood(limits: FloodLimits) -> str:
+    def limit(value: int, text: str) -> str:
+        return f"{value} {text}" if value else f"без ограничения {text}"
+    return (
+        f"🛡 Антифлуд триггеров за {limits.window} с: "
+        f"{limit(limits.chat_limit, 'ответов на чат')}, {limit(limits.user_limit, 'срабатываний на пользователя')}; "
+        f"пауза одного триггера {limits.cooldown} с."
+    )
+
+
+# Подписи видов записей в отчёте !import
+IMPORT_LABELS = {
+    "trigger": "триггеров",
+    "birthday": "дней рождения",
+    "quote": "цитат",
+    "activity": "строк активности",
+    "streak": "серий",
+}
+
+
+# Периоды статистики в аргументах !talker и !top
+PERIOD_ALIASES = {
+    "день": "day", "сегодня": "day", "day": "day",
+    "неделя": "week", "неделю": "week", "week": "week",
+    "месяц": "month", "month": "month",
+}
+PERIOD_LABELS = {"day": "сегодня", "week": "недели", "month": "месяца"}
+PERIOD_TOTALS = {"day": "сегодня", "week": "за неделю", "month": "за месяц"}
+
+
+def parse_period(arg: str) -> Optional[str]:
+    return PERIOD_ALIASES.get(arg.lower())
+
+
+def parse_trigger_key(raw: str) -> Tuple[str, str, Optional[str]]:
+    """
+    Разбирает ключ из !add/!del. Возвращает (ключ для показа, ключ для хранения, режим).
+    Регулярки хранятся как есть, остальные ключи в нижнем регистре.
+    """
+    for prefix, mode in MATCH_PREFIXES.items():
+        if raw.lower().startswith(prefix):
+            key = raw[len(prefix):].strip()
+            return key, key if mode == MATCH_REGEX else key.lower(), mode
+    return raw, raw.lower(), None
+
+
+def reply_method(message, resp_type: str):
+    """Метод ответа на сообщение для типа сохранённого ответа триггера."""
+    if resp_type == "photo":
+        return message.reply_photo
+    elif resp_type == "video":
+        return message.reply_video
+    elif resp_type == "video_note":
+        return message.reply_video_note
+    elif resp_type == "audio":
+        return message.reply_audio
+    elif resp_type == "document":
+        return message.reply_document
+    elif resp_type == "sticker":
+        return message.reply_sticker
+    return message.reply_text
+
+
+def reply_call(message, batch: List[TriggerResponse]):
+    """Вызов для очереди отправки: альбом для нескольких файлов, иначе обычный ответ."""
+    if len(batch) > 1:
+        media = [media_group_input(response) for response in batch]
+        return lambda: message.reply_media_group(media=media)
+    send = reply_method(message, batch[0].type)
+    content = batch[0].content
+    return lambda: send(content)
+
+
+def birthday_days(today: date) -> List[int]:
+    """Дни месяца, чьих именинников поздравляем сегодня: 29 февраля отмечаем 28-го в невисокосный год."""
+    if today.month == 2 and today.day == 28 and not calendar.isleap(today.year):
+        return [28, 29]
+    return [today.day]
+
+
 class BotHandlers:
     """
     Основной класс обработчиков команд и событий Telegram-бота.
@@ -29,69 +181,159 @@ class BotHandlers:
 
     def __init__(self, db):
         self.db = db
-        self.beauty_winners = {}
-        # Cache for triggers to reduce DB queries
-        self.trigger_cache: Dict[int, Dict[str, Tuple[List[str], str]]] = {}
+        # Красавчики дня хранятся в БД и кэшируются до смены даты
+        self.beauty = BeautyStore(db)
+        # Воркер отвечает только за свои чаты: (номер, число воркеров)
+        self.shard = (WORKER_INDEX, WORKER_COUNT)
+        # Кэш триггеров: чат читается из БД один раз, дальше только при изменениях
+        self.triggers = TriggerCache(db, max_chats=TRIGGER_CACHE_MAX_CHATS, ttl=TRIGGER_CACHE_TTL)
+        # Исходящие сообщения идут через очередь с лимитами Telegram
+        self.sender = SendScheduler(
+            global_rate=SEND_GLOBAL_RATE,
+            group_per_minute=SEND_GROUP_PER_MINUTE,
+            private_per_second=SEND_PRIVATE_PER_SECOND,
+            max_retries=SEND_MAX_RETRIES,
+        )
+        # Админы и имена пользователей без лишних запросов к Telegram API
+        self.members = MemberCache(ttl=MEMBER_CACHE_TTL)
+        # Цитаты читаются с диска один раз и перечитываются при изменении файла
+        self.quotes = QuoteStore(db)
+        # Счётчики активности копятся в памяти и пишутся в БД пачками
+        self.activity = ActivityBuffer(db, flush_size=ACTIVITY_FLUSH_SIZE)
+        # Файлы ответов триггеров: мёртвые file_id и время последней отправки
+        self.media = MediaRegistry(db)
+        # Лимиты срабатываний триггеров на чат и пользователя, паузы триггеров
+        self.flood = FloodGuard(db)
+        # Выбор ответа триггера по режиму, позиции round-robin
+        self.responses = ResponsePicker(db)
+        self.triggers.on_drop = self.responses.forget_chat
 
-    async def _send_message(self, chat_id: int, text: str) -> None:
+    async def _send_message(self, bot, chat_id: int, text: str) -> bool:
         """Вспомогательная функция для отправки сообщений с обработкой ошибок."""
         try:
-            await self.db.bot.send_message(chat_id=chat_id, text=text)
+            await self.sender.send(chat_id, lambda: bot.send_message(chat_id=chat_id, text=text))
             logger.info(f"Message sent to chat {chat_id}: {text}")
-        except Exception as e:
-            logger.error(f"Failed to send message to {chat_id}: {e}")
-
-    async def _load_triggers(self, chat_id: int) -> None:
-        """Loads triggers for a chat into cache asynchronously."""
-        loop = asyncio.get_running_loop()
-        def fetch():
-            with self.db.get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SELECT keyword, response, type FROM triggers WHERE chat_id = %s", (chat_id,))
-                    return cur.fetchall()
-        rows = await loop.run_in_executor(None, fetch)
-        # rows: List of tuples (keyword, json_responses, type)
-        cache = {}
-        for keyword, response_json, resp_type in rows:
-            try:
-                responses = json.loads(response_json)
-                if not isinstance(responses, list):
-                    responses = [response_json]
-            except Exception:
-                responses = [response_json]
-            cache[keyword] = (responses, resp_type)
-        self.trigger_cache[chat_id] = cache
+            return True
+        except Exception:
+            # Ошибка уже залогирована очередью отправки
+            return False
 
     # -----------------------------
-    #   СБРОС "КРАСАВЧИКА ДНЯ"
+    #   УЧАСТНИКИ ЧАТА
     # -----------------------------
-    async def reset_beauty_winner(self, context: CallbackContext) -> None:
-        """Сбрасывает "красавчика дня" для чата."""
-        chat_id = context.job.chat_id
-        if chat_id in self.beauty_winners:
-            del self.beauty_winners[chat_id]
-        logger.info(f"Красавчик дня для чата {chat_id} сброшен.")
+    async def track_user(self, update: Update, context: CallbackContext) -> None:
+        """Запоминает имя автора каждого входящего сообщения."""
+        if update.effective_user:
+            self.members.remember_user(update.effective_user)
+
+    async def handle_chat_member(self, update: Update, context: CallbackContext) -> None:
+        """Обновляет кэш админов по событиям смены статуса участника."""
+        self.members.on_chat_member_updated(update)
 
     # -----------------------------
-    #   ЕЖЕДНЕВНАЯ ПРОВЕРКА ДР
+    #   ЕЖЕЧАСНАЯ ПРОВЕРКА ДР
     # -----------------------------
     async def check_birthdays(self, context: CallbackContext) -> None:
-        """Проверяет дни рождения сегодня и отправляет поздравления."""
-        today = date.today()
-        with self.db.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT chat_id, user_id, username FROM birthdays WHERE EXTRACT(MONTH FROM birthday) = %s AND EXTRACT(DAY FROM birthday) = %s",
-                    (today.month, today.day)
-                )
-                rows = cur.fetchall()
-        if rows:
-            for row in rows:
-                chat_id, user_id, username = row
-                toast = random.choice(BIRTHDAY_TOASTS)
-                toast = toast.format(username=username)
-                await self._send_message(chat_id, toast)
-                logger.info(f"Поздравление с ДР отправлено в чат {chat_id} для @{username}")
+        """
+        Запускается каждый час и поздравляет чаты, в чьём часовом поясе
+        сейчас наступил первый час суток.
+        """
+        now = datetime.now(timezone.utc)
+        timezones = {DEFAULT_TIMEZONE, *await self.db.chat_timezones()}
+        for tz_name in timezones:
+            try:
+                local_now = now.astimezone(ZoneInfo(tz_name))
+            except (ZoneInfoNotFoundError, ValueError):
+                logger.error(f"Неизвестный часовой пояс в настройках чатов: {tz_name}")
+                continue
+            if local_now.hour != 0:
+                continue
+            today = local_now.date()
+            # Выборы через БД: поздравления по поясу и шарду уходят один раз, даже при
+            # нескольких процессах, переводе часов или ручном запуске
+            job = f"birthdays:{tz_name}:{self.shard[0]}/{self.shard[1]}"
+            async with self.db.job_lock(job, today.isoformat()) as elected:
+                if elected:
+                    await self._greet_birthdays(context.bot, today, tz_name)
+
+    async def _greet_birthdays(self, bot, today: date, tz_name: str) -> None:
+        # Все поздравления уходят в очередь сразу: чаты отправляются параллельно в пределах лимитов
+        sends = []
+        async for chat_id, user_id, username in self.db.iter_birthdays(
+                today.month, birthday_days(today), tz_name, DEFAULT_TIMEZONE, shard=self.shard):
+            toast = random.choice(BIRTHDAY_TOASTS).format(username=username)
+            sends.append(asyncio.ensure_future(self._send_message(bot, chat_id, toast)))
+        if sends:
+            sent = sum(await asyncio.gather(*sends))
+            logger.info(f"Поздравления с ДР ({tz_name}, {today}) отправлены: {sent} из {len(sends)}")
+
+    async def handle_timezone_set(self, update: Update, context: CallbackContext) -> None:
+        """Устанавливает часовой пояс чата для поздравлений (только для админов)."""
+        if not await self.members.is_admin(context.bot, update.effective_chat.id, update.message.from_user.id):
+            await update.message.reply_text("❌ Только для админа! 🚫")
+            return
+        tz_name = update.message.text[len("!tz"):].strip()
+        try:
+            ZoneInfo(tz_name)
+        except (ZoneInfoNotFoundError, ValueError):
+            await update.message.reply_text("❌ Неизвестный часовой пояс. Пример: !tz Asia/Bishkek")
+            return
+        await self.db.set_chat_timezone(update.effective_chat.id, tz_name)
+        await update.message.reply_text(f"✅ Часовой пояс чата: {tz_name} 🕛")
+
+    # -----------------------------
+    #   ПЕРЕНОС ДАННЫХ ЧАТА
+    # -----------------------------
+    async def handle_export_command(self, update: Update, context: CallbackContext) -> None:
+        """Присылает данные чата файлом NDJSON (только для админов)."""
+        chat_id = update.effective_chat.id
+        if not await self.members.is_admin(context.bot, chat_id, update.message.from_user.id):
+            await update.message.reply_text("❌ Только для админа! 🚫")
+            return
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                filename = f"chat_{chat_id}.ndjson"
+                path = os.path.join(tmp, filename)
+                with open(path, "w", encoding="utf-8") as out:
+                    counts = await export_chat(self.db, chat_id, out)
+                with open(path, "rb") as f:
+                    await update.message.reply_document(document=f, filename=filename)
+            logger.info(f"Чат {chat_id} выгружен: {counts}")
+        except Exception as e:
+            logger.error(f"Ошибка выгрузки чата {chat_id}: {e}")
+            await update.message.reply_text("❌ Не удалось выгрузить данные чата.")
+
+    async def handle_import_command(self, update: Update, context: CallbackContext) -> None:
+        """Загружает в чат файл выгрузки, на который ответили !import (только для админов)."""
+        chat_id = update.effective_chat.id
+        if not await self.members.is_admin(context.bot, chat_id, update.message.from_user.id):
+            await update.message.reply_text("❌ Только для админа! 🚫")
+            return
+        replied = update.message.reply_to_message
+        if replied is None or replied.document is None:
+            await update.message.reply_text("❌ Ответьте !import на файл выгрузки (.ndjson)!")
+            return
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "import.ndjson")
+                file = await context.bot.get_file(replied.document.file_id)
+                await file.download_to_drive(path)
+                with open(path, encoding="utf-8") as f:
+                    _, counts = await import_chat(self.db, f, chat_id=chat_id)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ Ошибка в файле: {e}")
+            return
+        except Exception as e:
+            logger.error(f"Ошибка загрузки данных в чат {chat_id}: {e}")
+            await update.message.reply_text("❌ Не удалось загрузить данные.")
+            return
+        # Другие реплики узнают о триггерах через NOTIFY, кэши этого процесса сбрасываем сами
+        self.triggers.invalidate(chat_id)
+        self.quotes.invalidate(chat_id)
+        self.activity.invalidate_chat(chat_id)
+        summary = ", ".join(f"{IMPORT_LABELS[kind]}: {count}"
+                            for kind, count in counts.items() if kind in IMPORT_LABELS)
+        await update.message.reply_text(f"✅ Загружено. {summary or 'Записей нет.'}")
 
     # -----------------------------
     #   УСТАНОВКА ДАТЫ РОЖДЕНИЯ
@@ -114,19 +356,11 @@ class BotHandlers:
         user_id = update.message.from_user.id
         username = update.message.from_user.username or update.message.from_user.first_name
 
-        with self.db.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT id FROM birthdays WHERE chat_id = %s AND user_id = %s", (chat_id, user_id))
-                row = cur.fetchone()
-                if row:
-                    cur.execute("UPDATE birthdays SET birthday = %s, username = %s WHERE id = %s",
-                                (bd_date, username, row[0]))
-                    msg = f"✅ Дата рождения обновлена для @{username}! 🎂"
-                else:
-                    cur.execute("INSERT INTO birthdays (chat_id, user_id, username, birthday) VALUES (%s, %s, %s, %s)",
-                                (chat_id, user_id, username, bd_date))
-                    msg = f"✅ Дата рождения установлена для @{username}! 🎉"
-                conn.commit()
+        created = await self.db.set_birthday(chat_id, user_id, username, bd_date)
+        if created:
+            msg = f"✅ Дата рождения установлена для @{username}! 🎉"
+        else:
+            msg = f"✅ Дата рождения обновлена для @{username}! 🎂"
 
         await update.message.reply_text(msg)
 
@@ -138,13 +372,30 @@ class BotHandlers:
         text = update.message.text.strip().lower() if update.message and update.message.text else ""
         if text == "книга братан":
             username = update.message.from_user.username or update.message.from_user.first_name
-            response = get_random_quote()
+            response = await self.quotes.next_quote(update.effective_chat.id) or "Нет доступных цитат."
             if "@{username}" in response:
                 response = response.replace("@{username}", f"@{username}")
             else:
                 response += f" 😎 @{username}"
             await update.message.reply_text(response)
 
+    async def add_quote(self, update: Update, context: CallbackContext) -> None:
+        """Добавляет цитату в книгу чата (только для админов)."""
+        if not update.message:
+            return
+        if not await self.members.is_admin(context.bot, update.effective_chat.id, update.message.from_user.id):
+            await update.message.reply_text("❌ Только для админа! 🚫")
+            return
+        text = update.message.text[len("!quote"):].strip()
+        if not text and update.message.reply_to_message:
+            text = (update.message.reply_to_message.text or "").strip()
+        if not text:
+            await update.message.reply_text("❌ Напишите цитату после !quote или ответьте на сообщение!")
+            return
+        username = update.message.from_user.username or update.message.from_user.first_name
+        await self.quotes.add_quote(update.effective_chat.id, text, username)
+        await update.message.reply_text("✅ Цитата добавлена в книгу! 📖")
+
     # -----------------------------
     #   ТРИГГЕРЫ
     # -----------------------------
@@ -152,102 +403,70 @@ class BotHandlers:
         """Добавляет новый триггер в чат (только для админов)."""
         if not update.message:
             return
-        if not await is_admin(context.bot, update.effective_chat.id, update.message.from_user.id):
+        if not await self.members.is_admin(context.bot, update.effective_chat.id, update.message.from_user.id):
             await update.message.reply_text("❌ Только для админа! 🚫")
             return
         if not update.message.reply_to_message:
             await update.message.reply_text("❌ Ответьте на сообщение для добавления триггера! 🔔")
             return
-        key = update.message.text[len("!add"):].strip()
+        key, stored_key, match_mode = parse_trigger_key(update.message.text[len("!add"):].strip())
         if not key:
             await update.message.reply_text("❌ Укажите ключ триггера после !add!")
             return
         if len(key) > 128:
             await update.message.reply_text("❌ Слишком длинное имя триггера! ⚠️")
             return
-        if key.lower() in {"!add", "!del", "!list", "!bd", "!help", "!talker", "болтун"}:
+        if key.lower() in {"!add", "!del", "!list", "!bd", "!help", "!talker", "!top", "!streak", "!quote", "!tz",
+                           "!export", "!import", "!flood", "!mode", "!weight", "болтун"}:
             await update.message.reply_text("❌ Нельзя использовать зарезервированное имя! 🚫")
             return
+        if match_mode == MATCH_REGEX:
+            error = validate_pattern(key)
+            if error:
+                await update.message.reply_text(f"❌ Некорректное регулярное выражение: {error}")
+                return
 
         username = update.message.from_user.username or update.message.from_user.first_name
         chat_id = update.effective_chat.id
         replied_message = update.message.reply_to_message
         content_type = get_message_type(replied_message)
-        content = get_message_content(replied_message)
-
-        with self.db.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT id, response, added_by FROM triggers WHERE chat_id = %s AND keyword = %s",
-                            (chat_id, key.lower()))
-                row = cur.fetchone()
-                if row:
-                    trigger_id, existing_response, existing_added_by = row
-                    try:
-                        responses = json.loads(existing_response)
-                        if not isinstance(responses, list):
-                            responses = [existing_response]
-                    except Exception:
-                        responses = [existing_response]
-                    try:
-                        added_by_list = json.loads(existing_added_by)
-                        if not isinstance(added_by_list, list):
-                            added_by_list = [existing_added_by]
-                    except Exception:
-                        added_by_list = [existing_added_by]
-                    responses.append(content)
-                    if username not in added_by_list:
-                        added_by_list.append(username)
-                    cur.execute("UPDATE triggers SET response = %s, added_by = %s WHERE id = %s",
-                                (json.dumps(responses), json.dumps(added_by_list), trigger_id))
-                    logger.debug(f"add_trigger: триггер '{key.lower()}' добавлен от @{username} в чат {chat_id}")
-                    conn.commit()
-                    await self._load_triggers(chat_id)
-                    await update.message.reply_text(f"✅ Новый ответ для триггера '{key}' добавлен! 👍")
-                else:
-                    cur.execute(
-                        "INSERT INTO triggers (chat_id, keyword, type, response, added_by) VALUES (%s, %s, %s, %s, %s)",
-                        (chat_id, key.lower(), content_type, json.dumps([content]), json.dumps([username]))
-                    )
-                    logger.debug(f"add_trigger: триггер '{key.lower()}' добавлен от @{username} в чат {chat_id}")
-                    conn.commit()
-                    await self._load_triggers(chat_id)
-                    await update.message.reply_text(f"✅ Триггер '{key}' добавлен! 🎉")
+        # Файл хранится по file_id, даже если у сообщения есть подпись
+        media = get_message_file(replied_message)
+        content, media_id = media if media else (get_message_content(replied_message), None)
+
+        created = await self.db.add_trigger_response(chat_id, stored_key, content_type, content, username,
+                                                     match_mode=match_mode, media_id=media_id)
+        logger.debug(f"add_trigger: триггер '{stored_key}' добавлен от @{username} в чат {chat_id}")
+        await self.triggers.refresh(chat_id)
+        if created:
+            await update.message.reply_text(f"✅ Триггер '{key}' добавлен! 🎉")
+        else:
+            await update.message.reply_text(f"✅ Новый ответ для триггера '{key}' добавлен! 👍")
 
     async def delete_trigger(self, update: Update, context: CallbackContext) -> None:
         """Удаляет триггер из чата (только для админов)."""
         if not update.message:
             return
-        if not await is_admin(context.bot, update.effective_chat.id, update.message.from_user.id):
+        if not await self.members.is_admin(context.bot, update.effective_chat.id, update.message.from_user.id):
             await update.message.reply_text("❌ Только для админа! 🚫")
             return
-        key = update.message.text[len("!del"):].strip()
+        key, stored_key, _ = parse_trigger_key(update.message.text[len("!del"):].strip())
         if not key:
             await update.message.reply_text("❌ Укажите ключ триггера для удаления!")
             return
         chat_id = update.effective_chat.id
-        with self.db.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("DELETE FROM triggers WHERE chat_id = %s AND keyword = %s",
-                            (chat_id, key.lower()))
-            conn.commit()
-        await self._load_triggers(chat_id)
+        await self.db.delete_trigger(chat_id, stored_key)
+        await self.triggers.refresh(chat_id)
         await update.message.reply_text(f"✅ Триггер '{key}' удалён! ✂️")
 
     async def list_triggers(self, update: Update, context: CallbackContext) -> None:
         """Выводит список всех триггеров в чате."""
         chat_id = update.effective_chat.id
-        with self.db.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT keyword, added_by FROM triggers WHERE chat_id = %s", (chat_id,))
-                rows = cur.fetchall()
+        rows = await self.db.list_triggers(chat_id)
         if rows:
             lines = ["📋 Список триггеров:"]
-            for idx, (keyword, added_by) in enumerate(rows, start=1):
-                try:
-                    users = json.loads(added_by)
-                    user_str = ", ".join(users) if isinstance(users, list) else str(users)
-                except Exception:
-                    user_str = added_by
+            for idx, (keyword, users) in enumerate(rows, start=1):
+                user_str = ", ".join(users)
                 lines.append(f"{idx}. {keyword} (от: {user_str})")
             await update.message.reply_text("\n".join(lines))
         else:
@@ -257,36 +476,113 @@ class BotHandlers:
         """Обрабатывает вызов триггера по ключевому слову."""
         if not update.message or not update.message.text:
             return
-        logger.debug(f"handle_trigger_invocation: получено сообщение '{update.message.text}' от {update.message.from_user.id}")
-        trigger_key = update.message.text.strip().lower()
+        log_message_sample(logger, "handle_trigger_invocation: получено сообщение '%s' от %s",
+                           update.message.text, update.message.from_user.id)
         chat_id = update.effective_chat.id
-        # Ensure cache is loaded
-        await self._load_triggers(chat_id)
-        cache = self.trigger_cache.get(chat_id, {})
-        entry = cache.get(trigger_key)
-        if not entry:
-            logger.debug(f"Триггер '{trigger_key}' не найден в чате {chat_id}")
-            return
-        responses, resp_type = entry
-        for resp in responses:
-            try:
-                if resp_type == "photo":
-                    await update.message.reply_photo(photo=resp)
-                elif resp_type == "video":
-                    await update.message.reply_video(video=resp)
-                elif resp_type == "video_note":
-                    await update.message.reply_video_note(video_note=resp)
-                elif resp_type == "audio":
-                    await update.message.reply_audio(audio=resp)
-                elif resp_type == "document":
-                    await update.message.reply_document(document=resp)
-                elif resp_type == "sticker":
-                    await update.message.reply_sticker(sticker=resp)
-                    await asyncio.sleep(0.5)
-                else:
-                    await update.message.reply_text(resp)
-            except Exception as send_err:
-                logger.error(f"❌ Ошибка при отправке ответа: {send_err}")
+        user_id = update.message.from_user.id
+        # Флудящий пользователь или чат отсекаются до поиска триггеров и запросов к БД,
+        # поэтому проверка идёт по ограничениям из памяти
+        if self.flood.blocked(chat_id, user_id, self.flood.cached_limits(chat_id)):
+            return
+        limits = await self.flood.limits(chat_id)
+        matched = await self.triggers.match(chat_id, update.message.text, limit=MAX_TRIGGERS_PER_MESSAGE)
+        if not matched:
+            logger.debug(f"Триггеры не найдены в чате {chat_id}")
+            return
+        for trigger in matched:
+            if self.flood.admit(chat_id, user_id, trigger.keyword, reply_count(trigger), limits):
+                await self._send_trigger_responses(update, self.responses.pick(chat_id, trigger))
+
+    async def handle_mode_command(self, update: Update, context: CallbackContext) -> None:
+        """!mode <ключ> все|случайно|вес|очередь — как триггер выбирает ответы (только для админов)."""
+        chat_id = update.effective_chat.id
+        if not await self.members.is_admin(context.bot, chat_id, update.message.from_user.id):
+            await update.message.reply_text("❌ Только для админа! 🚫")
+            return
+        parts = update.message.text[len("!mode"):].strip().rsplit(maxsplit=1)
+        mode = RESPONSE_MODE_ALIASES.get(parts[-1].lower()) if len(parts) == 2 else None
+        if mode is None:
+            await update.message.reply_text("Используй: !mode <ключ> все|случайно|вес|очередь")
+            return
+        key, stored_key, _ = parse_trigger_key(parts[0])
+        if not await self.db.set_response_mode(chat_id, stored_key, mode):
+            await update.message.reply_text(f"❌ Триггер '{key}' не найден!")
+            return
+        self.responses.forget(chat_id, stored_key)
+        await self.triggers.refresh(chat_id)
+        await update.message.reply_text(f"✅ Триггер '{key}': {RESPONSE_MODE_LABELS[mode]}.")
+
+    async def handle_weight_command(self, update: Update, context: CallbackContext) -> None:
+        """!weight <ключ> <номер ответа> <вес> — вес ответа для режима 'вес' (только для админов)."""
+        chat_id = update.effective_chat.id
+        if not await self.members.is_admin(context.bot, chat_id, update.message.from_user.id):
+            await update.message.reply_text("❌ Только для админа! 🚫")
+            return
+        parts = update.message.text[len("!weight"):].strip().rsplit(maxsplit=2)
+        if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit() or int(parts[1]) < 1:
+            await update.message.reply_text("Используй: !weight <ключ> <номер ответа> <вес>")
+            return
+        key, stored_key, _ = parse_trigger_key(parts[0])
+        position, weight = int(parts[1]), int(parts[2])
+        if not await self.db.set_response_weight(chat_id, stored_key, position, weight):
+            await update.message.reply_text(f"❌ У триггера '{key}' нет ответа номер {position}!")
+            return
+        await self.triggers.refresh(chat_id)
+        await update.message.reply_text(f"✅ Вес ответа {position} триггера '{key}': {weight}")
+
+    async def handle_flood_command(self, update: Update, context: CallbackContext) -> None:
+        """
+        !flood — текущие ограничения триггеров; админы меняют их парами
+        "!flood окно 60 чат 30 юзер 6 пауза 10" или сбрасывают "!flood сброс".
+        """
+        chat_id = update.effective_chat.id
+        args = update.message.text.split()[1:]
+        current = await self.flood.limits(chat_id)
+        if not args:
+            await update.message.reply_text(describe_flood(current))
+            return
+        if not await self.members.is_admin(context.bot, chat_id, update.message.from_user.id):
+            await update.message.reply_text("❌ Только для админа! 🚫")
+            return
+        if len(args) == 1 and args[0].lower() in ("сброс", "reset"):
+            limits = await self.flood.set_limits(chat_id, None)
+        else:
+            limits = parse_flood_args(args, current)
+            if limits is None:
+                await update.message.reply_text(
+                    "Используй: !flood [окно N] [чат N] [юзер N] [пауза N] или !flood сброс")
+                return
+            await self.flood.set_limits(chat_id, limits)
+        await update.message.reply_text(f"✅ {describe_flood(limits)}")
+
+    async def _send_trigger_responses(self, update: Update, responses: List[TriggerResponse]) -> None:
+        """
+        Ставит ответы одного триггера в очередь отправки и ждёт их.
+        Подряд идущие фото и видео уходят одним альбомом, мёртвые файлы пропускаются.
+        """
+        batches = group_responses([response for response in responses if not self.media.is_dead(response)])
+        rejected = await self._send_batches(update, batches)
+        if rejected:
+            # Альбом отклонён целиком: шлём по одному, чтобы найти негодный file_id
+            await self._send_batches(update, [[response] for response in rejected])
+
+    async def _send_batches(self, update: Update, batches: List[List[TriggerResponse]]) -> List[TriggerResponse]:
+        """Отправляет пачки ответов; возвращает ответы из отклонённых альбомов."""
+        chat_id = update.effective_chat.id
+        futures = [self.sender.submit(chat_id, reply_call(update.message, batch)) for batch in batches]
+        rejected, dead = [], []
+        for batch, result in zip(batches, await asyncio.gather(*futures, return_exceptions=True)):
+            if not isinstance(result, Exception):
+                self.media.record_sent(batch)
+            elif len(batch) > 1 and isinstance(result, BadRequest):
+                rejected.extend(batch)
+            elif is_dead_file_error(result):
+                dead.extend(batch)
+            else:
+                logger.error(f"❌ Ошибка при отправке ответа: {result}")
+        if dead:
+            await self.media.mark_dead(dead)
+        return rejected
 
     async def handle_beauty_trigger(self, update: Update, context: CallbackContext) -> None:
         """Обрабатывает триггер 'красавчик' и выбирает победителя."""
@@ -294,35 +590,50 @@ class BotHandlers:
         variants = {"кто красавчик сегодня", "красавчик сегодня", "красавчик"}
         if text in variants:
             chat_id = update.effective_chat.id
-            today_str = date.today().isoformat()
-            if chat_id in self.beauty_winners and self.beauty_winners[chat_id].get("date") == today_str:
-                winner = self.beauty_winners[chat_id]
-            else:
-                admins = await context.bot.get_chat_administrators(chat_id)
+            today = date.today()
+            winner = await self.beauty.get(chat_id, today)
+            if winner is None:
+                admins = await self.members.get_admins(context.bot, chat_id)
                 if not admins:
                     await update.message.reply_text("Не удалось определить администраторов. 🚫")
                     return
-                winner_admin = random.choice(admins).user
-                winner = {
-                    "winner_id": winner_admin.id,
-                    "username": winner_admin.username or winner_admin.first_name,
-                    "date": today_str
-                }
-                self.beauty_winners[chat_id] = winner
-            await update.message.reply_text(f"Сегодня красавчик: @{winner['username']}! 🌟")
+                winner = await self.beauty.choose(chat_id, today, admins)
+            await update.message.reply_text(f"Сегодня красавчик: @{winner.username}! 🌟")
+
+    async def handle_beauty_stats(self, update: Update, context: CallbackContext) -> None:
+        """Показывает, кто чаще всех становился красавчиком дня."""
+        rows = await self.beauty.leaderboard(update.effective_chat.id)
+        if not rows:
+            await update.message.reply_text("Красавчиков ещё не выбирали. 🤷")
+            return
+        lines = ["👑 Чаще всех красавчик:"]
+        for place, (_, username, wins) in enumerate(rows, 1):
+            lines.append(f"{place}. @{username} — {wins} раз")
+        await update.message.reply_text("\n".join(lines))
 
     async def help_command(self, update: Update, context: CallbackContext) -> None:
         """Показывает справочное сообщение со списком команд."""
         help_text = (
             "🆘 Список команд:\n"
             "1. **Книга братан** – Напиши 'Книга братан' и получи мудрую цитату.\n"
-            "2. **!add <ключ>** – Добавить триггер (только админы).\n"
+            "2. **!add <ключ>** – Добавить триггер (только админы). Префиксы `слово:`, `часть:`, `рег:` "
+            "задают срабатывание на слово, подстроку или регулярное выражение в сообщении.\n"
             "3. **!del <ключ>** – Удалить триггер (только админы).\n"
             "4. **!list** – Посмотреть список триггеров.\n"
-            "5. **Кто красавчик сегодня** – Узнать, кто сегодня красавчик (обновляется раз в сутки).\n"
+            "5. **Кто красавчик сегодня** – Узнать, кто сегодня красавчик (обновляется раз в сутки), "
+            "**красавчики** – кто чаще всех.\n"
             "6. **!bd <ДД.ММ.ГГГГ>** – Установить дату рождения. В день рождения бот поздравит тебя!\n"
-            "7. **!talker** или **болтун** – Узнать, кто болтун сегодня (статистика активности).\n"
-            "8. **!help** – Показать это сообщение.\n"
+            "7. **!talker [неделя|месяц]** или **болтун** – Узнать, кто болтун сегодня, за неделю или месяц.\n"
+            "   **!top [N] [неделя|месяц]** – Топ-N самых активных, **!streak** – твоя серия дней подряд.\n"
+            "8. **!quote <текст>** – Добавить цитату в книгу чата (только админы).\n"
+            "9. **!tz <пояс>** – Часовой пояс чата для поздравлений, например Asia/Bishkek (только админы).\n"
+            "10. **!export** – Выгрузить триггеры, дни рождения, цитаты и активность чата файлом, "
+            "**!import** ответом на такой файл – загрузить его (только админы).\n"
+            "11. **!flood** – Ограничения триггеров против флуда; админы меняют их: "
+            "`!flood окно 60 чат 30 юзер 6 пауза 10`, `!flood сброс`.\n"
+            "12. **!mode <ключ> все|случайно|вес|очередь** – Отвечать всеми ответами триггера, одним случайным, "
+            "случайным по весам (**!weight <ключ> <номер> <вес>**) или по очереди (только админы).\n"
+            "13. **!help** – Показать это сообщение.\n"
         )
         await update.message.reply_text(help_text, parse_mode="Markdown")
 
@@ -341,56 +652,106 @@ class BotHandlers:
         if update.message.from_user.is_bot:
             return
 
-        logger.debug(f"update_activity: получено сообщение от пользователя {update.message.from_user.id}: {text}")
+        log_message_sample(logger, "update_activity: получено сообщение от пользователя %s: %s",
+                           update.message.from_user.id, text)
 
         chat_id = update.effective_chat.id
         user_id = update.message.from_user.id
         today = date.today()
 
+        self.activity.record(chat_id, user_id, today, len(text.split()))
+
+    async def flush_activity(self, context: CallbackContext) -> None:
+        """Периодически сбрасывает в БД накопленную активность, время отправки файлов и позиции round-robin."""
+        await self.activity.flush()
+        await self.media.flush()
+        await self.responses.flush()
+
+    async def compact_activity(self, context: CallbackContext) -> None:
+        """Удаляет дневные строки активности старше ACTIVITY_RETENTION_DAYS."""
+        today = date.today()
+        before = today - timedelta(days=ACTIVITY_RETENTION_DAYS)
         try:
-            with self.db.get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        "SELECT id, message_count FROM activity WHERE chat_id = %s AND user_id = %s AND date = %s",
-                        (chat_id, user_id, today)
-                    )
-                    row = cur.fetchone()
-                    if row:
-                        activity_id, count = row
-                        new_count = count + 1
-                        cur.execute(
-                            "UPDATE activity SET message_count = %s WHERE id = %s",
-                            (new_count, activity_id)
-                        )
-                    else:
-                        cur.execute(
-                            "INSERT INTO activity (chat_id, user_id, date, message_count) VALUES (%s, %s, %s, %s)",
-                            (chat_id, user_id, today, 1)
-                        )
-                conn.commit()
+            # Общая для всех воркеров задача: выполняет тот, кто первым взял блокировку
+            async with self.db.job_lock("compact_activity", today.isoformat()) as elected:
+                if not elected:
+                    return
+                deleted = await self.db.compact_activity(before)
+            logger.info(f"Компактизация активности: удалено {deleted} дневных строк до {before}")
+        except Exception as e:
+            logger.error(f"Ошибка компактизации активности: {e}")
+
+    async def prune_media(self, context: CallbackContext) -> None:
+        """Удаляет ответы с файлами, недоступными дольше MEDIA_DEAD_RETENTION_DAYS."""
+        today = date.today()
+        before = datetime.now(timezone.utc) - timedelta(days=MEDIA_DEAD_RETENTION_DAYS)
+        try:
+            async with self.db.job_lock("prune_media", today.isoformat()) as elected:
+                if not elected:
+                    return
+                deleted, chat_ids = await self.db.prune_dead_media(before)
+            # Другие реплики узнают об изменениях через NOTIFY, свой кэш сбрасываем сами
+            for chat_id in chat_ids:
+                self.triggers.invalidate(chat_id)
+            logger.info(f"Очистка файлов: удалено {deleted} ответов с недоступными файлами в {len(chat_ids)} чатах")
         except Exception as e:
-            logger.error(f"Ошибка обновления активности: {e}")
+            logger.error(f"Ошибка очистки недоступных файлов: {e}")
 
     async def handle_talker_command(self, update: Update, context: CallbackContext) -> None:
-        """Обрабатывает команду !talker и возвращает самого активного пользователя за сегодня."""
+        """Обрабатывает команду !talker [неделя|месяц] и возвращает самого активного пользователя за период."""
         chat_id = update.effective_chat.id
+        args = update.message.text.split()[1:]
+        period = parse_period(args[0]) if args else "day"
+        if period is None:
+            await update.message.reply_text("Используй: !talker [неделя|месяц]")
+            return
         today = date.today()
         try:
-            with self.db.get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        "SELECT user_id, message_count FROM activity WHERE chat_id = %s AND date = %s ORDER BY message_count DESC LIMIT 1",
-                        (chat_id, today)
-                    )
-                    row = cur.fetchone()
+            row = await self.activity.top_talker(chat_id, today, period)
             if row:
                 user_id, count = row
-                member = await context.bot.get_chat_member(chat_id, user_id)
-                username = member.user.username or member.user.first_name
-                response_text = f"📢 Болтун сегодня: @{username}\nСообщений за сегодня: {count}"
+                username = await self.members.resolve_name(context.bot, chat_id, user_id)
+                response_text = f"📢 Болтун {PERIOD_LABELS[period]}: @{username}\nСообщений {PERIOD_TOTALS[period]}: {count}"
                 await update.message.reply_text(response_text)
             else:
-                await update.message.reply_text("Сегодня никто не болтал. 🤐")
+                await update.message.reply_text(f"{PERIOD_TOTALS[period].capitalize()} никто не болтал. 🤐")
         except Exception as e:
             logger.error(f"Ошибка обработки команды Болтун: {e}")
             await update.message.reply_text("Ошибка при получении статистики.")
+
+    async def handle_top_command(self, update: Update, context: CallbackContext) -> None:
+        """Обрабатывает команду !top [N] [неделя|месяц]: рейтинг самых активных за период."""
+        chat_id = update.effective_chat.id
+        limit, period = 10, "day"
+        for arg in update.message.text.split()[1:]:
+            if arg.isdigit():
+                limit = max(1, min(int(arg), LEADERBOARD_SIZE))
+            elif parse_period(arg) is not None:
+                period = parse_period(arg)
+            else:
+                await update.message.reply_text(f"Используй: !top [N до {LEADERBOARD_SIZE}] [неделя|месяц]")
+                return
+        try:
+            rows = await self.activity.top(chat_id, period, date.today(), limit)
+            if not rows:
+                await update.message.reply_text(f"{PERIOD_TOTALS[period].capitalize()} никто не болтал. 🤐")
+                return
+            lines = [f"🏆 Топ-{len(rows)} болтунов {PERIOD_LABELS[period]}:"]
+            for place, (user_id, messages, words) in enumerate(rows, 1):
+                username = await self.members.resolve_name(context.bot, chat_id, user_id)
+                lines.append(f"{place}. @{username} — {messages} сообщ., {words} слов")
+            await update.message.reply_text("\n".join(lines))
+        except Exception as e:
+            logger.error(f"Ошибка обработки команды !top: {e}")
+            await update.message.reply_text("Ошибка при получении статистики.")
+
+    async def handle_streak_command(self, update: Update, context: CallbackContext) -> None:
+        """Обрабатывает команду !streak: серия дней подряд с сообщениями у автора."""
+        chat_id = update.effective_chat.id
+        user_id = update.message.from_user.id
+        try:
+            current, best = await self.activity.streak(chat_id, user_id, date.today())
+            await update.message.reply_text(f"🔥 Серия: {current} дн. подряд\nРекорд: {best} дн.")
+        except Exception as e:
+            logger.error(f"Ошибка обработки команды !streak: {e}")
+            await update.message.reply_text("Ошибка при получении статистики.")
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, List, Tuple
+
+from telegram.ext import Application
+
+from app.sender import SendScheduler
+
+logger = logging.getLogger(__name__)
+
+Intake = Callable[[], Awaitable]
+
+
+class Lifecycle:
+    """
+    Запуск и упорядоченная остановка бота вокруг Application.
+    По SIGINT/SIGTERM: прекращается приём апдейтов, принятые апдейты
+    дорабатываются, а очередь отправки досылается не дольше drain_timeout
+    секунд; что не успело уйти, отбрасывается с SendDropped, чтобы
+    обработчики не висели. Затем PTB останавливается, и post_shutdown
+    сбрасывает буферы и закрывает пул, каждый шаг через step: ошибка
+    одного шага не отменяет следующие.
+    """
+
+    def __init__(self, application: Application, sender: SendScheduler, drain_timeout: float = 20.0):
+        self.application = application
+        self.sender = sender
+        self.drain_timeout = drain_timeout
+        # (шаг, секунды, ошибка или пустая строка)
+        self.steps: List[Tuple[str, float, str]] = []
+        self.dropped = 0
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        """Шаг остановки: время пишется в лог, ошибка логируется и не прерывает остановку."""
+        started = time.perf_counter()
+        error = ""
+        try:
+            yield
+        except Exception as e:
+            error = (str(e) or type(e).__name__).splitlines()[0]
+            logger.error(f"Остановка: {name} — ошибка: {error}")
+        else:
+            logger.info(f"Остановка: {name} за {time.perf_counter() - started:.3f} с")
+        self.steps.append((name, time.perf_counter() - started, error))
+
+    async def run(self, start_intake: Intake, stop_intake: Intake,
+                  stop_signals=(signal.SIGINT, signal.SIGTERM)) -> None:
+        """
+        initialize, post_init, start, start_intake, работа до сигнала,
+        затем stop(stop_intake). Приём апдейтов (polling или webhook) задаётся парой функций.
+        """
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in stop_signals:
+            loop.add_signal_handler(sig, stop.set)
+        try:
+            await self.application.initialize()
+            try:
+                if self.application.post_init:
+                    await self.application.post_init(self.application)
+                await self.application.start()
+                await start_intake()
+                await stop.wait()
+                logger.info("Получен сигнал остановки")
+            finally:
+                await self.stop(stop_intake)
+        finally:
+            for sig in stop_signals:
+                loop.remove_signal_handler(sig)
+
+    async def stop(self, stop_intake: Intake) -> None:
+        with self.step("приём апдейтов"):
+            await stop_intake()
+        # PTB дорабатывает апдейты из очереди и ждёт обработчики, а те ждут свои отправки
+        stopping = asyncio.ensure_future(self.application.stop()) if self.application.running else None
+        with self.step("доработка апдейтов и очереди отправки"):
+            if stopping is not None:
+                await asyncio.wait((stopping,), timeout=self.drain_timeout)
+        dropped_before = self.sender.dropped
+        with self.step("очередь отправки"):
+            await self.sender.close()
+        # Обработчики, доработанные после таймаута, получают SendDropped сразу
+        with self.step("остановка PTB"):
+            if stopping is not None:
+                await stopping
+        self.dropped = self.sender.dropped - dropped_before
+        if self.dropped:
+            logger.warning(f"Не успели отправить за {self.drain_timeout:.0f} с: {self.dropped} сообщений")
+        with self.step("закрытие PTB"):
+            await self.application.shutdown()
+        if self.application.post_shutdown:
+            await self.application.post_shutdown(self.application)
+
+
+class PendingState:
+    """
+    Несброшенное состояние буферов на диске. Если при остановке БД недоступна,
+    накопленное в памяти (активность, время отправки файлов, позиции round-robin)
+    пишется в файл, а при следующем запуске возвращается в буферы и уходит
+    в БД обычным сбросом. Буфер отдаёт строки через snapshot() и принимает
+    через restore(rows). Прочитанный файл остаётся на месте, пока save()
+    после успешного сброса не увидит пустые буферы, а файл, который ещё
+    не прочитан, save() сначала вливает в буферы: данные не теряются,
+    даже если запуск оборвался до restore().
+    """
+
+    def __init__(self, path: str, buffers: Dict[str, object]):
+        self.path = path
+        self.buffers = buffers
+        # Файл прочитан в буферы (или его не было): save() может его перезаписать
+        self.loaded = False
+
+    def save(self) -> int:
+        """
+        Пишет непустые буферы в файл; если писать нечего, убирает старый файл.
+        Вызывается после сброса буферов в БД. Возвращает число строк.
+        """
+        if not self.loaded:
+            self.restore()
+        state = {name: buffer.snapshot() for name, buffer in self.buffers.items()}
+        state = {name: rows for name, rows in state.items() if rows}
+        if not state:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return 0
+        # Через временный файл: оборванная запись не испортит прошлое состояние
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        counts = {name: len(rows) for name, rows in state.items()}
+        logger.warning(f"Несброшенное состояние сохранено в {self.path}: {counts}")
+        return sum(counts.values())
+
+    def restore(self) -> int:
+        """
+        Возвращает состояние из файла в буферы. Файл не удаляется: это сделает
+        save(), когда восстановленное дойдёт до БД. Возвращает число строк.
+        """
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            self.loaded = True
+            return 0
+        except ValueError as e:
+            # Испорченный файл не мешает запуску, но остаётся для разбора вручную
+            logger.error(f"Файл состояния {self.path} не читается, переименован в .bad: {e}")
+            os.replace(self.path, self.path + ".bad")
+            self.loaded = True
+            return 0
+        self.loaded = True
+        rows = 0
+        for name, buffer_rows in state.items():
+            buffer = self.buffers.get(name)
+            if buffer is None:
+                logger.error(f"В файле состояния неизвестный буфер {name!r}, {len(buffer_rows)} строк пропущено")
+                continue
+            buffer.restore(buffer_rows)
+            rows += len(buffer_rows)
+        logger.info(f"Восстановлено состояние прошлого запуска из {self.path}: {rows} строк")
+        return rows
@@ -1,64 +1,206 @@
+import asyncio
 import logging
-import time
-from datetime import time as dtime
-from telegram.ext import Application, MessageHandler, filters
-from app.config import BOT_TOKEN, DATABASE_URL
+import os
+import sys
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from telegram import Update
+from telegram.ext import Application, ChatMemberHandler, MessageHandler, TypeHandler, filters
+from app.config import (
+    BOT_TOKEN, DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_READY_TIMEOUT,
+    ACTIVITY_FLUSH_INTERVAL, TRIGGER_CACHE_MAX_CHATS,
+    BOT_MODE, CONCURRENT_UPDATES, WEBHOOK_HOST, WEBHOOK_MAX_PENDING, WEBHOOK_MAX_PENDING_PER_CHAT,
+    WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_RECORD_PATH, WEBHOOK_SECRET, WEBHOOK_URL, LOG_LEVEL,
+    METRICS_HOST, METRICS_PORT, WORKER_INDEX,
+    SHUTDOWN_DRAIN_TIMEOUT, STATE_PATH,
+)
 from app.database import Database
 from app.handlers import BotHandlers
+from app.lifecycle import Lifecycle, PendingState
+from app.metrics import REGISTRY, InstrumentedRequest, MetricsServer, instrument_handlers
+from app.router import MessageRouter
+from app.startup import StartupTimer
+from app.webhook import ChatOrderedUpdateProcessor, WebhookServer, serve
 
 logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s',
-    level=logging.DEBUG
+    level=getattr(logging, LOG_LEVEL.upper(), logging.INFO)
 )
 logger = logging.getLogger(__name__)
 
-# Задержка, чтобы успел подняться контейнер с PostgreSQL
-time.sleep(10)
+# Режим проверки: пройти все фазы запуска, вывести их длительность и выйти
+CHECK_MODE = "--check" in sys.argv[1:]
+timer = StartupTimer()
+
+# Пул соединений открывается и закрывается вместе с приложением
+db = Database(DATABASE_URL, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE, timeout=DB_POOL_TIMEOUT)
+
+
+async def on_startup(application: Application) -> None:
+    restored = 0
+    if not CHECK_MODE:
+        # Счётчики, которые прошлый запуск не смог записать в БД. Читаются до подключения:
+        # если БД всё ещё недоступна, остановка сохранит их в файл снова
+        with timer.phase("состояние прошлого запуска"):
+            restored = pending_state.restore()
+    # Вместо фиксированной паузы ждём ровно столько, сколько поднимается PostgreSQL
+    with timer.phase("ожидание БД"):
+        await db.wait_until_ready(timeout=DB_READY_TIMEOUT)
+    with timer.phase("пул соединений"):
+        await db.open()
+    with timer.phase("миграции"):
+        await db.migrate()
+    if restored:
+        # Файл состояния удаляется, только когда восстановленное записано в БД
+        with timer.phase("сброс восстановленного состояния"):
+            await handlers.flush_activity(None)
+            pending_state.save()
+    handlers.triggers.start_listener()
+    if METRICS_PORT and not CHECK_MODE:
+        await metrics_server.start(METRICS_HOST, METRICS_PORT + WORKER_INDEX)
+    if CHECK_MODE:
+        await warm_caches()
+    else:
+        # Приём апдейтов не ждёт прогрева: до его конца промахи загрузятся лениво
+        application.create_task(warm_caches())
+
+
+async def warm_caches() -> None:
+    """Параллельно загружает триггеры и цитаты самых активных чатов за неделю."""
+    try:
+        with timer.phase("прогрев кэшей"):
+            chats = await db.active_chats(date.today() - timedelta(weeks=1), TRIGGER_CACHE_MAX_CHATS,
+                                          shard=handlers.shard)
+            triggers, quotes = await asyncio.gather(handlers.triggers.warm(chats), handlers.quotes.warm(chats))
+        logger.info(f"Кэши прогреты: триггеры {triggers} чатов, цитат в файле {quotes}")
+    except Exception as e:
+        logger.error(f"Ошибка прогрева кэшей: {e}")
+
+
+async def check() -> int:
+    """Проходит фазы запуска без приёма апдейтов. Возвращает код выхода."""
+    try:
+        try:
+            await on_startup(application)
+        except Exception as e:
+            logger.error(f"Проверка БД не пройдена: {e}")
+        try:
+            with timer.phase("Telegram getMe"):
+                await application.initialize()
+        except Exception as e:
+            logger.error(f"Проверка Telegram не пройдена: {e}")
+    finally:
+        await handlers.triggers.stop_listener()
+        if not db.pool.closed:
+            await db.close()
+        await application.shutdown()
+    print(timer.report())
+    return 1 if timer.failed else 0
+
+
+async def on_shutdown(application: Application) -> None:
+    """Вызывается Lifecycle после остановки PTB: новых апдейтов и отправок уже не будет."""
+    with lifecycle.step("сервер метрик"):
+        await metrics_server.stop()
+    with lifecycle.step("слушатель триггеров"):
+        await handlers.triggers.stop_listener()
+    logger.info(f"Кэш триггеров: {handlers.triggers.stats()}")
+    logger.info(f"Очередь отправки: {handlers.sender.stats()}")
+    logger.info(f"Рейтинги активности: {handlers.activity.stats()}")
+    logger.info(f"Файлы ответов: {handlers.media.stats()}")
+    logger.info(f"Позиции round-robin: {handlers.responses.stats()}")
+    # Досылаем накопленную активность, время отправки файлов и позиции, пока пул ещё открыт;
+    # при ошибке записи буферы сохраняют данные, и они уходят в файл состояния
+    with lifecycle.step("сброс буферов в БД"):
+        await handlers.activity.flush()
+        await handlers.media.flush()
+        await handlers.responses.flush()
+    with lifecycle.step("файл состояния"):
+        pending_state.save()
+    with lifecycle.step("пул соединений"):
+        await db.close()
 
-# Инициализация базы данных
-db = Database(DATABASE_URL)
-db.init_db()
 
 # Создаем объект с нашими хендлерами
 handlers = BotHandlers(db)
+# Замер времени каждого метода; до регистрации, чтобы PTB и маршрутизатор взяли обёртки
+instrument_handlers(handlers)
+metrics_server = MetricsServer()
+# Несброшенные буферы переживают остановку при недоступной БД; у каждого воркера свой файл
+state_root, state_ext = os.path.splitext(STATE_PATH)
+pending_state = PendingState(f"{state_root}.{WORKER_INDEX}{state_ext}" if WORKER_INDEX else STATE_PATH, {
+    "activity": handlers.activity,
+    "media": handlers.media,
+    "round_robin": handlers.responses,
+})
 
-# Создаем приложение Telegram
-application = Application.builder().token(BOT_TOKEN).build()
+# Апдейты разных чатов обрабатываются параллельно, одного чата — по порядку
+processor = ChatOrderedUpdateProcessor(CONCURRENT_UPDATES, max_pending=WEBHOOK_MAX_PENDING,
+                                       max_pending_per_chat=WEBHOOK_MAX_PENDING_PER_CHAT)
 
-# Планирование ежедневных задач через job_queue
-# Сброс "красавчика дня" в полночь
-application.job_queue.run_daily(handlers.reset_beauty_winner, dtime(0, 0), name="reset_beauty")
-# Проверка дней рождения в 00:01
-application.job_queue.run_daily(handlers.check_birthdays, dtime(0, 1), name="check_birthdays")
-
-# Регистрируем обработчики команд
-application.add_handler(MessageHandler(filters.TEXT & filters.Regex("(?i)^!add"), handlers.add_trigger))
-application.add_handler(MessageHandler(filters.TEXT & filters.Regex("(?i)^!del"), handlers.delete_trigger))
-application.add_handler(MessageHandler(filters.TEXT & filters.Regex("(?i)^!list$"), handlers.list_triggers))
-application.add_handler(MessageHandler(filters.TEXT & filters.Regex(r"(?i)^!bd\s+\d{2}\.\d{2}\.\d{4}"), handlers.handle_birthday_set))
-application.add_handler(MessageHandler(filters.TEXT & filters.Regex("(?i)^!help$"), handlers.help_command))
-application.add_handler(MessageHandler(filters.TEXT & (filters.Regex("(?i)^!talker$") | filters.Regex("(?i)^болтун$")), handlers.handle_talker_command))
-application.add_handler(MessageHandler(filters.TEXT & filters.Regex("(?i)^книга братан$"), handlers.handle_kniga_bratan))
-application.add_handler(MessageHandler(filters.TEXT & filters.Regex("(?i)^(кто красавчик сегодня|красавчик сегодня|красавчик)$"), handlers.handle_beauty_trigger))
-
-# Обработчик для триггеров
-application.add_handler(MessageHandler(filters.TEXT & ~filters.Regex("(?i)^!"), handlers.handle_trigger_invocation))
-
-# Обработчик для команд "болтун" и "!talker"
-application.add_handler(
-    MessageHandler(
-        filters.TEXT & (filters.Regex("(?i)^!talker$") | filters.Regex("(?i)^болтун$")),
-        handlers.handle_talker_command
-    )
+# Создаем приложение Telegram
+application = (
+    Application.builder().token(BOT_TOKEN).concurrent_updates(processor)
+    .request(InstrumentedRequest(connection_pool_size=256))
+    .post_init(on_startup).post_shutdown(on_shutdown).build()
 )
+# Порядок остановки: приём, доработка апдейтов и отправок, PTB, буферы, пул
+lifecycle = Lifecycle(application, handlers.sender, drain_timeout=SHUTDOWN_DRAIN_TIMEOUT)
 
-# Обработчик для всех текстовых сообщений (без команд) для обновления активности
-application.add_handler(
-    MessageHandler(
-        filters.TEXT & ~filters.Regex("(?i)^!"),
-        handlers.update_activity
+# Состояние кэшей и очередей снимается в момент запроса /metrics
+REGISTRY.gauge("bot_cache_hit_ratio", "Доля попаданий в кэши", ["cache"], lambda: {
+    (name,): stats["hits"] / (stats["hits"] + stats["misses"]) if stats["hits"] + stats["misses"] else 0.0
+    for name, stats in (
+        ("triggers", handlers.triggers.stats()),
+        ("members", handlers.members.stats()),
+        ("beauty", handlers.beauty.stats()),
+        ("activity_boards", {"hits": handlers.activity.board_hits, "misses": handlers.activity.board_misses}),
     )
-)
+})
+REGISTRY.gauge("bot_send_queue_depth", "Сообщения в очереди отправки", [],
+               lambda: {(): handlers.sender.queue_depth()})
+REGISTRY.gauge("bot_updates_in_flight", "Апдейты в обработке", [], lambda: {(): processor.in_flight})
+REGISTRY.gauge("bot_flood_tracked", "Записи антифлуда в памяти", ["kind"], lambda: {
+    ("windows",): handlers.flood.stats()["windows"],
+    ("cooldowns",): handlers.flood.stats()["cooldowns"],
+})
+REGISTRY.gauge("bot_db_pool_in_use", "Занятые соединения пула", [], lambda: {(): db.metrics.in_use})
+
+# Планирование ежедневных задач через job_queue
+# Проверка дней рождения каждый час в hh:01: каждый чат поздравляется в полночь своего часового пояса
+now = datetime.now(timezone.utc)
+next_run = now.replace(minute=1, second=0, microsecond=0)
+if next_run <= now:
+    next_run += timedelta(hours=1)
+application.job_queue.run_repeating(handlers.check_birthdays, timedelta(hours=1), first=next_run,
+                                    name="check_birthdays")
+# Сброс буфера активности в БД
+application.job_queue.run_repeating(handlers.flush_activity, ACTIVITY_FLUSH_INTERVAL, name="flush_activity")
+# Удаление старых дневных строк активности, их счётчики остаются в сводках
+application.job_queue.run_daily(handlers.compact_activity, dtime(3, 30), name="compact_activity")
+# Удаление ответов с файлами, которые Telegram давно не принимает
+application.job_queue.run_daily(handlers.prune_media, dtime(3, 45), name="prune_media")
+
+# Имена авторов запоминаются до всех остальных обработчиков (группа -1)
+application.add_handler(TypeHandler(Update, handlers.track_user), group=-1)
+# Смена статуса участника обновляет кэш админов без запросов к API
+application.add_handler(ChatMemberHandler(handlers.handle_chat_member, ChatMemberHandler.ANY_CHAT_MEMBER))
+
+# Все текстовые сообщения идут через один маршрутизатор: команды, активность, триггеры
+router = MessageRouter(handlers)
+application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT, router.route))
 
 # Запускаем бота
-application.run_polling()
+# chat_member приходит только если явно запрошен в allowed_updates
+if CHECK_MODE:
+    sys.exit(asyncio.get_event_loop().run_until_complete(check()))
+elif BOT_MODE == "webhook":
+    server = WebhookServer(application, processor, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                           max_pending=WEBHOOK_MAX_PENDING, record_path=WEBHOOK_RECORD_PATH or None)
+    asyncio.get_event_loop().run_until_complete(
+        serve(lifecycle, server, WEBHOOK_HOST, WEBHOOK_PORT, url=WEBHOOK_URL or None)
+    )
+else:
+    asyncio.get_event_loop().run_until_complete(lifecycle.run(
+        lambda: application.updater.start_polling(allowed_updates=Update.ALL_TYPES),
+        application.updater.stop,
+    ))
@@ -0,0 +1,258 @@
+import logging
+import re
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Pattern, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Режимы срабатывания триггера
+MATCH_EXACT = "exact"          # сообщение целиком равно ключу
+MATCH_SUBSTRING = "substring"  # ключ встречается где угодно в сообщении
+MATCH_WORD = "word"            # ключ встречается отдельным словом
+MATCH_REGEX = "regex"          # регулярное выражение ищется в сообщении
+MATCH_MODES = (MATCH_EXACT, MATCH_SUBSTRING, MATCH_WORD, MATCH_REGEX)
+
+
+# Ссылки на группы: \1, (?P=имя), (?(1)...). Перед ними чётное число обратных слешей,
+# то есть сам символ не экранирован. В объединённом выражении номера групп сдвигаются
+_GROUP_REFERENCE = re.compile(r"(?<!\\)(?:\\\\)*(?:\\[1-9]|\(\?P=|\(\?\()")
+# Глобальные флаги (?i), (?x)...: внутри объединённого выражения они уже не в начале
+_GLOBAL_FLAGS = re.compile(r"(?<!\\)(?:\\\\)*\(\?[aiLmsux]+\)")
+
+
+def validate_pattern(pattern: str) -> Optional[str]:
+    """Проверяет регулярку для триггера. Возвращает текст ошибки или None."""
+    try:
+        compiled = re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        return str(e)
+    if compiled.groupindex:
+        return "именованные группы не поддерживаются"
+    if _GROUP_REFERENCE.search(pattern):
+        return "ссылки на группы не поддерживаются"
+    if _GLOBAL_FLAGS.search(pattern):
+        return "флаги вида (?i) не поддерживаются, используйте (?i:...)"
+    try:
+        # Так же, как регулярка попадёт в объединённое выражение
+        re.compile(f"(?P<t0>{pattern})", re.IGNORECASE)
+    except re.error as e:
+        return str(e)
+    if compiled.search("") is not None:
+        return "выражение совпадает с пустой строкой"
+    return None
+
+
+_REGEX_META = set(".^$*+?{}[]\\|()")
+
+
+def literal_prefix(pattern: str) -> str:
+    """
+    Литеральное начало регулярки в нижнем регистре: любое её вхождение
+    обязано начинаться с этой строки. Пустая строка, если префикс не выделить.
+    """
+    if "|" in pattern:
+        return ""
+    literal = []
+    for ch in pattern:
+        if ch in _REGEX_META:
+            # Квантификатор после символа делает сам символ необязательным
+            if ch in "*?{" and literal:
+                literal.pop()
+            break
+        literal.append(ch)
+    return "".join(literal).lower()
+
+
+class AhoCorasick:
+    """
+    Автомат Ахо-Корасик: находит все вхождения набора строк за один
+    проход по тексту, время линейно по длине текста плюс число совпадений.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        # Ближайшее по суффиксным ссылкам состояние, в котором заканчивается шаблон
+        self._dict_link: List[int] = [0]
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str) -> None:
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._dict_link.append(0)
+            state = nxt
+        self._out[state].append(len(self.patterns))
+        self.patterns.append(pattern)
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = fail
+                self._dict_link[nxt] = fail if self._out[fail] else self._dict_link[fail]
+
+    def iter(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Отдаёт пары (индекс конца вхождения, номер шаблона)."""
+        goto, fail, out, dict_link = self._goto, self._fail, self._out, self._dict_link
+        state = 0
+        for end, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            node = state if out[state] else dict_link[state]
+            while node:
+                for pattern_idx in out[node]:
+                    yield end, pattern_idx
+                node = dict_link[node]
+
+
+def _compiles(pattern: str) -> bool:
+    try:
+        re.compile(pattern, re.IGNORECASE)
+    except re.error:
+        return False
+    return True
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class TriggerMatcher:
+    """
+    Скомпилированный поиск триггеров одного чата.
+    Точные ключи ищутся по словарю, подстроки, слова и литеральные начала
+    регулярок одним автоматом Ахо-Корасик, остальные регулярки одним
+    объединённым выражением. Части строятся
+    лениво и переиспользуются из предыдущей версии, если их набор ключей
+    не изменился, поэтому правка одного точного триггера не пересобирает автомат.
+    """
+
+    def __init__(self, modes: Dict[str, str], previous: Optional["TriggerMatcher"] = None):
+        self.exact = {keyword for keyword, mode in modes.items() if mode == MATCH_EXACT}
+        scan = []
+        regex = []
+        for keyword, mode in modes.items():
+            if mode in (MATCH_SUBSTRING, MATCH_WORD):
+                scan.append((keyword, mode, keyword))
+            elif mode == MATCH_REGEX:
+                # Регулярка с литеральным началом ищется через автомат и
+                # проверяется только там, где встретился её префикс
+                prefix = literal_prefix(keyword)
+                if len(prefix) >= 2:
+                    scan.append((prefix, mode, keyword))
+                else:
+                    regex.append(keyword)
+        self._scan_key: Tuple[Tuple[str, str, str], ...] = tuple(sorted(scan))
+        self._regex_key: Tuple[str, ...] = tuple(sorted(regex))
+        self._automaton: Optional[AhoCorasick] = None
+        self._scan_entries: List[Tuple[str, str, Optional[Pattern]]] = []
+        self._regex: Optional[Pattern] = None
+        self._regex_keywords: Dict[str, str] = {}
+        if previous is not None:
+            if previous._scan_key == self._scan_key:
+                self._automaton, self._scan_entries = previous._automaton, previous._scan_entries
+            if previous._regex_key == self._regex_key:
+                self._regex, self._regex_keywords = previous._regex, previous._regex_keywords
+
+    def _get_automaton(self) -> AhoCorasick:
+        if self._automaton is None:
+            entries = []
+            for needle, mode, keyword in self._scan_key:
+                compiled = None
+                if mode == MATCH_REGEX:
+                    if validate_pattern(keyword) is not None:
+                        logger.warning(f"Пропущена некорректная регулярка триггера: {keyword}")
+                        needle = ""
+                    else:
+                        compiled = re.compile(keyword, re.IGNORECASE)
+                entries.append((needle, mode, keyword, compiled))
+            # Пустая строка-игла пропускается автоматом и не получает номер,
+            # поэтому некорректные регулярки отбрасываются до сборки
+            entries = [entry for entry in entries if entry[0]]
+            self._automaton = AhoCorasick(needle for needle, _, _, _ in entries)
+            self._scan_entries = [(mode, keyword, compiled) for _, mode, keyword, compiled in entries]
+        return self._automaton
+
+    def _get_regex(self) -> Pattern:
+        if self._regex is None:
+            parts = []
+            for idx, pattern in enumerate(self._regex_key):
+                if validate_pattern(pattern) is not None:
+                    logger.warning(f"Пропущена некорректная регулярка триггера: {pattern}")
+                    continue
+                group = f"t{idx}"
+                self._regex_keywords[group] = pattern
+                parts.append(f"(?P<{group}>{pattern})")
+            try:
+                # (?!) никогда не совпадает: все регулярки чата оказались некорректными
+                self._regex = re.compile("|".join(parts) or "(?!)", re.IGNORECASE)
+            except re.error as e:
+                # Регулярки, сохранённые до ужесточения проверки, не должны ломать весь чат:
+                # оставляем части, которые компилируются по отдельности
+                logger.warning(f"Объединённая регулярка триггеров не компилируется, собираем по частям: {e}")
+                parts = [part for part in parts if _compiles(part)]
+                try:
+                    self._regex = re.compile("|".join(parts) or "(?!)", re.IGNORECASE)
+                except re.error:
+                    self._regex = re.compile("(?!)")
+        return self._regex
+
+    def match(self, text: str, limit: int = 0) -> List[str]:
+        """
+        Возвращает ключи сработавших триггеров в порядке первого вхождения.
+        Точное совпадение всегда идёт первым. limit=0 — без ограничения.
+        """
+        lowered = text.strip().lower()
+        found: Dict[str, int] = {}
+        if lowered in self.exact:
+            found[lowered] = -1
+        if self._scan_key:
+            automaton = self._get_automaton()
+            entries = self._scan_entries
+            for end, pattern_idx in automaton.iter(lowered):
+                mode, keyword, compiled = entries[pattern_idx]
+                if keyword in found:
+                    continue
+                start = end - len(automaton.patterns[pattern_idx]) + 1
+                if mode == MATCH_WORD:
+                    if start > 0 and _is_word_char(lowered[start - 1]):
+                        continue
+                    if end + 1 < len(lowered) and _is_word_char(lowered[end + 1]):
+                        continue
+                elif mode == MATCH_REGEX:
+                    m = compiled.match(lowered, start)
+                    if m is None or m.start() == m.end():
+                        continue
+                found[keyword] = start
+        if self._regex_key:
+            # Объединённое выражение отдаёт непересекающиеся вхождения:
+            # регулярка, перекрытая более ранней альтернативой, в этом месте не сработает.
+            # Регулярки сравниваются с текстом в нижнем регистре (флаг IGNORECASE),
+            # чтобы позиции совпадали с позициями автомата.
+            for m in self._get_regex().finditer(lowered):
+                if m.start() == m.end():
+                    continue
+                keyword = self._regex_keywords[m.lastgroup]
+                if keyword not in found:
+                    found[keyword] = m.start()
+        ordered = sorted(found, key=found.__getitem__)
+        return ordered[:limit] if limit else ordered
@@ -0,0 +1,131 @@
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from telegram import InputMediaPhoto, InputMediaVideo
+from telegram.error import BadRequest
+
+from app.database import TriggerResponse
+
+logger = logging.getLogger(__name__)
+
+# Типы ответов, которые Telegram принимает одним альбомом, и его предельный размер
+MEDIA_GROUP_TYPES = {"photo": InputMediaPhoto, "video": InputMediaVideo}
+MEDIA_GROUP_MAX = 10
+# Фрагменты текста BadRequest, означающие, что file_id больше не годится
+DEAD_FILE_ERRORS = ("wrong file identifier", "wrong remote file identifier", "invalid file_id", "file reference")
+
+
+def is_dead_file_error(error: BaseException) -> bool:
+    return isinstance(error, BadRequest) and any(text in error.message.lower() for text in DEAD_FILE_ERRORS)
+
+
+def group_responses(responses: List[TriggerResponse]) -> List[List[TriggerResponse]]:
+    """
+    Разбивает ответы триггера на отправки: подряд идущие фото и видео
+    собираются в альбомы до MEDIA_GROUP_MAX штук, остальное уходит по одному.
+    Порядок ответов сохраняется.
+    """
+    batches: List[List[TriggerResponse]] = []
+    run: List[TriggerResponse] = []
+    for response in responses:
+        if response.type in MEDIA_GROUP_TYPES:
+            run.append(response)
+            if len(run) == MEDIA_GROUP_MAX:
+                batches.append(run)
+                run = []
+            continue
+        batches.extend(_close_run(run))
+        run = []
+        batches.append([response])
+    batches.extend(_close_run(run))
+    return batches
+
+
+def _close_run(run: List[TriggerResponse]) -> List[List[TriggerResponse]]:
+    # Альбом из одного файла Telegram не принимает
+    return [run] if len(run) > 1 else [[response] for response in run]
+
+
+def media_group_input(response: TriggerResponse):
+    return MEDIA_GROUP_TYPES[response.type](response.content)
+
+
+class MediaRegistry:
+    """
+    Состояние файлов ответов триггеров в этом процессе. Файл, от которого
+    Telegram отказался, помечается мёртвым в БД и больше не отправляется;
+    старые ответы без записи в реестре пропускаются по file_id до перезапуска.
+    Время последней успешной отправки копится в памяти и пишется в БД пачкой.
+    """
+
+    def __init__(self, db, max_dead: int = 10000):
+        self.db = db
+        self.max_dead = max_dead
+        # file_id мёртвых файлов, в порядке обнаружения
+        self._dead: "OrderedDict[str, None]" = OrderedDict()
+        # file_unique_id -> время последней успешной отправки, ещё не записанное в БД
+        self._sent: Dict[str, datetime] = {}
+        self.sent = 0
+        self.skipped = 0
+        self.marked_dead = 0
+
+    def is_dead(self, response: TriggerResponse) -> bool:
+        if response.type == "text" or response.content not in self._dead:
+            return False
+        self.skipped += 1
+        return True
+
+    def record_sent(self, responses: List[TriggerResponse]) -> None:
+        now = datetime.now(timezone.utc)
+        for response in responses:
+            if response.media_id is not None:
+                self._sent[response.media_id] = now
+                self.sent += 1
+
+    async def mark_dead(self, responses: List[TriggerResponse]) -> None:
+        file_ids = [response.content for response in responses]
+        for file_id in file_ids:
+            self._dead[file_id] = None
+            self._dead.move_to_end(file_id)
+        while len(self._dead) > self.max_dead:
+            self._dead.popitem(last=False)
+        self.marked_dead += len(file_ids)
+        logger.warning(f"Файлы ответов больше недоступны в Telegram: {len(file_ids)}")
+        try:
+            await self.db.mark_media_dead(file_ids)
+        except Exception as e:
+            logger.error(f"Ошибка пометки недоступных файлов: {e}")
+
+    async def flush(self) -> int:
+        """Пишет накопленные времена отправки в БД; при ошибке они вернутся в буфер."""
+        if not self._sent:
+            return 0
+        sent, self._sent = self._sent, {}
+        try:
+            return await self.db.touch_media(sent)
+        except Exception as e:
+            logger.error(f"Ошибка записи времени отправки файлов: {e}")
+            for media_id, sent_at in sent.items():
+                self._sent.setdefault(media_id, sent_at)
+            return 0
+
+    def snapshot(self) -> List[list]:
+        """Незаписанные времена отправки для файла состояния: [media_id, время ISO]."""
+        return [[media_id, sent_at.isoformat()] for media_id, sent_at in self._sent.items()]
+
+    def restore(self, rows: List[list]) -> None:
+        for media_id, sent_at in rows:
+            sent_at = datetime.fromisoformat(sent_at)
+            if media_id not in self._sent or self._sent[media_id] < sent_at:
+                self._sent[media_id] = sent_at
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "marked_dead": self.marked_dead,
+            "dead_known": len(self._dead),
+            "pending": len(self._sent),
+        }
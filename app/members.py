@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from telegram import ChatMember, Update, User
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = {ChatMember.ADMINISTRATOR, ChatMember.OWNER}
+
+
+def display_name(user: User) -> str:
+    return user.username or user.first_name
+
+
+class MemberCache:
+    """
+    Кэш администраторов чатов и имён пользователей.
+    Список админов чата запрашивается одним get_chat_administrators на TTL,
+    одновременные запросы по одному чату объединяются, а события
+    ChatMemberUpdated правят кэш без обращения к API.
+    Имена пользователей запоминаются из входящих сообщений.
+    """
+
+    def __init__(self, ttl: float = 600.0, max_chats: int = 10000, max_users: int = 100000):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self.max_users = max_users
+        # chat_id -> (время загрузки, {user_id: User})
+        self._admins: "OrderedDict[int, Tuple[float, Dict[int, User]]]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._names: "OrderedDict[int, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.api_calls = 0
+
+    # -----------------------------
+    #   АДМИНИСТРАТОРЫ
+    # -----------------------------
+    async def get_admins(self, bot, chat_id: int) -> List[User]:
+        """Администраторы чата; пустой список, если их не удалось получить."""
+        entry = self._admins.get(chat_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            self._admins.move_to_end(chat_id)
+            self.hits += 1
+            return list(entry[1].values())
+        self.misses += 1
+        pending = self._loading.get(chat_id)
+        if pending is None:
+            pending = asyncio.get_running_loop().create_task(self._fetch_admins(bot, chat_id))
+            self._loading[chat_id] = pending
+            pending.add_done_callback(lambda _: self._loading.pop(chat_id, None))
+        admins = await asyncio.shield(pending)
+        return list(admins.values())
+
+    async def _fetch_admins(self, bot, chat_id: int) -> Dict[int, User]:
+        self.api_calls += 1
+        try:
+            members = await bot.get_chat_administrators(chat_id)
+        except Exception as e:
+            logger.error(f"Ошибка получения администраторов чата {chat_id}: {e}")
+            return {}
+        admins = {member.user.id: member.user for member in members}
+        for user in admins.values():
+            self.remember_user(user)
+        self._admins[chat_id] = (time.monotonic(), admins)
+        self._admins.move_to_end(chat_id)
+        while len(self._admins) > self.max_chats:
+            self._admins.popitem(last=False)
+        return admins
+
+    async def is_admin(self, bot, chat_id: int, user_id: int) -> bool:
+        return any(user.id == user_id for user in await self.get_admins(bot, chat_id))
+
+    def on_chat_member_updated(self, update: Update) -> None:
+        """Обновляет кэш по событию ChatMemberUpdated."""
+        member_update = update.chat_member or update.my_chat_member
+        if member_update is None:
+            return
+        user = member_update.new_chat_member.user
+        self.remember_user(user)
+        entry = self._admins.get(member_update.chat.id)
+        if entry is None:
+            return
+        if member_update.new_chat_member.status in ADMIN_STATUSES:
+            entry[1][user.id] = user
+        else:
+            entry[1].pop(user.id, None)
+
+    # -----------------------------
+    #   ИМЕНА ПОЛЬЗОВАТЕЛЕЙ
+    # -----------------------------
+    def remember_user(self, user: Optional[User]) -> None:
+        if user is None or user.is_bot:
+            return
+        self._names[user.id] = display_name(user)
+        self._names.move_to_end(user.id)
+        while len(self._names) > self.max_users:
+            self._names.popitem(last=False)
+
+    async def resolve_name(self, bot, chat_id: int, user_id: int) -> str:
+        """Имя пользователя из кэша, при промахе один запрос get_chat_member."""
+        name = self._names.get(user_id)
+        if name is not None:
+            self.hits += 1
+            return name
+        self.misses += 1
+        self.api_calls += 1
+        member = await bot.get_chat_member(chat_id, user_id)
+        self.remember_user(member.user)
+        return display_name(member.user)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "chats": len(self._admins),
+            "users": len(self._names),
+            "hits": self.hits,
+            "misses": self.misses,
+            "api_calls": self.api_calls,
+        }
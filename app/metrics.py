@@ -0,0 +1,281 @@
+import asyncio
+import functools
+import logging
+import re
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+from psycopg import AsyncCursor
+from telegram import Update
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+# Границы корзин гистограмм в секундах: от миллисекунды до десяти секунд
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """Монотонный счётчик с метками."""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма длительностей с метками, в формате Prometheus (кумулятивные корзины)."""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики корзин (последняя — +Inf), сумма, количество]
+        self.values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def count(self, *labels: str) -> int:
+        entry = self.values.get(labels)
+        return entry[2] if entry else 0
+
+    def total_count(self) -> int:
+        return sum(entry[2] for entry in self.values.values())
+
+    def quantile(self, q: float, *labels: str) -> float:
+        """Оценка квантиля по корзинам (верхняя граница корзины), для логов и бенчмарков."""
+        entry = self.values.get(labels)
+        if not entry or not entry[2]:
+            return 0.0
+        rank = q * entry[2]
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), entry[0]):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _format_labels(self.labels, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class Gauge:
+    """Мгновенное значение, вычисляемое при каждом сборе: {метки: значение}."""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str],
+                 collect: Callable[[], Dict[LabelValues, float]]):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.collect()
+        except Exception as e:
+            logger.error(f"Ошибка сбора метрики {self.name}: {e}")
+            return lines
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {float(value):g}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса и их вывод в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str],
+              collect: Callable[[], Dict[LabelValues, float]]) -> Gauge:
+        # Повторная регистрация заменяет источник: gauge ссылается на живые объекты
+        self.metrics[name] = Gauge(name, help_text, labels, collect)
+        return self.metrics[name]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram("bot_handler_seconds", "Длительность методов BotHandlers", ["handler"])
+HANDLER_ERRORS = REGISTRY.counter("bot_handler_errors_total", "Исключения в методах BotHandlers", ["handler"])
+DB_QUERY_SECONDS = REGISTRY.histogram("bot_db_query_seconds", "Длительность SQL-запросов", ["statement"])
+TELEGRAM_API_SECONDS = REGISTRY.histogram("bot_telegram_api_seconds", "Длительность вызовов Bot API", ["method"])
+TELEGRAM_API_ERRORS = REGISTRY.counter("bot_telegram_api_errors_total", "Ошибки вызовов Bot API",
+                                       ["method", "error"])
+UPDATES_TOTAL = REGISTRY.counter("bot_updates_total", "Принятые апдейты", ["type"])
+FLOOD_DROPPED = REGISTRY.counter("bot_flood_dropped_total", "Срабатывания триггеров, отброшенные антифлудом",
+                                 ["reason"])
+
+# Типы апдейтов для метки bot_updates_total, в порядке проверки
+UPDATE_TYPES = ("message", "edited_message", "callback_query", "chat_member", "my_chat_member", "channel_post")
+
+
+def update_type(update: object) -> str:
+    if not isinstance(update, Update):
+        return "other"
+    for name in UPDATE_TYPES:
+        if getattr(update, name) is not None:
+            return name
+    return "other"
+
+
+# -----------------------------
+#   ИНСТРУМЕНТИРОВАНИЕ
+# -----------------------------
+def instrument_handlers(handlers) -> None:
+    """
+    Оборачивает публичные корутины объекта обработчиков замером времени.
+    Вызывать до регистрации обработчиков: маршрутизатор и PTB запоминают
+    ссылки на методы.
+    """
+    for name in dir(type(handlers)):
+        if name.startswith("_"):
+            continue
+        method = getattr(handlers, name)
+        if asyncio.iscoroutinefunction(method):
+            setattr(handlers, name, _timed(name, method))
+
+
+def _timed(name: str, method):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+# Первая таблица после FROM/INTO/UPDATE: метка запроса без параметров и числа строк VALUES
+_STATEMENT_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+([a-z_]+)", re.IGNORECASE)
+
+
+def statement_label(query) -> str:
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    if not isinstance(query, str):
+        return "composed"
+    head = query.lstrip()[:200]
+    verb = head.split(None, 1)[0].lower() if head else ""
+    match = _STATEMENT_TABLE.search(head)
+    return f"{verb} {match.group(1).lower()}" if match else verb
+
+
+class TimedCursor(AsyncCursor):
+    """Курсор psycopg, засекающий время каждого execute по метке запроса."""
+
+    async def execute(self, query, params=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, statement_label(query))
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTP-клиент Bot API с замером задержки и ошибок по методу API."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            TELEGRAM_API_ERRORS.inc(api_method, type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.observe(time.perf_counter() - started, api_method)
+        if code >= 400:
+            TELEGRAM_API_ERRORS.inc(api_method, str(code))
+        return code, payload
+
+
+# -----------------------------
+#   /metrics
+# -----------------------------
+class MetricsServer:
+    """Локальный HTTP-эндпоинт /metrics для Prometheus."""
+
+    def __init__(self, registry: Registry = REGISTRY):
+        self.registry = registry
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self, host: str, port: int) -> None:
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Метрики: http://{host}:{port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
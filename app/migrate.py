@@ -0,0 +1,46 @@
+"""
+Применение миграций и проверка индексов без запуска бота.
+
+    python -m app.migrate                  # применить миграции
+    python -m app.migrate --check-indexes  # и убедиться, что горячие запросы идут по индексам
+"""
+import argparse
+import asyncio
+import logging
+import sys
+
+from app.config import DATABASE_URL
+from app.database import Database
+
+logger = logging.getLogger(__name__)
+
+
+async def run(check_indexes: bool) -> int:
+    db = Database(DATABASE_URL, min_size=1, max_size=1)
+    await db.open()
+    try:
+        await db.migrate()
+        if not check_indexes:
+            return 0
+        failed = 0
+        for name, uses_index, nodes in await db.explain_hot_queries():
+            status = "OK  " if uses_index else "SEQ "
+            print(f"{status} {name}: {', '.join(nodes)}")
+            if not uses_index:
+                failed += 1
+        return 1 if failed else 0
+    finally:
+        await db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument("--check-indexes", action="store_true",
+                        help="проверить через EXPLAIN, что запросы обработчиков используют индексы")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    sys.exit(asyncio.run(run(args.check_indexes)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.utils import load_quotes, quotes_path
+
+logger = logging.getLogger(__name__)
+
+
+class QuoteStore:
+    """
+    Цитаты "Книги братана" в памяти.
+    Файл читается один раз и перечитывается, только если изменился его mtime.
+    Цитаты, добавленные админами, читаются из БД один раз на чат.
+    Для каждого чата ведётся перемешанная колода: цитата не повторится,
+    пока колода не закончится.
+    """
+
+    def __init__(self, db=None, filepath: str = "quotes.json", check_interval: float = 5.0,
+                 max_chats: int = 10000):
+        self.db = db
+        self.path = quotes_path(filepath)
+        self.check_interval = check_interval
+        self.max_chats = max_chats
+        self._quotes: List[str] = []
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._version = 0
+        self._chat_quotes: "OrderedDict[int, List[str]]" = OrderedDict()
+        # chat_id -> ((версия файла, число цитат чата), оставшиеся индексы колоды)
+        self._decks: "OrderedDict[int, Tuple[Tuple[int, int], List[int]]]" = OrderedDict()
+
+    def load(self) -> int:
+        """Читает файл цитат. Возвращает число загруженных цитат."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            logger.error(f"Ошибка загрузки цитат: {e}")
+            return len(self._quotes)
+        quotes = load_quotes(self.path)
+        self._mtime = mtime
+        if not quotes and self._quotes:
+            # Файл сохранён с ошибкой: остаёмся на прошлой версии до следующей правки
+            return len(self._quotes)
+        self._quotes = quotes
+        self._version += 1
+        logger.info(f"Загружено цитат: {len(self._quotes)}")
+        return len(self._quotes)
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
+    async def _chat_extra(self, chat_id: int) -> List[str]:
+        if self.db is None:
+            return []
+        extra = self._chat_quotes.get(chat_id)
+        if extra is None:
+            extra = await self.db.fetch_quotes(chat_id)
+            self._chat_quotes[chat_id] = extra
+            while len(self._chat_quotes) > self.max_chats:
+                self._chat_quotes.popitem(last=False)
+        self._chat_quotes.move_to_end(chat_id)
+        return extra
+
+    async def warm(self, chat_ids: List[int]) -> int:
+        """Читает файл цитат в отдельном потоке и подгружает цитаты чатов. Возвращает число цитат в файле."""
+        count = await asyncio.get_running_loop().run_in_executor(None, self.load)
+        chat_ids = chat_ids[:self.max_chats]
+        if self.db is not None and chat_ids:
+            for chat_id, extra in (await self.db.fetch_quotes_many(chat_ids)).items():
+                self._chat_quotes.setdefault(chat_id, extra)
+            while len(self._chat_quotes) > self.max_chats:
+                self._chat_quotes.popitem(last=False)
+        return count
+
+    async def add_quote(self, chat_id: int, text: str, added_by: str) -> None:
+        """Сохраняет цитату чата в БД и сразу добавляет её в колоду."""
+        cached = self._chat_quotes.get(chat_id)
+        await self.db.add_quote(chat_id, text, added_by)
+        if cached is not None:
+            cached.append(text)
+        self._decks.pop(chat_id, None)
+
+    def invalidate(self, chat_id: int) -> None:
+        """Перечитать цитаты чата из БД при следующем запросе."""
+        self._chat_quotes.pop(chat_id, None)
+        self._decks.pop(chat_id, None)
+
+    def random_quote(self) -> Optional[str]:
+        """Случайная цитата из файла за O(1), без учёта колоды чата."""
+        self._maybe_reload()
+        return random.choice(self._quotes) if self._quotes else None
+
+    async def next_quote(self, chat_id: int) -> Optional[str]:
+        """Следующая цитата из колоды чата."""
+        self._maybe_reload()
+        extra = await self._chat_extra(chat_id)
+        total = len(self._quotes) + len(extra)
+        if not total:
+            return None
+        deck_version = (self._version, len(extra))
+        entry = self._decks.get(chat_id)
+        if entry is None or entry[0] != deck_version or not entry[1]:
+            deck = list(range(total))
+            random.shuffle(deck)
+            entry = (deck_version, deck)
+            self._decks[chat_id] = entry
+            while len(self._decks) > self.max_chats:
+                self._decks.popitem(last=False)
+        self._decks.move_to_end(chat_id)
+        idx = entry[1].pop()
+        return self._quotes[idx] if idx < len(self._quotes) else extra[idx - len(self._quotes)]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "quotes": len(self._quotes),
+            "chats": len(self._chat_quotes),
+            "decks": len(self._decks),
+        }
@@ -0,0 +1,90 @@
+"""
+Воспроизведение записанных апдейтов: каждая строка файла — JSON апдейта
+Telegram, как его присылает webhook (например, записанный через
+WEBHOOK_RECORD_PATH). Строки без update_id пропускаются.
+
+Запуск: python -m app.replay updates.jsonl --url http://127.0.0.1:8443/telegram [--secret S]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Dict, List
+
+from aiohttp import ClientSession
+
+from app.webhook import SECRET_HEADER
+
+
+def read_updates(path: str) -> List[bytes]:
+    """Тела запросов для POST; строки, не похожие на апдейт, пропускаются."""
+    bodies = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(data, dict) and "update_id" in data:
+                bodies.append(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+    return bodies
+
+
+async def replay(bodies: List[bytes], url: str, secret: str, concurrency: int) -> Dict[str, float]:
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers[SECRET_HEADER] = secret
+    statuses: Dict[int, int] = {}
+    retries = 0
+    queue: "asyncio.Queue[bytes]" = asyncio.Queue()
+    for body in bodies:
+        queue.put_nowait(body)
+
+    async def worker(session: ClientSession) -> None:
+        nonlocal retries
+        while not queue.empty():
+            body = queue.get_nowait()
+            while True:
+                async with session.post(url, data=body, headers=headers) as response:
+                    if response.status != 503:
+                        statuses[response.status] = statuses.get(response.status, 0) + 1
+                        break
+                    # Как Telegram: при перегрузке повторяем позже
+                    retries += 1
+                    await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "updates": len(bodies),
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(len(bodies) / elapsed, 1) if elapsed else 0.0,
+        "retries_503": retries,
+        **{f"status_{status}": count for status, count in sorted(statuses.items())},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="POST записанных апдейтов на webhook бота")
+    parser.add_argument("path", help="файл с апдейтами, по одному JSON на строку")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default="", help="значение X-Telegram-Bot-Api-Secret-Token")
+    parser.add_argument("--concurrency", type=int, default=8, help="одновременных запросов")
+    args = parser.parse_args()
+
+    bodies = read_updates(args.path)
+    if not bodies:
+        print(f"В {args.path} нет апдейтов (строк с update_id)")
+        sys.exit(1)
+    result = asyncio.run(replay(bodies, args.url, args.secret, args.concurrency))
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
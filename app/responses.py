@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import random
+from typing import Dict, List, Optional, Tuple
+
+from app.database import Trigger, TriggerResponse
+
+logger = logging.getLogger(__name__)
+
+# Режимы выбора ответа триггера: все ответы, один случайный, случайный по весам, по очереди
+RESPONSE_MODES = ("all", "random", "weighted", "round_robin")
+
+
+def reply_count(trigger: Trigger) -> int:
+    """Сколько ответов отправит срабатывание триггера."""
+    return len(trigger.responses) if trigger.response_mode == "all" else min(len(trigger.responses), 1)
+
+
+class ResponsePicker:
+    """
+    Выбор ответов сработавшего триггера по его режиму. Выбор идёт по списку
+    ответов из кэша триггеров: случайный и по очереди — O(1), по весам —
+    бинарный поиск по накопленным весам, посчитанным при загрузке.
+    Позиции round-robin живут в памяти и пишутся в БД пачкой при flush;
+    после перезапуска очередь продолжается с сохранённой позиции. Позиции
+    чата забываются вместе с его записью в кэше триггеров (forget_chat),
+    незаписанные остаются до ближайшего flush.
+    """
+
+    def __init__(self, db, rng: Optional[random.Random] = None):
+        self.db = db
+        self.rng = rng or random.Random()
+        # chat_id -> keyword -> следующая позиция; в памяти главнее позиции из кэша триггеров
+        self._cursors: Dict[int, Dict[str, int]] = {}
+        # Позиции, ещё не записанные в БД, и пачка, которая пишется сейчас
+        self._dirty: Dict[Tuple[int, str], int] = {}
+        self._flushing: Dict[Tuple[int, str], int] = {}
+        self._lock = asyncio.Lock()
+
+    def pick(self, chat_id: int, trigger: Trigger) -> List[TriggerResponse]:
+        responses = trigger.responses
+        if trigger.response_mode == "all" or len(responses) < 2:
+            return responses
+        if trigger.response_mode == "weighted" and trigger.cum_weights and trigger.cum_weights[-1] > 0:
+            return self.rng.choices(responses, cum_weights=trigger.cum_weights)
+        if trigger.response_mode == "round_robin":
+            key = (chat_id, trigger.keyword)
+            cursors = self._cursors.setdefault(chat_id, {})
+            position = cursors.get(trigger.keyword)
+            if position is None:
+                # Триггер мог перечитаться из БД раньше, чем в неё попала позиция
+                position = self._dirty.get(key, self._flushing.get(key, trigger.cursor))
+            position %= len(responses)
+            cursors[trigger.keyword] = self._dirty[key] = (position + 1) % len(responses)
+            return [responses[position]]
+        return [self.rng.choice(responses)]
+
+    def forget(self, chat_id: int, keyword: str) -> None:
+        """Сбрасывает позицию триггера в памяти, например после смены режима."""
+        self._cursors.get(chat_id, {}).pop(keyword, None)
+        self._dirty.pop((chat_id, keyword), None)
+        self._flushing.pop((chat_id, keyword), None)
+
+    def forget_chat(self, chat_id: int) -> None:
+        """Забывает позиции чата, вытесненного из кэша триггеров или сброшенного."""
+        self._cursors.pop(chat_id, None)
+
+    async def flush(self) -> int:
+        """Пишет изменившиеся позиции в БД; при ошибке они останутся до следующего раза."""
+        async with self._lock:
+            if not self._dirty:
+                return 0
+            self._flushing, self._dirty = self._dirty, {}
+            try:
+                return await self.db.save_rr_cursors(self._flushing)
+            except Exception as e:
+                logger.error(f"Ошибка записи позиций round-robin: {e}")
+                for key, position in self._flushing.items():
+                    self._dirty.setdefault(key, position)
+                return 0
+            finally:
+                self._flushing = {}
+
+    def snapshot(self) -> List[list]:
+        """Незаписанные позиции для файла состояния: [chat_id, keyword, позиция]."""
+        return [[chat_id, keyword, position] for (chat_id, keyword), position in self._dirty.items()]
+
+    def restore(self, rows: List[list]) -> None:
+        """Позиции из файла состояния; позиции, сдвинутые уже в этом запуске, главнее."""
+        for chat_id, keyword, position in rows:
+            cursors = self._cursors.setdefault(int(chat_id), {})
+            if keyword not in cursors:
+                cursors[keyword] = self._dirty[(int(chat_id), keyword)] = int(position)
+
+    def stats(self) -> Dict[str, int]:
+        return {"cursors": sum(len(cursors) for cursors in self._cursors.values()), "pending": len(self._dirty)}
@@ -0,0 +1,77 @@
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+logger = logging.getLogger(__name__)
+
+Callback = Callable[[Update, CallbackContext], Awaitable[None]]
+
+
+class MessageRouter:
+    """
+    Единственный обработчик текстовых сообщений.
+    Текст нормализуется один раз, команды ищутся по словарю (целиком или
+    по первому слову), а учёт активности и поиск триггеров работают как
+    независимые этапы: ошибка одного не мешает другому.
+    """
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        # Команды, которые должны совпасть с сообщением целиком
+        self.exact: Dict[str, Callback] = {
+            "!list": handlers.list_triggers,
+            "!help": handlers.help_command,
+            "!export": handlers.handle_export_command,
+            "!import": handlers.handle_import_command,
+            "болтун": handlers.handle_talker_command,
+            "книга братан": handlers.handle_kniga_bratan,
+            "кто красавчик сегодня": handlers.handle_beauty_trigger,
+            "красавчик сегодня": handlers.handle_beauty_trigger,
+            "красавчик": handlers.handle_beauty_trigger,
+            "красавчики": handlers.handle_beauty_stats,
+        }
+        # Команды с аргументами: ищутся по первому слову
+        self.prefix: Dict[str, Callback] = {
+            "!add": handlers.add_trigger,
+            "!del": handlers.delete_trigger,
+            "!bd": handlers.handle_birthday_set,
+            "!tz": handlers.handle_timezone_set,
+            "!quote": handlers.add_quote,
+            "!talker": handlers.handle_talker_command,
+            "!top": handlers.handle_top_command,
+            "!streak": handlers.handle_streak_command,
+            "!flood": handlers.handle_flood_command,
+            "!mode": handlers.handle_mode_command,
+            "!weight": handlers.handle_weight_command,
+        }
+
+    def resolve(self, normalized: str) -> Optional[Callback]:
+        """Команда для нормализованного текста или None."""
+        callback = self.exact.get(normalized)
+        if callback is None and normalized.startswith("!"):
+            parts = normalized.split(maxsplit=1)
+            if parts:
+                callback = self.prefix.get(parts[0])
+        return callback
+
+    async def route(self, update: Update, context: CallbackContext) -> None:
+        message = update.message
+        if message is None or not message.text:
+            return
+        normalized = message.text.strip().lower()
+        is_command = normalized.startswith("!")
+        callback = self.resolve(normalized)
+        if not is_command:
+            await self._stage(self.handlers.update_activity, update, context)
+        if callback is not None:
+            await callback(update, context)
+        elif not is_command:
+            await self._stage(self.handlers.handle_trigger_invocation, update, context)
+
+    async def _stage(self, stage: Callback, update: Update, context: CallbackContext) -> None:
+        try:
+            await stage(update, context)
+        except Exception as e:
+            logger.error(f"Ошибка этапа {stage.__name__} в чате {update.effective_chat.id}: {e}")
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+SendCall = Callable[[], Awaitable]
+
+
+class SendDropped(Exception):
+    """Отправка не выполнена: очередь остановлена при завершении бота."""
+
+
+class TokenBucket:
+    """Ведро токенов: capacity отправок подряд, дальше rate отправок в секунду."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Сколько ждать до следующего токена; 0 — токен есть прямо сейчас."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def pause(self, seconds: float) -> None:
+        """Обнуляет ведро так, чтобы следующий токен появился через seconds."""
+        self.tokens = -seconds * self.rate + 1
+        self.updated = time.monotonic()
+
+
+class SendScheduler:
+    """
+    Центральная очередь исходящих сообщений.
+    У каждого чата своя очередь и свой обработчик: внутри чата порядок
+    сохраняется, разные чаты отправляются параллельно. Скорость ограничена
+    ведром на чат и общим ведром под лимиты Telegram, на RetryAfter
+    чат ставится на паузу и отправка повторяется.
+    """
+
+    def __init__(self, global_rate: float = 30.0, group_per_minute: float = 20.0,
+                 private_per_second: float = 1.0, max_retries: int = 3, max_idle_buckets: int = 10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.group_per_minute = group_per_minute
+        self.private_per_second = private_per_second
+        self.max_retries = max_retries
+        self.max_idle_buckets = max_idle_buckets
+        # chat_id -> очередь (вызов, future, время постановки)
+        self._queues: Dict[int, Deque[Tuple[SendCall, asyncio.Future, float]]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.dropped = 0
+        # После close новые отправки сразу завершаются SendDropped
+        self.closed = False
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_idle_buckets:
+                self._purge_buckets()
+            if chat_id < 0:
+                # Группы: не больше group_per_minute сообщений в минуту
+                bucket = TokenBucket(self.group_per_minute, self.group_per_minute / 60)
+            else:
+                bucket = TokenBucket(self.private_per_second, self.private_per_second)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _purge_buckets(self) -> None:
+        # Полное ведро ничего не помнит: его можно пересоздать без потери лимита
+        for chat_id in [c for c, b in self._buckets.items() if c not in self._queues and b.is_full()]:
+            del self._buckets[chat_id]
+
+    def submit(self, chat_id: int, call: SendCall) -> asyncio.Future:
+        """
+        Ставит отправку в очередь чата. call — функция без аргументов,
+        возвращающая корутину вызова Bot API. Результат придёт в future.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self.closed:
+            self._drop(future)
+            return future
+        queue = self._queues.setdefault(chat_id, deque())
+        queue.append((call, future, time.monotonic()))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = loop.create_task(self._run_chat(chat_id))
+        return future
+
+    async def send(self, chat_id: int, call: SendCall):
+        """Ставит отправку в очередь и ждёт её результата."""
+        return await self.submit(chat_id, call)
+
+    async def _wait_token(self, bucket: TokenBucket) -> None:
+        while True:
+            delay = max(bucket.delay(), self.global_bucket.delay())
+            if delay <= 0:
+                bucket.take()
+                self.global_bucket.take()
+                return
+            await asyncio.sleep(delay)
+
+    async def _run_chat(self, chat_id: int) -> None:
+        queue = self._queues[chat_id]
+        bucket = self._bucket(chat_id)
+        future = None
+        try:
+            while queue:
+                call, future, queued_at = queue.popleft()
+                if future.cancelled():
+                    continue
+                result, error = await self._execute(chat_id, bucket, call)
+                latency = time.monotonic() - queued_at
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+                if error is None:
+                    self.sent += 1
+                    if not future.done():
+                        future.set_result(result)
+                else:
+                    self.failed += 1
+                    if not future.done():
+                        future.set_exception(error)
+                        # Исключение доступно вызывающему; не даём asyncio ругаться на него
+                        future.exception()
+        except asyncio.CancelledError:
+            if future is not None:
+                self._drop(future)
+            for _, pending, _ in queue:
+                self._drop(pending)
+            queue.clear()
+            raise
+        finally:
+            del self._workers[chat_id]
+            del self._queues[chat_id]
+
+    async def _execute(self, chat_id: int, bucket: TokenBucket, call: SendCall) -> Tuple[object, Optional[Exception]]:
+        attempt = 0
+        while True:
+            await self._wait_token(bucket)
+            try:
+                return await call(), None
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                delay = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+                if attempt >= self.max_retries:
+                    logger.error(f"Чат {chat_id}: превышен лимит Telegram, отправка отброшена после {attempt} повторов")
+                    return None, e
+                attempt += 1
+                self.retries += 1
+                logger.warning(f"Чат {chat_id}: RetryAfter {delay:.1f} с, повтор {attempt}/{self.max_retries}")
+                bucket.pause(delay)
+            except Exception as e:
+                logger.error(f"Failed to send message to {chat_id}: {e}")
+                return None, e
+
+    def _drop(self, future: asyncio.Future) -> None:
+        if not future.done():
+            self.dropped += 1
+            future.set_exception(SendDropped("очередь отправки остановлена"))
+            future.exception()
+
+    async def close(self) -> int:
+        """
+        Останавливает очередь: недосланные и новые отправки завершаются
+        SendDropped, ждущие их обработчики сразу получают ошибку.
+        Возвращает число отброшенных отправок.
+        """
+        self.closed = True
+        dropped = self.dropped
+        workers = list(self._workers.values())
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        return self.dropped - dropped
+
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> Dict[str, float]:
+        done = self.sent + self.failed
+        return {
+            "queue_depth": self.queue_depth(),
+            "active_chats": len(self._workers),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "latency_avg_ms": self.latency_total / done * 1000 if done else 0.0,
+            "latency_max_ms": self.latency_max * 1000,
+        }
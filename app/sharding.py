@@ -0,0 +1,32 @@
+from typing import Optional
+
+# Апдейты, у которых нет чата, но есть объект с ним (callback_query.message.chat)
+NESTED_MESSAGE_KEYS = ("message",)
+
+
+def shard_of(chat_id: int, count: int) -> int:
+    """Номер воркера, которому принадлежит чат. Одинаков в Python и в SQL (abs(chat_id) % count)."""
+    return abs(chat_id) % count
+
+
+def update_chat_id(data: dict) -> Optional[int]:
+    """
+    chat_id из сырого JSON апдейта Telegram, не разбирая его в объекты PTB.
+    Для апдейтов без чата (inline-запросы и т.п.) возвращает id пользователя.
+    """
+    for key, payload in data.items():
+        if key == "update_id" or not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat")
+        if chat is None:
+            for nested in NESTED_MESSAGE_KEYS:
+                message = payload.get(nested)
+                if isinstance(message, dict):
+                    chat = message.get("chat")
+                    break
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+        user = payload.get("from") or payload.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+    return None
@@ -0,0 +1,38 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Длительность фаз запуска: пишется в лог и выводится в режиме --check."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # (фаза, секунды, ошибка или пустая строка)
+        self.phases: List[Tuple[str, float, str]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.phases.append((name, time.perf_counter() - started, (str(e) or type(e).__name__).splitlines()[0]))
+            raise
+        self.phases.append((name, time.perf_counter() - started, ""))
+        logger.info(f"Старт: {name} за {time.perf_counter() - started:.3f} с")
+
+    @property
+    def failed(self) -> bool:
+        return any(error for _, _, error in self.phases)
+
+    def report(self) -> str:
+        lines = []
+        for name, seconds, error in self.phases:
+            status = f"ОШИБКА: {error}" if error else "OK"
+            lines.append(f"{name:<28} {seconds * 1000:9.1f} мс  {status}")
+        lines.append(f"{'всего с запуска процесса':<28} {(time.perf_counter() - self.started) * 1000:9.1f} мс")
+        return "\n".join(lines)
@@ -0,0 +1,210 @@
+"""
+Перенос данных чата между базами: триггеры, дни рождения, цитаты, активность.
+Формат — NDJSON: первая строка заголовок {"kind": "chat", ...}, дальше по записи
+на строку. Выгрузка читается серверным курсором, загрузка идёт пачками через
+COPY и upsert, так что память не зависит от размера чата, а повторная загрузка
+того же файла ничего не дублирует.
+
+    python -m app.transfer export <chat_id> [-o chat.ndjson]
+    python -m app.transfer import chat.ndjson [--chat <chat_id>] [--batch-size 5000]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
+
+from app.config import DATABASE_URL
+from app.database import ACTIVITY_PERIODS, IMPORT_SPECS, Database
+from app.responses import RESPONSE_MODES
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+IMPORT_BATCH_SIZE = 5000
+# Поля записи settings в порядке колонок chat_settings; отсутствующие в файле остаются NULL
+SETTINGS_FIELDS = ("timezone", "flood_window", "flood_chat_limit", "flood_user_limit", "trigger_cooldown")
+
+
+def _export_record(kind: str, row: tuple) -> dict:
+    if kind == "settings":
+        return {"kind": kind, **dict(zip(SETTINGS_FIELDS, row))}
+    if kind == "birthday":
+        user_id, username, birthday = row
+        return {"kind": kind, "user_id": user_id, "username": username, "birthday": birthday.isoformat()}
+    if kind == "quote":
+        text, added_by = row
+        return {"kind": kind, "text": text, "added_by": added_by}
+    if kind == "activity":
+        period, start, user_id, messages, words = row
+        return {"kind": kind, "period": period, "start": start.isoformat(), "user_id": user_id,
+                "message_count": messages, "word_count": words}
+    user_id, last_date, current, best = row
+    return {"kind": kind, "user_id": user_id, "last_date": last_date.isoformat(),
+            "current_streak": current, "best_streak": best}
+
+
+def _write(out: TextIO, record: dict) -> None:
+    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+async def export_chat(db: Database, chat_id: int, out: TextIO) -> Dict[str, int]:
+    """Пишет данные чата в out построчно. Возвращает число записей по видам."""
+    _write(out, {"kind": "chat", "version": FORMAT_VERSION, "chat_id": chat_id,
+                 "exported_at": datetime.now(timezone.utc).isoformat(timespec="seconds")})
+    counts: Dict[str, int] = {}
+    trigger: Optional[dict] = None
+    async with db.export_rows(chat_id) as rows:
+        async for kind, row in rows:
+            if kind == "trigger":
+                keyword, match_mode, response_mode, resp_type, content, added_by, media_id, weight = row
+                if trigger is None or trigger["keyword"] != keyword:
+                    if trigger is not None:
+                        _write(out, trigger)
+                    trigger = {"kind": kind, "keyword": keyword, "match_mode": match_mode,
+                               "response_mode": response_mode, "responses": []}
+                    counts[kind] = counts.get(kind, 0) + 1
+                response = {"type": resp_type, "content": content, "added_by": added_by}
+                if media_id is not None:
+                    response["media_id"] = media_id
+                if weight != 1:
+                    response["weight"] = weight
+                trigger["responses"].append(response)
+                continue
+            if trigger is not None:
+                _write(out, trigger)
+                trigger = None
+            _write(out, _export_record(kind, row))
+            counts[kind] = counts.get(kind, 0) + 1
+    if trigger is not None:
+        _write(out, trigger)
+    return counts
+
+
+def _import_rows(record: dict, position: int) -> List[tuple]:
+    """Строки временной таблицы IMPORT_SPECS для одной записи файла."""
+    kind = record["kind"]
+    if kind == "settings":
+        return [tuple(record.get(field) for field in SETTINGS_FIELDS)]
+    if kind == "trigger":
+        mode = record.get("response_mode", "all")
+        if mode not in RESPONSE_MODES:
+            raise ValueError(f"неизвестный режим ответа {mode!r}")
+        return [
+            (record["keyword"], record.get("match_mode", "exact"), mode, response["type"], response["content"],
+             response["added_by"], response.get("media_id"), int(response.get("weight", 1)), position + i)
+            for i, response in enumerate(record["responses"])
+        ]
+    if kind == "birthday":
+        return [(int(record["user_id"]), record["username"], date.fromisoformat(record["birthday"]))]
+    if kind == "quote":
+        return [(record["text"], record["added_by"])]
+    if kind == "activity":
+        if record["period"] not in ACTIVITY_PERIODS:
+            raise ValueError(f"неизвестный период {record['period']!r}")
+        return [(record["period"], date.fromisoformat(record["start"]), int(record["user_id"]),
+                 int(record["message_count"]), int(record["word_count"]))]
+    return [(int(record["user_id"]), date.fromisoformat(record["last_date"]),
+             int(record["current_streak"]), int(record["best_streak"]))]
+
+
+async def import_chat(db: Database, lines: Iterable[str], chat_id: Optional[int] = None,
+                      batch_size: int = IMPORT_BATCH_SIZE) -> Tuple[int, Dict[str, int]]:
+    """
+    Загружает выгрузку в чат chat_id (по умолчанию — в чат из заголовка).
+    Строки копятся пачками по виду записи и пишутся, как только пачка наберётся.
+    Ошибка в файле прерывает загрузку с ValueError; уже записанные пачки
+    остаются, и исправленный файл можно загрузить заново.
+    Возвращает (чат, число записей по видам).
+    """
+    target = chat_id
+    batches: Dict[str, List[tuple]] = {}
+    counts: Dict[str, int] = {}
+    position = 0
+    header_seen = False
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            kind = record["kind"]
+            if kind == "chat":
+                if record.get("version", FORMAT_VERSION) > FORMAT_VERSION:
+                    raise ValueError(f"версия формата {record['version']} новее поддерживаемой")
+                header_seen = True
+                if target is None:
+                    target = int(record["chat_id"])
+                continue
+            if kind not in IMPORT_SPECS:
+                raise ValueError(f"неизвестный вид записи {kind!r}")
+            rows = _import_rows(record, position)
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"строка {number}: {e}") from e
+        if not header_seen:
+            raise ValueError(f"строка {number}: файл должен начинаться с заголовка {{\"kind\": \"chat\"}}")
+        if target is None:
+            raise ValueError("в заголовке нет chat_id, укажите чат явно")
+        position += len(rows)
+        counts[kind] = counts.get(kind, 0) + 1
+        batch = batches.setdefault(kind, [])
+        # Пачка пишется только между записями: ответы триггера всегда попадают в одну пачку
+        batch.extend(rows)
+        if len(batch) >= batch_size:
+            await db.import_rows(target, kind, batch)
+            batches[kind] = []
+    if target is None:
+        raise ValueError("пустой файл")
+    for kind, batch in batches.items():
+        if batch:
+            await db.import_rows(target, kind, batch)
+    return target, counts
+
+
+async def run(args) -> int:
+    db = Database(DATABASE_URL, min_size=1, max_size=1)
+    await db.open()
+    try:
+        await db.migrate()
+        if args.command == "export":
+            if args.output == "-":
+                counts = await export_chat(db, args.chat_id, sys.stdout)
+            else:
+                with open(args.output, "w", encoding="utf-8") as out:
+                    counts = await export_chat(db, args.chat_id, out)
+            logger.info(f"Чат {args.chat_id} выгружен: {counts}")
+            return 0
+        try:
+            if args.file == "-":
+                chat_id, counts = await import_chat(db, sys.stdin, args.chat, args.batch_size)
+            else:
+                with open(args.file, encoding="utf-8") as f:
+                    chat_id, counts = await import_chat(db, f, args.chat, args.batch_size)
+        except ValueError as e:
+            logger.error(f"Ошибка в файле выгрузки: {e}")
+            return 1
+        logger.info(f"Чат {chat_id} загружен: {counts}")
+        return 0
+    finally:
+        await db.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Выгрузка и загрузка данных чата в NDJSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="выгрузить чат")
+    export.add_argument("chat_id", type=int)
+    export.add_argument("-o", "--output", default="-", help="файл выгрузки (по умолчанию stdout)")
+    load = commands.add_parser("import", help="загрузить выгрузку")
+    load.add_argument("file", help="файл выгрузки ('-' — stdin)")
+    load.add_argument("--chat", type=int, help="загрузить в этот чат вместо чата из заголовка")
+    load.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="строк в одной пачке COPY")
+    args = parser.parse_args()
+    # Логи в stderr, чтобы не смешивались с выгрузкой в stdout
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, stream=sys.stderr)
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
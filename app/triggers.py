@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.database import TRIGGER_CHANNEL, Trigger
+from app.matching import TriggerMatcher
+
+logger = logging.getLogger(__name__)
+
+ChatTriggers = Dict[str, Trigger]
+
+
+class TriggerCache:
+    """
+    Кэш триггеров по чатам с вытеснением LRU/TTL.
+    Чат загружается из БД один раз; записи через !add/!del обновляют кэш,
+    а изменения из других реплик приходят через LISTEN/NOTIFY.
+    on_drop(chat_id) вызывается, когда чат инвалидирован или вытеснен:
+    по нему сбрасывается состояние, привязанное к триггерам чата.
+    """
+
+    def __init__(self, db, max_chats: int = 1000, ttl: float = 3600.0,
+                 on_drop: Optional[Callable[[int], None]] = None):
+        self.db = db
+        self.on_drop = on_drop
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[float, ChatTriggers]]" = OrderedDict()
+        # Загрузка помечается номером поколения при старте и попадает в кэш, только если
+        # чат не инвалидировали позже. Счётчик общий и только растёт, а номер последней
+        # инвалидации хранится лишь для чатов, чья загрузка ещё идёт
+        self._generation = 0
+        self._invalidated: Dict[int, int] = {}
+        self._inflight: Dict[int, int] = {}
+        self._loading: Dict[int, Tuple[int, asyncio.Future]] = {}
+        # Скомпилированный поиск переживает инвалидацию, чтобы переиспользовать неизменённые части
+        self._matchers: Dict[int, TriggerMatcher] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def get(self, chat_id: int) -> ChatTriggers:
+        """Возвращает триггеры чата, загружая их из БД только при промахе."""
+        entry = self._entries.get(chat_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            self._entries.move_to_end(chat_id)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return await self._load(chat_id)
+
+    async def _load(self, chat_id: int) -> ChatTriggers:
+        # Одновременные промахи по одному чату ждут одну загрузку, начатую после инвалидации
+        pending = self._loading.get(chat_id)
+        if pending is not None and self._fresh(chat_id, pending[0]):
+            return await asyncio.shield(pending[1])
+        generation = self._generation
+        future = asyncio.get_running_loop().create_future()
+        self._loading[chat_id] = (generation, future)
+        self._begin([chat_id])
+        try:
+            triggers = await self.db.fetch_triggers(chat_id)
+            fresh = self._fresh(chat_id, generation)
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим; помечаем его как полученное
+            future.exception()
+            raise
+        finally:
+            if self._loading.get(chat_id, (None, None))[1] is future:
+                del self._loading[chat_id]
+            self._end([chat_id])
+        if fresh:
+            self._store(chat_id, triggers)
+        future.set_result(triggers)
+        return triggers
+
+    def _fresh(self, chat_id: int, generation: int) -> bool:
+        """Загрузка, начатая в поколении generation, не пережила инвалидацию чата."""
+        return self._invalidated.get(chat_id, 0) <= generation
+
+    def _begin(self, chat_ids: List[int]) -> None:
+        for chat_id in chat_ids:
+            self._inflight[chat_id] = self._inflight.get(chat_id, 0) + 1
+
+    def _end(self, chat_ids: List[int]) -> None:
+        for chat_id in chat_ids:
+            self._inflight[chat_id] -= 1
+            if not self._inflight[chat_id]:
+                del self._inflight[chat_id]
+                self._invalidated.pop(chat_id, None)
+
+    def _store(self, chat_id: int, triggers: ChatTriggers) -> None:
+        self._entries[chat_id] = (time.monotonic(), triggers)
+        self._entries.move_to_end(chat_id)
+        modes = {keyword: trigger.match_mode for keyword, trigger in triggers.items()}
+        self._matchers[chat_id] = TriggerMatcher(modes, previous=self._matchers.get(chat_id))
+        while len(self._entries) > self.max_chats:
+            evicted, _ = self._entries.popitem(last=False)
+            self._matchers.pop(evicted, None)
+            self.evictions += 1
+            if self.on_drop is not None:
+                self.on_drop(evicted)
+
+    async def match(self, chat_id: int, text: str, limit: int = 0) -> List[Trigger]:
+        """Возвращает триггеры чата, сработавшие на текст сообщения."""
+        triggers = await self.get(chat_id)
+        entry = self._entries.get(chat_id)
+        matcher = self._matchers.get(chat_id)
+        if matcher is None or entry is None or entry[1] is not triggers:
+            # Загрузка устарела до сохранения в кэш, и сохранённый поиск собран по другому
+            # набору ключей: собираем поиск без кэширования, переиспользуя неизменённые части
+            modes = {keyword: trigger.match_mode for keyword, trigger in triggers.items()}
+            matcher = TriggerMatcher(modes, previous=matcher)
+        return [triggers[keyword] for keyword in matcher.match(text, limit) if keyword in triggers]
+
+    async def warm(self, chat_ids: List[int]) -> int:
+        """
+        Загружает триггеры чатов одним запросом до первых сообщений.
+        Чаты, изменённые или уже загруженные за время запроса, не трогаются.
+        Возвращает число загруженных чатов.
+        """
+        chat_ids = chat_ids[:self.max_chats]
+        if not chat_ids:
+            return 0
+        generation = self._generation
+        self._begin(chat_ids)
+        try:
+            loaded = await self.db.fetch_triggers_many(chat_ids)
+            fresh = {chat_id for chat_id in loaded if self._fresh(chat_id, generation)}
+        finally:
+            self._end(chat_ids)
+        stored = 0
+        for chat_id, triggers in loaded.items():
+            if chat_id not in self._entries and chat_id in fresh:
+                self._store(chat_id, triggers)
+                stored += 1
+        return stored
+
+    def invalidate(self, chat_id: int) -> None:
+        """Сбрасывает кэш чата; следующий запрос загрузит его заново."""
+        self._generation += 1
+        if chat_id in self._inflight:
+            self._invalidated[chat_id] = self._generation
+        self._entries.pop(chat_id, None)
+        self.invalidations += 1
+        if self.on_drop is not None:
+            self.on_drop(chat_id)
+
+    async def refresh(self, chat_id: int) -> ChatTriggers:
+        """Перечитывает триггеры чата после изменения."""
+        self.invalidate(chat_id)
+        return await self._load(chat_id)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "chats": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    # -----------------------------
+    #   ИНВАЛИДАЦИЯ МЕЖДУ РЕПЛИКАМИ
+    # -----------------------------
+    def start_listener(self) -> None:
+        if self._listener is None:
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def stop_listener(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async for origin, chat_id in self.db.notifications(TRIGGER_CHANNEL):
+                    if origin != self.db.instance_id:
+                        self.invalidate(chat_id)
+                        logger.debug(f"Кэш триггеров чата {chat_id} сброшен репликой {origin}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка подписки на изменения триггеров: {e}")
+            # После обрыва соединения мы могли пропустить уведомления
+            if self.on_drop is not None:
+                for chat_id in self._entries:
+                    self.on_drop(chat_id)
+            self._entries.clear()
+            await asyncio.sleep(5)
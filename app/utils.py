@@ -1,10 +1,21 @@
 import json
-import random
 import os
 import logging
+import random
+
+from app.config import LOG_MESSAGE_SAMPLE_RATE
 
 logger = logging.getLogger(__name__)
 
+
+def log_message_sample(log: logging.Logger, msg: str, *args) -> None:
+    """
+    DEBUG-лог с текстом сообщения для доли LOG_MESSAGE_SAMPLE_RATE сообщений.
+    Строка форматируется logging лениво и только для попавших в выборку.
+    """
+    if LOG_MESSAGE_SAMPLE_RATE > 0 and log.isEnabledFor(logging.DEBUG) and random.random() < LOG_MESSAGE_SAMPLE_RATE:
+        log.debug(msg, *args)
+
 def get_message_type(message):
     """
     Определяет тип сообщения (например, текст, фото, видео и т.д.)
@@ -43,28 +54,29 @@ def get_message_content(message):
         return message.sticker.file_id
     return ""
 
-async def is_admin(bot, chat_id, user_id):
-    try:
-        member = await bot.get_chat_member(chat_id, user_id)
-        return member.status in ["administrator", "creator"]
-    except Exception as e:
-        logger.error(f"Ошибка проверки админки: {e}")
-        return False
+def get_message_file(message):
+    """
+    Файл сообщения как (file_id, file_unique_id) или None, если файла нет.
+    У фото берётся самый крупный размер.
+    """
+    if message.photo:
+        media = message.photo[-1]
+    else:
+        media = message.video or message.video_note or message.audio or message.document or message.sticker
+    if media is None:
+        return None
+    return media.file_id, media.file_unique_id
+
+def quotes_path(filepath="quotes.json"):
+    # Определяем базовый путь (относительно файла utils.py)
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base_path, "..", filepath)
 
 def load_quotes(filepath="quotes.json"):
     try:
-        # Определяем базовый путь (относительно файла utils.py)
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        full_path = os.path.join(base_path, "..", filepath)
-        with open(full_path, encoding="utf-8") as f:
+        with open(quotes_path(filepath), encoding="utf-8") as f:
             quotes = json.load(f)
         return quotes
     except Exception as e:
         logger.error(f"Ошибка загрузки цитат: {e}")
         return []
-
-def get_random_quote():
-    quotes = load_quotes()
-    if quotes:
-        return random.choice(quotes)
-    return "Нет доступных цитат."
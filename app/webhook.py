@@ -0,0 +1,193 @@
+import asyncio
+import hmac
+import json
+import logging
+from typing import Awaitable, Dict, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+from app.lifecycle import Lifecycle
+from app.metrics import UPDATES_TOTAL, update_type
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка апдейтов с сохранением порядка внутри чата.
+    Апдейт чата ждёт, пока не закончится предыдущий апдейт того же чата,
+    и только потом занимает одно из max_concurrent_updates мест выполнения,
+    поэтому выполняется не больше одного апдейта чата за раз.
+    Внешний семафор PTB (max_pending мест) держится и на время ожидания
+    своей очереди, так что ждущие апдейты шумного чата тоже занимают места.
+    Чтобы один чат не занял их все, webhook перед приёмом вызывает reserve:
+    у чата не больше max_pending_per_chat недоработанных апдейтов, лишние
+    получают 503. При long polling отказать нельзя, и это ограничение не действует.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending: int, max_pending_per_chat: int = 0):
+        super().__init__(max(max_pending, max_concurrent_updates))
+        self._running = asyncio.Semaphore(max_concurrent_updates)
+        self.max_pending_per_chat = max_pending_per_chat
+        # chat_id -> future, завершающийся вместе с последним апдейтом чата
+        self._tails: Dict[int, asyncio.Future] = {}
+        # chat_id -> апдейты чата, принятые через reserve и ещё не доработанные
+        self._reserved: Dict[int, int] = {}
+        self.in_flight = 0
+
+    def reserve(self, chat_id: int) -> bool:
+        """Учитывает принятый апдейт чата. False — у чата уже max_pending_per_chat апдейтов в очереди."""
+        count = self._reserved.get(chat_id, 0)
+        if self.max_pending_per_chat and count >= self.max_pending_per_chat:
+            return False
+        self._reserved[chat_id] = count + 1
+        return True
+
+    def _release(self, chat_id: int) -> None:
+        count = self._reserved.get(chat_id)
+        if count is None:
+            return
+        if count > 1:
+            self._reserved[chat_id] = count - 1
+        else:
+            del self._reserved[chat_id]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        UPDATES_TOTAL.inc(update_type(update))
+        self.in_flight += 1
+        try:
+            if chat is None:
+                async with self._running:
+                    await coroutine
+                return
+            previous = self._tails.get(chat.id)
+            done = asyncio.get_running_loop().create_future()
+            self._tails[chat.id] = done
+            try:
+                if previous is not None:
+                    await asyncio.wait((previous,))
+                async with self._running:
+                    await coroutine
+            finally:
+                done.set_result(None)
+                if self._tails.get(chat.id) is done:
+                    del self._tails[chat.id]
+                self._release(chat.id)
+        finally:
+            self.in_flight -= 1
+            # Апдейт мог быть отменён до запуска: закрываем корутину без предупреждения
+            if asyncio.iscoroutine(coroutine):
+                coroutine.close()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class WebhookServer:
+    """
+    HTTP-приём апдейтов от Telegram на aiohttp.
+    Запрос проверяется по секретному заголовку, апдейт кладётся в очередь
+    приложения, и ответ 200 уходит сразу, не дожидаясь обработки. Если в
+    работе уже max_pending апдейтов или у чата апдейта их уже
+    max_pending_per_chat процессора, отвечает 503: Telegram повторит
+    доставку позже, память не растёт, а шумный чат не отнимает места у остальных.
+    """
+
+    def __init__(self, application: Application, processor: ChatOrderedUpdateProcessor,
+                 path: str = "/telegram", secret_token: Optional[str] = None, max_pending: int = 1000,
+                 record_path: Optional[str] = None):
+        self.application = application
+        self.processor = processor
+        self.path = path
+        self.secret_token = secret_token
+        self.max_pending = max_pending
+        self.record_path = record_path
+        self._runner: Optional[web.AppRunner] = None
+        self.accepted = 0
+        self.rejected = 0
+        self.rejected_chat = 0
+        self.forbidden = 0
+        self.invalid = 0
+
+    def backlog(self) -> int:
+        """Апдейты, принятые, но ещё не обработанные."""
+        return self.application.update_queue.qsize() + self.processor.in_flight
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and not hmac.compare_digest(
+                request.headers.get(SECRET_HEADER, ""), self.secret_token):
+            self.forbidden += 1
+            return web.Response(status=403)
+        if self.backlog() >= self.max_pending:
+            self.rejected += 1
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        body = await request.read()
+        try:
+            data = json.loads(body)
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            self.invalid += 1
+            logger.warning(f"Некорректный апдейт в webhook: {e}")
+            return web.Response(status=400)
+        chat = update.effective_chat
+        if chat is not None and not self.processor.reserve(chat.id):
+            self.rejected_chat += 1
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        if self.record_path:
+            with open(self.record_path, "ab") as f:
+                f.write(body.strip() + b"\n")
+        self.application.update_queue.put_nowait(update)
+        self.accepted += 1
+        return web.Response(status=200)
+
+    async def start(self, host: str, port: int) -> None:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Webhook слушает http://{host}:{port}{self.path}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "rejected_chat": self.rejected_chat,
+            "forbidden": self.forbidden,
+            "invalid": self.invalid,
+            "backlog": self.backlog(),
+        }
+
+
+async def serve(lifecycle: Lifecycle, server: WebhookServer, host: str, port: int,
+                url: Optional[str] = None, allowed_updates=Update.ALL_TYPES) -> None:
+    """
+    Бот в режиме webhook: приём апдейтов — HTTP-сервер, остальной жизненный
+    цикл и порядок остановки задаёт Lifecycle. Если url задан, webhook
+    регистрируется в Telegram; без него сервер принимает только локально
+    отправленные апдейты.
+    """
+    async def start_intake() -> None:
+        await server.start(host, port)
+        if url:
+            await lifecycle.application.bot.set_webhook(url + server.path, secret_token=server.secret_token,
+                                                        allowed_updates=allowed_updates)
+
+    async def stop_intake() -> None:
+        await server.stop()
+        logger.info(f"Webhook: {server.stats()}")
+
+    await lifecycle.run(start_intake, stop_intake)
@@ -0,0 +1,78 @@
+"""
+Бенчмарк поиска триггеров: 10k триггеров в одном чате, сообщения разной длины.
+
+Запуск: python -m benchmarks.bench_matching
+"""
+import random
+import string
+import time
+
+from app.matching import MATCH_EXACT, MATCH_REGEX, MATCH_SUBSTRING, MATCH_WORD, TriggerMatcher
+
+TRIGGER_COUNT = 10_000
+MESSAGE_LENGTHS = (50, 200, 1000, 4000)
+ROUNDS = 200
+
+ALPHABET = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+
+
+def random_word(rng: random.Random, low: int = 3, high: int = 9) -> str:
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(low, high)))
+
+
+def build_modes(rng: random.Random) -> dict:
+    modes = {}
+    while len(modes) < TRIGGER_COUNT:
+        roll = rng.random()
+        if roll < 0.4:
+            modes[random_word(rng)] = MATCH_EXACT
+        elif roll < 0.7:
+            modes[random_word(rng)] = MATCH_WORD
+        elif roll < 0.99:
+            modes[random_word(rng, 4, 10)] = MATCH_SUBSTRING
+        else:
+            modes[rf"{random_word(rng, 2, 4)}\d+"] = MATCH_REGEX
+    return modes
+
+
+def build_message(rng: random.Random, length: int) -> str:
+    words = []
+    size = 0
+    while size < length:
+        word = random_word(rng) if rng.random() < 0.9 else rng.choice(string.digits) * 3
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length]
+
+
+def naive_match(modes: dict, text: str) -> int:
+    """Проверка каждого ключа против сообщения: O(триггеры × длина)."""
+    lowered = text.strip().lower()
+    return sum(1 for keyword, mode in modes.items() if mode != MATCH_REGEX and keyword in lowered)
+
+
+def main() -> None:
+    rng = random.Random(42)
+    modes = build_modes(rng)
+
+    started = time.perf_counter()
+    matcher = TriggerMatcher(modes)
+    matcher.match("прогрев")
+    print(f"Сборка поиска для {TRIGGER_COUNT} триггеров: {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    print(f"{'длина':>6} {'автомат, мкс':>13} {'мкс/символ':>11} {'наивно, мкс':>12}")
+    for length in MESSAGE_LENGTHS:
+        messages = [build_message(rng, length) for _ in range(ROUNDS)]
+        started = time.perf_counter()
+        for message in messages:
+            matcher.match(message)
+        automaton_us = (time.perf_counter() - started) / ROUNDS * 1e6
+        started = time.perf_counter()
+        for message in messages[:20]:
+            naive_match(modes, message)
+        naive_us = (time.perf_counter() - started) / 20 * 1e6
+        print(f"{length:>6} {automaton_us:>13.1f} {automaton_us / length:>11.3f} {naive_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Бенчмарк выдачи цитат: чтение quotes.json на каждый вызов против QuoteStore.
+
+Запуск: python -m benchmarks.bench_quotes
+"""
+import asyncio
+import random
+import time
+
+from app.quotes import QuoteStore
+from app.utils import load_quotes
+
+ROUNDS = 20_000
+
+
+def load_per_call() -> str:
+    """Прежний путь: открыть и разобрать файл на каждый запрос."""
+    quotes = load_quotes()
+    return random.choice(quotes)
+
+
+async def store_per_call(store: QuoteStore, chat_ids) -> None:
+    for chat_id in chat_ids:
+        await store.next_quote(chat_id)
+
+
+def main() -> None:
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        load_per_call()
+    per_call_us = (time.perf_counter() - started) / ROUNDS * 1e6
+
+    store = QuoteStore()
+    store.load()
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        store.random_quote()
+    random_us = (time.perf_counter() - started) / ROUNDS * 1e6
+
+    chat_ids = [random.randrange(100) for _ in range(ROUNDS)]
+    started = time.perf_counter()
+    asyncio.run(store_per_call(store, chat_ids))
+    deck_us = (time.perf_counter() - started) / ROUNDS * 1e6
+
+    print(f"Чтение файла на каждый вызов: {per_call_us:8.2f} мкс")
+    print(f"QuoteStore.random_quote:      {random_us:8.2f} мкс")
+    print(f"QuoteStore.next_quote (100 колод): {deck_us:8.2f} мкс")
+
+
+if __name__ == "__main__":
+    main()
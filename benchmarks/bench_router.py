@@ -0,0 +1,106 @@
+"""
+Бенчмарк диспетчеризации текстовых сообщений: прежний стек MessageHandler
+с отдельными filters.Regex против MessageRouter. Обработчики пустые, меряется
+только выбор обработчика.
+
+Запуск: python -m benchmarks.bench_router
+"""
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import MessageHandler, filters
+
+from app.router import MessageRouter
+
+ROUNDS = 50_000
+
+TEXTS = [
+    "привет всем", "как дела?", "кто идёт вечером", "ха-ха", "ну ты даёшь",
+    "книга братан", "болтун", "!list", "!help", "!add кот", "красавчик",
+    "сегодня жарко", "ок", "где встречаемся", "!bd 05.04.1998",
+]
+
+
+class NoopHandlers:
+    """Заглушки с именами методов BotHandlers."""
+
+    def __getattr__(self, name):
+        async def noop(update, context):
+            return None
+        noop.__name__ = name
+        return noop
+
+
+class StubContext:
+    """Минимальный контекст: Regex-фильтры складывают в него найденные совпадения."""
+
+    def update(self, data) -> None:
+        self.__dict__.update(data)
+
+
+def legacy_stack(handlers):
+    """Обработчики в том порядке, в каком их регистрировал прежний main.py."""
+    return [
+        MessageHandler(filters.TEXT & filters.Regex("(?i)^!add"), handlers.add_trigger),
+        MessageHandler(filters.TEXT & filters.Regex("(?i)^!del"), handlers.delete_trigger),
+        MessageHandler(filters.TEXT & filters.Regex("(?i)^!list$"), handlers.list_triggers),
+        MessageHandler(filters.TEXT & filters.Regex(r"(?i)^!bd\s+\d{2}\.\d{2}\.\d{4}"), handlers.handle_birthday_set),
+        MessageHandler(filters.TEXT & filters.Regex("(?i)^!help$"), handlers.help_command),
+        MessageHandler(filters.TEXT & (filters.Regex("(?i)^!talker$") | filters.Regex("(?i)^болтун$")),
+                       handlers.handle_talker_command),
+        MessageHandler(filters.TEXT & filters.Regex("(?i)^книга братан$"), handlers.handle_kniga_bratan),
+        MessageHandler(filters.TEXT & filters.Regex("(?i)^(кто красавчик сегодня|красавчик сегодня|красавчик)$"),
+                       handlers.handle_beauty_trigger),
+        MessageHandler(filters.TEXT & ~filters.Regex("(?i)^!"), handlers.handle_trigger_invocation),
+        MessageHandler(filters.TEXT & (filters.Regex("(?i)^!talker$") | filters.Regex("(?i)^болтун$")),
+                       handlers.handle_talker_command),
+        MessageHandler(filters.TEXT & ~filters.Regex("(?i)^!"), handlers.update_activity),
+    ]
+
+
+def make_update(update_id: int, text: str) -> Update:
+    chat = Chat(-100, Chat.SUPERGROUP)
+    user = User(update_id % 50 + 1, "user", False)
+    message = Message(update_id, datetime.now(timezone.utc), chat, from_user=user, text=text)
+    return Update(update_id, message=message)
+
+
+async def run_legacy(stack, updates) -> None:
+    # Как Application.process_update: в группе срабатывает первый подходящий обработчик
+    for update in updates:
+        for handler in stack:
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                await handler.handle_update(update, None, check, StubContext())
+                break
+
+
+async def run_router(router, updates) -> None:
+    for update in updates:
+        await router.route(update, None)
+
+
+def main() -> None:
+    rng = random.Random(1)
+    updates = [make_update(i, rng.choice(TEXTS)) for i in range(ROUNDS)]
+    handlers = NoopHandlers()
+
+    stack = legacy_stack(handlers)
+    started = time.perf_counter()
+    asyncio.run(run_legacy(stack, updates))
+    legacy_rate = ROUNDS / (time.perf_counter() - started)
+
+    router = MessageRouter(handlers)
+    started = time.perf_counter()
+    asyncio.run(run_router(router, updates))
+    router_rate = ROUNDS / (time.perf_counter() - started)
+
+    print(f"Стек MessageHandler: {legacy_rate:10.0f} сообщений/с")
+    print(f"MessageRouter:       {router_rate:10.0f} сообщений/с ({router_rate / legacy_rate:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Локальная замена Telegram Bot API для нагрузочных тестов: отвечает на вызовы
+бота правдоподобными объектами, считает вызовы по методам и может добавлять
+задержку, чтобы имитировать сеть.
+"""
+import asyncio
+import json
+import time
+from typing import Dict, Optional
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "loadtest", "username": "loadtest_bot",
+            "can_join_groups": True, "can_read_all_group_messages": True, "supports_inline_queries": False}
+# Сколько администраторов возвращает getChatAdministrators
+ADMINS_PER_CHAT = 5
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+
+class FakeTelegramAPI:
+    """aiohttp-сервер, принимающий запросы вида POST /bot<token>/<method>."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self._message_id = 0
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = {key: _decode(value) for key, value in (await request.post()).items()}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getChatAdministrators":
+            return [{"status": "creator", "user": _user(user_id), "is_anonymous": False}
+                    for user_id in range(1, ADMINS_PER_CHAT + 1)]
+        if method == "getChatMember":
+            return {"status": "member", "user": _user(int(params.get("user_id", 0)))}
+        if method == "sendMediaGroup":
+            # Альбом — отдельное сообщение на каждый файл, как в Bot API
+            chat_id = int(params.get("chat_id", 0))
+            media = params.get("media")
+            return [self._message(chat_id, "") for _ in (media if isinstance(media, list) else [media])]
+        if method.startswith("send"):
+            return self._message(int(params.get("chat_id", 0)), str(params.get("text", "")))
+        return True
+
+    def _message(self, chat_id: int, text: str) -> dict:
+        self._message_id += 1
+        return {"message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+                "from": BOT_USER, "text": text}
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+def _decode(value):
+    # PTB передаёт параметры формой, сложные значения — JSON-строками
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
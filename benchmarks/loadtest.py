@@ -0,0 +1,317 @@
+"""
+Нагрузочный тест обработчиков без реального Telegram: BotHandlers получают
+синтетические или записанные апдейты, отвечают в локальную замену Bot API
+(benchmarks.fake_telegram), данные лежат в локальном PostgreSQL.
+
+Сценарии:
+  busy_chat       — один шумный чат: текст, триггеры, !talker, !top, цитаты, красавчик
+  triggers_10k    — чат с 10 000 триггеров, холодная загрузка и поиск по каждому сообщению
+  birthday_burst  — полуночная волна поздравлений в тысячах чатов
+  replay          — апдейты из файла (--updates, по одному JSON апдейта на строку)
+
+Результат — JSON на сценарий: p50/p99 задержки, сообщений в секунду, запросов
+к БД и вызовов API на сообщение; с --output строки дописываются в файл для
+сравнения между прогонами.
+
+Запуск: LOADTEST_DATABASE_URL=postgresql://... python -m benchmarks.loadtest [сценарии] [--output results.ndjson]
+Тест пишет в БД чаты из отдельного диапазона id и удаляет их за собой;
+используйте отдельную базу, не рабочую.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List
+
+from telegram import Bot, Update
+
+from app.config import DEFAULT_TIMEZONE
+from app.database import Database
+from app.handlers import BotHandlers
+from app.metrics import DB_QUERY_SECONDS, HANDLER_SECONDS, REGISTRY, InstrumentedRequest, instrument_handlers
+from app.router import MessageRouter
+from app.sender import SendScheduler
+from benchmarks.fake_telegram import FakeTelegramAPI
+
+TOKEN = "1:loadtest"
+# Диапазон id чатов теста: не пересекается с настоящими чатами
+CHAT_BASE = -8_000_000_000_000
+CHAT_RANGE = 1_000_000
+ACTIVITY_TABLES = ("activity", "activity_weekly", "activity_monthly", "activity_streaks")
+SEEDED_TABLES = ("triggers", "birthdays", "quotes", "beauty_winners", "chat_settings") + ACTIVITY_TABLES
+
+WORDS = ("привет", "как", "дела", "кто", "идёт", "вечером", "ну", "да", "нет", "ок", "кот", "пиво",
+         "работа", "завтра", "сегодня", "смешно", "ахах", "где", "когда", "почему")
+
+
+def make_update(update_id: int, chat_id: int, user_id: int, text: str, bot: Bot) -> Update:
+    data = {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "loadtest"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"},
+            "text": text,
+        },
+    }
+    return Update.de_json(data, bot)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+class LoadTest:
+    def __init__(self, db: Database, bot: Bot, api: FakeTelegramAPI, send_rate: float, seed: int):
+        self.db = db
+        self.bot = bot
+        self.api = api
+        self.send_rate = send_rate
+        self.rng = random.Random(seed)
+
+    def make_handlers(self):
+        """Свежие обработчики на сценарий; лимиты отправки подняты, чтобы мерить бота, а не ограничитель."""
+        for metric in REGISTRY.metrics.values():
+            if hasattr(metric, "values") and isinstance(metric.values, dict):
+                metric.values.clear()
+        handlers = BotHandlers(self.db)
+        handlers.sender = SendScheduler(global_rate=self.send_rate, group_per_minute=self.send_rate * 60,
+                                        private_per_second=self.send_rate)
+        instrument_handlers(handlers)
+        return handlers, MessageRouter(handlers), SimpleNamespace(bot=self.bot)
+
+    async def cleanup(self) -> None:
+        async with self.db.connection() as conn:
+            for table in SEEDED_TABLES:
+                await conn.execute(f"DELETE FROM {table} WHERE chat_id BETWEEN %s AND %s",
+                                   (CHAT_BASE - CHAT_RANGE, CHAT_BASE))
+
+    async def seed_triggers(self, chat_id: int, count: int) -> List[str]:
+        keywords = [f"триггер{i}" for i in range(count)]
+        modes = [self.rng.choices(("exact", "word", "substring"), (70, 20, 10))[0] for _ in keywords]
+        async with self.db.connection() as conn:
+            await conn.execute(
+                "INSERT INTO triggers (chat_id, keyword, match_mode) "
+                "SELECT %s, k, m FROM unnest(%s::text[], %s::text[]) AS t(k, m)",
+                (chat_id, keywords, modes)
+            )
+            await conn.execute(
+                "INSERT INTO trigger_responses (trigger_id, type, content, added_by) "
+                "SELECT id, 'text', 'ответ на ' || keyword, 'loadtest' FROM triggers WHERE chat_id = %s",
+                (chat_id,)
+            )
+        return keywords
+
+    async def drive(self, handlers, router, context, updates: List[Update]) -> Dict[str, float]:
+        """Прогоняет апдейты по порядку, как их обрабатывает один чат, и снимает метрики."""
+        queries_before = DB_QUERY_SECONDS.total_count()
+        calls_before = self.api.total_calls()
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        for update in updates:
+            t0 = time.perf_counter()
+            try:
+                await handlers.track_user(update, context)
+                await router.route(update, context)
+            except Exception:
+                # В боте ошибку ловит PTB; здесь она только считается
+                errors += 1
+            latencies.append(time.perf_counter() - t0)
+        await handlers.activity.flush()
+        elapsed = time.perf_counter() - started
+        count = len(updates)
+        return {
+            "messages": count,
+            "seconds": round(elapsed, 3),
+            "msgs_per_sec": round(count / elapsed, 1) if elapsed else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 3),
+                "p99": round(percentile(latencies, 0.99) * 1000, 3),
+                "max": round(max(latencies, default=0.0) * 1000, 3),
+            },
+            "db_queries_per_message": round((DB_QUERY_SECONDS.total_count() - queries_before) / count, 3),
+            "api_calls_per_message": round((self.api.total_calls() - calls_before) / count, 3),
+            "errors": errors,
+            "handlers": self.handler_stats(),
+        }
+
+    @staticmethod
+    def handler_stats() -> Dict[str, Dict[str, float]]:
+        # Квантили по корзинам гистограммы: верхняя граница корзины
+        return {
+            name: {
+                "count": HANDLER_SECONDS.count(name),
+                "p50_ms_le": HANDLER_SECONDS.quantile(0.50, name) * 1000,
+                "p99_ms_le": HANDLER_SECONDS.quantile(0.99, name) * 1000,
+            }
+            for (name,) in HANDLER_SECONDS.values
+        }
+
+    # -----------------------------
+    #   СЦЕНАРИИ
+    # -----------------------------
+    async def busy_chat(self, messages: int) -> Dict[str, float]:
+        handlers, router, context = self.make_handlers()
+        chat_id = CHAT_BASE
+        keywords = await self.seed_triggers(chat_id, 100)
+        commands = ["!talker", "!top 10", "!talker неделя", "книга братан", "красавчик", "!streak", "!list"]
+        updates = []
+        for i in range(messages):
+            roll = self.rng.random()
+            if roll < 0.05:
+                text = self.rng.choice(keywords)
+            elif roll < 0.08:
+                text = self.rng.choice(commands)
+            else:
+                text = " ".join(self.rng.choices(WORDS, k=self.rng.randint(1, 12)))
+            updates.append(make_update(i + 1, chat_id, 1000 + self.rng.randrange(200), text, self.bot))
+        return await self.drive(handlers, router, context, updates)
+
+    async def triggers_10k(self, messages: int) -> Dict[str, float]:
+        handlers, router, context = self.make_handlers()
+        chat_id = CHAT_BASE - 1
+        keywords = await self.seed_triggers(chat_id, 10_000)
+        started = time.perf_counter()
+        await handlers.triggers.get(chat_id)
+        cold_load_ms = (time.perf_counter() - started) * 1000
+        updates = []
+        for i in range(messages):
+            words = self.rng.choices(WORDS, k=self.rng.randint(3, 20))
+            if self.rng.random() < 0.1:
+                words.insert(self.rng.randrange(len(words) + 1), self.rng.choice(keywords))
+            updates.append(make_update(i + 1, chat_id, 1000 + self.rng.randrange(50), " ".join(words), self.bot))
+        result = await self.drive(handlers, router, context, updates)
+        result["cold_load_ms"] = round(cold_load_ms, 3)
+        return result
+
+    async def birthday_burst(self, chats: int) -> Dict[str, float]:
+        handlers, _, _ = self.make_handlers()
+        today = datetime.now(timezone.utc).date()
+        birthday = date(1992, today.month, today.day)
+        async with self.db.connection() as conn:
+            await conn.execute(
+                "INSERT INTO birthdays (chat_id, user_id, username, birthday) "
+                "SELECT %s - n, 1000 + n, 'user' || n, %s FROM generate_series(2, %s + 1) AS n",
+                (CHAT_BASE, birthday, chats)
+            )
+        queries_before = DB_QUERY_SECONDS.total_count()
+        calls_before = self.api.total_calls()
+        started = time.perf_counter()
+        await handlers._greet_birthdays(self.bot, today, DEFAULT_TIMEZONE)
+        elapsed = time.perf_counter() - started
+        sender = handlers.sender.stats()
+        sent = sender["sent"]
+        return {
+            "messages": sent,
+            "seconds": round(elapsed, 3),
+            "msgs_per_sec": round(sent / elapsed, 1) if elapsed else 0.0,
+            # Задержка поздравления: от постановки в очередь до ответа API
+            "latency_ms": {"avg": round(sender["latency_avg_ms"], 3), "max": round(sender["latency_max_ms"], 3)},
+            "db_queries_per_message": round((DB_QUERY_SECONDS.total_count() - queries_before) / max(sent, 1), 4),
+            "api_calls_per_message": round((self.api.total_calls() - calls_before) / max(sent, 1), 3),
+            "failed": sender["failed"],
+        }
+
+    async def replay(self, path: str) -> Dict[str, float]:
+        handlers, router, context = self.make_handlers()
+        updates = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    data = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(data, dict) and "update_id" in data:
+                    updates.append(Update.de_json(data, self.bot))
+        if not updates:
+            raise SystemExit(f"В {path} нет апдейтов (строк с update_id)")
+        return await self.drive(handlers, router, context, updates)
+
+
+async def run(args) -> List[dict]:
+    api = FakeTelegramAPI(latency=args.api_latency / 1000)
+    await api.start()
+    db = Database(args.dsn, min_size=1, max_size=10)
+    await db.wait_until_ready(timeout=10)
+    await db.open()
+    await db.migrate()
+    bot = Bot(TOKEN, base_url=api.base_url, request=InstrumentedRequest(connection_pool_size=256))
+    await bot.initialize()
+    test = LoadTest(db, bot, api, send_rate=args.send_rate, seed=args.seed)
+    results = []
+    try:
+        for scenario in args.scenarios:
+            await test.cleanup()
+            if scenario == "busy_chat":
+                result = await test.busy_chat(args.messages)
+            elif scenario == "triggers_10k":
+                result = await test.triggers_10k(args.messages)
+            elif scenario == "birthday_burst":
+                result = await test.birthday_burst(args.chats)
+            else:
+                result = await test.replay(args.updates)
+            results.append({
+                "scenario": scenario,
+                "revision": git_revision(),
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "api_latency_ms": args.api_latency,
+                **result,
+            })
+    finally:
+        await test.cleanup()
+        await bot.shutdown()
+        await db.close()
+        await api.stop()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест BotHandlers с локальным Bot API")
+    parser.add_argument("scenarios", nargs="*", default=["busy_chat", "triggers_10k", "birthday_burst"],
+                        choices=["busy_chat", "triggers_10k", "birthday_burst", "replay"])
+    parser.add_argument("--dsn", default=os.getenv("LOADTEST_DATABASE_URL"),
+                        help="PostgreSQL для теста (по умолчанию LOADTEST_DATABASE_URL)")
+    parser.add_argument("--messages", type=int, default=5000, help="сообщений в busy_chat и triggers_10k")
+    parser.add_argument("--chats", type=int, default=5000, help="чатов с именинниками в birthday_burst")
+    parser.add_argument("--updates", help="файл апдейтов для replay")
+    parser.add_argument("--api-latency", type=float, default=5.0, help="задержка локального Bot API, мс")
+    parser.add_argument("--send-rate", type=float, default=10_000.0, help="лимит отправки в секунду")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="дописать результаты в файл, по строке JSON на сценарий")
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("нужен --dsn или LOADTEST_DATABASE_URL")
+    if "replay" in args.scenarios and not args.updates:
+        parser.error("для replay нужен --updates")
+
+    results = asyncio.run(run(args))
+    for result in results:
+        line = json.dumps(result, ensure_ascii=False)
+        print(line)
+        if args.output:
+            with open(args.output, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Проверка остановки под нагрузкой: бот на Lifecycle получает поток сообщений
+в несколько чатов, посреди потока процессу приходит настоящий SIGTERM, и после
+остановки сверяется, что ничего не потеряно:
+  - каждое принятое сообщение учтено в активности в БД;
+  - каждый ответ триггера либо дошёл до Bot API, либо учтён как отброшенный
+    по таймауту досылки;
+  - позиции round-robin в БД совпадают с числом срабатываний.
+
+Сценарии:
+  sigterm  — БД доступна, буферы сбрасываются при остановке
+  db_down  — к моменту сброса пул уже закрыт: буферы уходят в файл состояния,
+             второй запуск возвращает их и дописывает в БД
+
+Запуск: LOADTEST_DATABASE_URL=postgresql://... python -m benchmarks.shutdown [сценарии]
+Код выхода 1, если что-то потеряно. Чаты теста — из диапазона benchmarks.loadtest,
+используйте отдельную базу, не рабочую.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import Application, MessageHandler, TypeHandler, filters
+
+from app.database import Database
+from app.flood import FloodLimits
+from app.handlers import BotHandlers
+from app.lifecycle import Lifecycle, PendingState
+from app.router import MessageRouter
+from app.sender import SendScheduler
+from app.webhook import ChatOrderedUpdateProcessor
+from benchmarks.fake_telegram import FakeTelegramAPI
+from benchmarks.loadtest import CHAT_BASE, CHAT_RANGE, SEEDED_TABLES, TOKEN, WORDS, make_update
+
+# Триггеры каждого тестового чата: ответы по очереди и все ответы сразу
+ROUND_ROBIN_KEY = "по кругу"
+ALL_KEY = "хором"
+RESPONSES = 3
+
+
+class ShutdownTest:
+    def __init__(self, dsn: str, api: FakeTelegramAPI, args):
+        self.dsn = dsn
+        self.api = api
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.chat_ids = [CHAT_BASE - i for i in range(args.chats)]
+
+    async def open_db(self) -> Database:
+        db = Database(self.dsn, min_size=1, max_size=10)
+        await db.wait_until_ready(timeout=10)
+        await db.open()
+        await db.migrate()
+        return db
+
+    @staticmethod
+    async def cleanup(db: Database) -> None:
+        async with db.connection() as conn:
+            for table in SEEDED_TABLES:
+                await conn.execute(f"DELETE FROM {table} WHERE chat_id BETWEEN %s AND %s",
+                                   (CHAT_BASE - CHAT_RANGE, CHAT_BASE))
+
+    async def prepare(self, db: Database) -> None:
+        await self.cleanup(db)
+        for chat_id in self.chat_ids:
+            for i in range(RESPONSES):
+                await db.add_trigger_response(chat_id, ROUND_ROBIN_KEY, "text", f"по кругу {i}", "shutdown")
+                await db.add_trigger_response(chat_id, ALL_KEY, "text", f"хором {i}", "shutdown")
+            await db.set_response_mode(chat_id, ROUND_ROBIN_KEY, "round_robin")
+            # Антифлуд выключен: проверяется остановка, а не ограничения
+            await db.set_flood_limits(chat_id, FloodLimits(60, 0, 0, 0))
+
+    def messages(self) -> List[tuple]:
+        texts = [ROUND_ROBIN_KEY, ALL_KEY] + [" ".join(self.rng.choices(WORDS, k=3)) for _ in range(8)]
+        return [(self.rng.choice(self.chat_ids), self.rng.randint(1, 50), self.rng.choice(texts))
+                for _ in range(self.args.messages)]
+
+    async def run_bot(self, db: Database, state_path: str, messages: List[tuple],
+                      break_db: bool = False) -> Dict[str, object]:
+        """
+        Один запуск бота до SIGTERM. messages подаются в очередь апдейтов
+        с частотой --rate; пустой список — запуск только для восстановления
+        состояния. break_db закрывает пул до сброса буферов.
+        """
+        handlers = BotHandlers(db)
+        handlers.sender = SendScheduler(global_rate=self.args.send_rate, group_per_minute=self.args.send_rate * 60,
+                                        private_per_second=self.args.send_rate)
+        processor = ChatOrderedUpdateProcessor(64, max_pending=1000)
+        pending_state = PendingState(state_path, {
+            "activity": handlers.activity,
+            "media": handlers.media,
+            "round_robin": handlers.responses,
+        })
+        replies: Dict[str, int] = {"expected": 0}
+        round_robin: Dict[int, int] = {}
+        pick = handlers.responses.pick
+
+        def counting_pick(chat_id, trigger):
+            responses = pick(chat_id, trigger)
+            replies["expected"] += len(responses)
+            if trigger.keyword == ROUND_ROBIN_KEY:
+                round_robin[chat_id] = round_robin.get(chat_id, 0) + 1
+            return responses
+
+        handlers.responses.pick = counting_pick
+
+        async def on_startup(application: Application) -> None:
+            pending_state.restore()
+
+        async def on_shutdown(application: Application) -> None:
+            if break_db:
+                await db.close()
+            with lifecycle.step("сброс буферов в БД"):
+                await handlers.activity.flush()
+                await handlers.media.flush()
+                await handlers.responses.flush()
+            with lifecycle.step("файл состояния"):
+                pending_state.save()
+
+        application = (
+            Application.builder().token(TOKEN).base_url(self.api.base_url).updater(None)
+            .concurrent_updates(processor).post_init(on_startup).post_shutdown(on_shutdown).build()
+        )
+        router = MessageRouter(handlers)
+        application.add_handler(TypeHandler(Update, handlers.track_user), group=-1)
+        application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT, router.route))
+        lifecycle = Lifecycle(application, handlers.sender, drain_timeout=self.args.drain_timeout)
+
+        accepted: List[tuple] = []
+        feeder: Optional[asyncio.Task] = None
+
+        async def feed() -> None:
+            for update_id, (chat_id, user_id, text) in enumerate(messages, start=1):
+                await application.update_queue.put(make_update(update_id, chat_id, user_id, text, application.bot))
+                accepted.append((chat_id, user_id, text))
+                await asyncio.sleep(1 / self.args.rate)
+
+        async def start_intake() -> None:
+            nonlocal feeder
+            feeder = asyncio.ensure_future(feed())
+            # SIGTERM посреди потока, как при деплое
+            delay = self.args.kill_after if messages else 0.1
+            asyncio.get_running_loop().call_later(delay, os.kill, os.getpid(), signal.SIGTERM)
+
+        async def stop_intake() -> None:
+            feeder.cancel()
+            await asyncio.gather(feeder, return_exceptions=True)
+
+        sends_before = self.api.calls.get("sendMessage", 0)
+        await lifecycle.run(start_intake, stop_intake)
+        return {
+            "accepted": len(accepted),
+            "replies_expected": replies["expected"],
+            "api_sends": self.api.calls.get("sendMessage", 0) - sends_before,
+            "round_robin_fires": round_robin,
+            "sender": handlers.sender.stats(),
+            "state_file_left": os.path.exists(state_path),
+            "steps": {name: round(seconds * 1000, 1) for name, seconds, _ in lifecycle.steps},
+            "step_errors": [name for name, _, error in lifecycle.steps if error],
+        }
+
+    async def check(self, db: Database, runs: List[Dict[str, object]]) -> Dict[str, object]:
+        """Сверяет БД и Bot API с тем, что бот принял в запусках runs."""
+        accepted = sum(run["accepted"] for run in runs)
+        replies = sum(run["replies_expected"] for run in runs)
+        sent = sum(run["sender"]["sent"] for run in runs)
+        dropped = sum(run["sender"]["dropped"] for run in runs)
+        failed = sum(run["sender"]["failed"] for run in runs)
+        api_sends = sum(run["api_sends"] for run in runs)
+        fires: Dict[int, int] = {}
+        for run in runs:
+            for chat_id, count in run["round_robin_fires"].items():
+                fires[chat_id] = fires.get(chat_id, 0) + count
+        async with db.connection() as conn:
+            cur = await conn.execute(
+                "SELECT COALESCE(sum(message_count), 0) FROM activity WHERE chat_id BETWEEN %s AND %s",
+                (CHAT_BASE - CHAT_RANGE, CHAT_BASE)
+            )
+            recorded = (await cur.fetchone())[0]
+            cur = await conn.execute(
+                "SELECT chat_id, rr_cursor FROM triggers WHERE chat_id BETWEEN %s AND %s AND keyword = %s",
+                (CHAT_BASE - CHAT_RANGE, CHAT_BASE, ROUND_ROBIN_KEY)
+            )
+            cursors = dict(await cur.fetchall())
+        wrong_cursors = [chat_id for chat_id in self.chat_ids
+                         if cursors.get(chat_id, 0) != fires.get(chat_id, 0) % RESPONSES]
+        lost = {
+            "activity": accepted - recorded,
+            # Каждый ответ либо отправлен, либо завершился ошибкой, либо отброшен по таймауту
+            "replies": replies - sent - failed - dropped,
+            # Прерванный на лету вызов мог дойти до API, поэтому допускается до dropped лишних
+            "api": 0 if sent <= api_sends <= sent + dropped else api_sends - sent,
+            "round_robin": len(wrong_cursors),
+        }
+        return {
+            "accepted": accepted,
+            "activity_recorded": recorded,
+            "replies_expected": replies,
+            "sent": sent,
+            "dropped": dropped,
+            "lost": lost,
+            "ok": not any(lost.values()),
+            "runs": runs,
+        }
+
+    async def sigterm(self, state_path: str) -> Dict[str, object]:
+        db = await self.open_db()
+        try:
+            await self.prepare(db)
+            run = await self.run_bot(db, state_path, self.messages())
+            return await self.check(db, [run])
+        finally:
+            await db.close()
+
+    async def db_down(self, state_path: str) -> Dict[str, object]:
+        db = await self.open_db()
+        await self.prepare(db)
+        # Пул закрывается внутри запуска, до сброса буферов
+        first = await self.run_bot(db, state_path, self.messages(), break_db=True)
+        db = await self.open_db()
+        try:
+            second = await self.run_bot(db, state_path, [])
+            result = await self.check(db, [first, second])
+            result["state_file_written"] = first["state_file_left"]
+            result["ok"] = result["ok"] and first["state_file_left"] and not second["state_file_left"]
+            return result
+        finally:
+            await db.close()
+
+
+async def run(args) -> List[dict]:
+    api = FakeTelegramAPI(latency=args.api_latency / 1000)
+    await api.start()
+    test = ShutdownTest(args.dsn, api, args)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for scenario in args.scenarios:
+                state_path = os.path.join(tmp, f"{scenario}.json")
+                result = await (test.sigterm(state_path) if scenario == "sigterm" else test.db_down(state_path))
+                results.append({"scenario": scenario, **result})
+    finally:
+        db = await test.open_db()
+        try:
+            await test.cleanup(db)
+        finally:
+            await db.close()
+        await api.stop()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Проверка остановки бота по SIGTERM под нагрузкой")
+    parser.add_argument("scenarios", nargs="*", default=["sigterm", "db_down"], choices=["sigterm", "db_down"])
+    parser.add_argument("--dsn", default=os.getenv("LOADTEST_DATABASE_URL"),
+                        help="PostgreSQL для теста (по умолчанию LOADTEST_DATABASE_URL)")
+    parser.add_argument("--messages", type=int, default=5000, help="сообщений в потоке")
+    parser.add_argument("--chats", type=int, default=20, help="тестовых чатов")
+    parser.add_argument("--rate", type=float, default=2000.0, help="сообщений в секунду на входе")
+    parser.add_argument("--kill-after", type=float, default=1.0, help="через сколько секунд прислать SIGTERM")
+    parser.add_argument("--drain-timeout", type=float, default=5.0, help="таймаут досылки при остановке, с")
+    parser.add_argument("--api-latency", type=float, default=5.0, help="задержка локального Bot API, мс")
+    parser.add_argument("--send-rate", type=float, default=10_000.0, help="лимит отправки в секунду")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("нужен --dsn или LOADTEST_DATABASE_URL")
+
+    results = asyncio.run(run(args))
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False))
+    sys.exit(0 if all(result["ok"] for result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import asyncio
+
+from app.flood import FloodGuard, FloodLimits
+
+
+class SlowDb:
+    def __init__(self):
+        self.queries = 0
+
+    async def get_flood_limits(self, chat_id):
+        self.queries += 1
+        await asyncio.sleep(0.01)
+        return (600, 5, 2, 0)
+
+
+def test_concurrent_misses_share_one_query():
+    async def scenario():
+        db = SlowDb()
+        guard = FloodGuard(db)
+        results = await asyncio.gather(*(guard.limits(1) for _ in range(10)))
+        return db.queries, results
+
+    queries, results = asyncio.run(scenario())
+    assert queries == 1
+    assert all(limits == FloodLimits(600, 5, 2, 0) for limits in results)
+
+
+def test_window_outlives_evicted_limits():
+    guard = FloodGuard(db=None, max_chats=1)
+    limits = FloodLimits(window=600, chat_limit=0, user_limit=2, cooldown=0)
+    guard._store_limits(1, limits)
+    assert guard.blocked(1, 7, limits, now=1000.0) is None
+    assert guard.admit(1, 7, "кот", 1, limits, now=1000.0)
+    assert guard.admit(1, 7, "пёс", 1, limits, now=1001.0)
+    # Ограничения чата вытеснены другим чатом, а колесо проверяет окно раньше срока
+    # (600 * 2 больше оборота колеса): окно всё равно живёт по своей длине
+    guard._store_limits(2, FloodLimits())
+    assert guard.blocked(1, 7, limits, now=1600.0) == "user"
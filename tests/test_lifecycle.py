@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+from app.lifecycle import Lifecycle, PendingState
+
+
+class Buffer:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+
+    def snapshot(self):
+        return list(self.rows)
+
+    def restore(self, rows):
+        self.rows.extend(rows)
+
+
+def test_restore_keeps_file_until_flushed(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text(json.dumps({"activity": [[1, 2]]}), encoding="utf-8")
+    buffer = Buffer()
+    state = PendingState(str(path), {"activity": buffer})
+    assert state.restore() == 1
+    assert buffer.rows == [[1, 2]]
+    assert path.exists()
+    # Сброс не удался: строки остались в буфере и снова пишутся в файл
+    assert state.save() == 1
+    assert json.loads(path.read_text(encoding="utf-8")) == {"activity": [[1, 2]]}
+    buffer.rows.clear()
+    assert state.save() == 0
+    assert not path.exists()
+
+
+def test_save_merges_file_that_was_never_restored(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text(json.dumps({"activity": [[1, 2]]}), encoding="utf-8")
+    # Запуск оборвался до restore(): остановка не должна затереть файл
+    state = PendingState(str(path), {"activity": Buffer([[3, 4]])})
+    assert state.save() == 2
+    assert sorted(json.loads(path.read_text(encoding="utf-8"))["activity"]) == [[1, 2], [3, 4]]
+
+
+def test_unreadable_file_moved_aside(tmp_path):
+    path = tmp_path / "state.json"
+    path.write_text("{", encoding="utf-8")
+    state = PendingState(str(path), {"activity": Buffer()})
+    assert state.restore() == 0
+    assert (tmp_path / "state.json.bad").exists()
+    assert state.save() == 0
+
+
+class Sender:
+    def __init__(self, events):
+        self.events = events
+        self.dropped = 0
+
+    async def close(self):
+        self.events.append("sender.close")
+        self.dropped += 3
+
+
+class App:
+    def __init__(self, events, stop_delay):
+        self.events = events
+        self.stop_delay = stop_delay
+        self.running = True
+        self.post_shutdown = self._post_shutdown
+
+    async def stop(self):
+        self.events.append("app.stop")
+        await asyncio.sleep(self.stop_delay)
+        self.events.append("app.stopped")
+        self.running = False
+
+    async def shutdown(self):
+        self.events.append("app.shutdown")
+
+    async def _post_shutdown(self, application):
+        self.events.append("post_shutdown")
+
+
+def run_stop(stop_delay, drain_timeout):
+    events = []
+
+    async def stop_intake():
+        events.append("intake.stop")
+
+    lifecycle = Lifecycle(App(events, stop_delay), Sender(events), drain_timeout=drain_timeout)
+    asyncio.run(lifecycle.stop(stop_intake))
+    return events, lifecycle
+
+
+def test_stop_order_when_drained_in_time():
+    events, lifecycle = run_stop(stop_delay=0.01, drain_timeout=1.0)
+    assert events == ["intake.stop", "app.stop", "app.stopped", "sender.close",
+                      "app.shutdown", "post_shutdown"]
+    assert not any(error for _, _, error in lifecycle.steps)
+
+
+def test_send_queue_closed_after_drain_timeout():
+    events, lifecycle = run_stop(stop_delay=0.2, drain_timeout=0.01)
+    # Очередь отправки закрывается, не дожидаясь PTB, а закрытие PTB идёт после его остановки
+    assert events.index("sender.close") < events.index("app.stopped") < events.index("app.shutdown")
+    assert lifecycle.dropped == 3
+
+
+def test_failed_step_does_not_stop_shutdown():
+    events = []
+
+    async def stop_intake():
+        raise RuntimeError("webhook не остановился")
+
+    lifecycle = Lifecycle(App(events, 0), Sender(events), drain_timeout=1.0)
+    asyncio.run(lifecycle.stop(stop_intake))
+    assert events[-1] == "post_shutdown"
+    assert [name for name, _, error in lifecycle.steps if error] == ["приём апдейтов"]
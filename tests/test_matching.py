@@ -0,0 +1,25 @@
+from app.matching import MATCH_EXACT, MATCH_REGEX, MATCH_SUBSTRING, TriggerMatcher, validate_pattern
+
+
+def test_global_flags_rejected():
+    assert validate_pattern("(?i)кот") is not None
+    assert validate_pattern("(?x) кот") is not None
+    assert validate_pattern(r"\(?i\)кот") is None
+    assert validate_pattern("(?i:кот)") is None
+
+
+def test_group_references_rejected():
+    assert validate_pattern(r"(а)\1") is not None
+    assert validate_pattern(r"\\1") is None
+
+
+def test_saved_global_flag_does_not_break_chat():
+    matcher = TriggerMatcher({"(?i)кот": MATCH_REGEX, "привет": MATCH_EXACT, "пёс": MATCH_SUBSTRING})
+    assert matcher.match("привет") == ["привет"]
+    assert matcher.match("рыжий пёс") == ["пёс"]
+    assert matcher.match("кот") == []
+
+
+def test_regex_and_substring_order():
+    matcher = TriggerMatcher({"к[оа]т": MATCH_REGEX, "пёс": MATCH_SUBSTRING})
+    assert matcher.match("пёс и кат") == ["пёс", "к[оа]т"]
@@ -0,0 +1,45 @@
+import asyncio
+
+from app.triggers import TriggerCache
+
+
+class GatedDb:
+    """fetch_triggers отдаёт номер запроса и ждёт, пока тест не откроет gate."""
+
+    def __init__(self):
+        self.calls = 0
+        self.gate = None
+
+    async def fetch_triggers(self, chat_id):
+        self.calls += 1
+        call = self.calls
+        if self.gate is not None:
+            await self.gate.wait()
+        return {"load": call}
+
+
+def test_stale_load_not_cached_after_eviction():
+    async def scenario():
+        db = GatedDb()
+        cache = TriggerCache(db, max_chats=1)
+        db.gate = asyncio.Event()
+        stale = asyncio.ensure_future(cache.get(1))
+        await asyncio.sleep(0)
+        # Чат вытеснен другим чатом и несколько раз изменён, пока шла первая загрузка
+        cache._store(2, {})
+        for _ in range(3):
+            cache.invalidate(1)
+        db.gate.set()
+        await stale
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert 1 not in cache._entries
+    assert not cache._invalidated and not cache._inflight
+
+
+def test_notifications_for_uncached_chats_leave_no_state():
+    cache = TriggerCache(GatedDb())
+    for chat_id in range(1000):
+        cache.invalidate(chat_id)
+    assert not cache._invalidated and not cache._inflight